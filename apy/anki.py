@@ -1,40 +1,73 @@
 """An Anki collection wrapper class."""
+import copy
 import os
 import re
 import tempfile
+from contextlib import contextmanager
 from pathlib import Path
 
 import click
 import anki
+from anki.utils import ids2str, intTime, splitFields, joinFields
+from anki.utils import stripHTMLMedia, fieldChecksum
 from anki.sync import Syncer, RemoteServer
 from aqt.profiles import ProfileManager
 
+from apy import trace
+from apy.batch import Batch
+from apy.cache import QueryCache, is_time_dependent
+from apy.cache import load_snapshot, save_snapshot
 from apy.config import cfg
-from apy.note import Note
+from apy.lock import CollectionLock, backoff, copy_snapshot
+from apy.note import Note, NoteView
+from apy.search import SearchIndex
 from apy.convert import html_to_screen
 from apy.convert import markdown_file_to_notes
 from apy.convert import markdown_to_html, plain_to_html
-from apy.utilities import editor, choose, cd
+from apy.convert import with_highlight_css
+from apy.utilities import editor, choose, cd, chunked, echo_lines
+from apy.utilities import parallel_map
+
+# Sort keys for sort_ids(): SQL expressions for cards and for notes (as
+# aggregates of the card expressions). Due dates of new cards are placed after
+# all other cards, and due times of learning cards are converted to days.
+SORT_KEYS = {
+    'ease': ('c.factor', 'min({card})'),
+    'lapses': ('c.lapses', 'max({card})'),
+    'due': ('(case when c.type = 0 then 1000000 + c.due '
+            'when c.queue = 1 then (c.due - {crt})/86400 '
+            'else c.due end)', 'min({card})'),
+    'mod': ('c.mod', 'n.mod'),
+    'ivl': ('c.ivl', 'min({card})'),
+}
+
+# User flags of cards by color
+FLAGS = {'red': 1, 'orange': 2, 'green': 3, 'blue': 4}
 
 
 class Anki:
-    """My Anki collection wrapper class."""
+    """My Anki collection wrapper class.
 
-    def __init__(self, base=None, path=None, profile=None, **kwargs):
+    Writers hold an exclusive lock while the collection is open. With
+    read_only=True, a snapshot copy of the last committed state of the
+    collection is opened instead (and changes are never saved), so readers
+    neither wait for writers nor for each other.
+    """
+
+    def __init__(self, base=None, path=None, profile=None, read_only=False,
+                 **kwargs):
         self.modified = False
+        self.read_only = read_only
+        self._batch = None
+        self._lock = None
+        self._snapshot = None
+        self._query_cache = None
+        self._metadata = None
+        self._metadata_changed = False
 
         self._init_load_collection(base, path, profile)
         self._init_load_config()
 
-        self.model_name_to_id = {m['name']: m['id']
-                                 for m in self.col.models.all()}
-        self.model_names = self.model_name_to_id.keys()
-
-        self.deck_name_to_id = {d['name']: d['id']
-                                for d in self.col.decks.all()}
-        self.deck_names = self.deck_name_to_id.keys()
-        self.n_decks = len(self.deck_names)
-
     def _init_load_collection(self, base, path, profile):
         """Load the Anki collection"""
         # Save CWD (because Anki changes it)
@@ -53,31 +86,80 @@ class Anki:
 
             # Initialize a profile manager to get an interface to the profile
             # settings and main database path; also required for syncing
-            self.pm = ProfileManager(base)
-            self.pm.setupMeta()
+            with trace.span('profile.load'):
+                self.pm = ProfileManager(base)
+                self.pm.setupMeta()
 
-            if profile is None:
-                profile = self.pm.profiles()[0]
+                if profile is None:
+                    profile = self.pm.profiles()[0]
 
-            # Load the main Anki database/collection
-            self.pm.load(profile)
-            path = self.pm.collectionPath()
+                # Load the main Anki database/collection
+                self.pm.load(profile)
+                path = self.pm.collectionPath()
         else:
             self.pm = None
 
-        try:
-            self.col = anki.Collection(path)
-        except AssertionError:
+        # The path of the collection (the open collection may be a snapshot)
+        self.path = str(path)
+        if not (Path(path).is_file() if self.read_only
+                else Path(path).parent.is_dir()):
             click.echo('Path to database is not valid!')
             click.echo(f'path = {path}')
             raise click.Abort()
-        except anki.rsbackend.DBError:
-            click.echo('Database is NA/locked!')
-            raise click.Abort()
+
+        try:
+            path = self._acquire(path)
+
+            # Wait for other applications (e.g. Anki) that have it open
+            for _ in backoff(cfg['lock_timeout']):
+                try:
+                    with trace.span('collection.open'):
+                        self.col = anki.Collection(path)
+                    break
+                except anki.rsbackend.DBError:
+                    continue
+            else:
+                click.echo('Database is NA/locked!')
+                raise click.Abort()
+        except AssertionError:
+            self._release()
+            click.echo('Path to database is not valid!')
+            click.echo(f'path = {self.path}')
+            raise click.Abort() from None
+        except click.Abort:
+            self._release()
+            raise
 
         # Restore CWD (because Anki changes it)
         os.chdir(save_cwd)
 
+    def _acquire(self, path):
+        """Lock the collection, or copy it to a snapshot if read-only
+
+        Returns the path of the collection file to open.
+        """
+        try:
+            if not self.read_only:
+                self._lock = CollectionLock(path, timeout=cfg['lock_timeout'])
+                with trace.span('collection.lock'):
+                    self._lock.acquire()
+                return path
+
+            self._snapshot = tempfile.TemporaryDirectory(prefix='apy-')
+            with trace.span('collection.snapshot'):
+                return copy_snapshot(path, self._snapshot.name,
+                                     cfg['lock_timeout'])
+        except TimeoutError:
+            click.echo('Timed out while waiting for other processes!')
+            raise click.Abort() from None
+
+    def _release(self):
+        """Release the lock or remove the snapshot"""
+        if self._lock is not None:
+            self._lock.release()
+        if self._snapshot is not None:
+            self._snapshot.cleanup()
+
     @staticmethod
     def _init_load_config():
         """Load custom configuration"""
@@ -89,17 +171,151 @@ class Anki:
             anki.latex.svgCommands = cfg['svgCommands']
 
 
+    def _get_metadata(self):
+        """Get model and deck names, ids and field names (loaded lazily)
+
+        The metadata is loaded from a snapshot in the sidecar database if the
+        snapshot matches the schema and modification stamps of the
+        collection. Otherwise it is rebuilt, and the snapshot is updated when
+        the collection is closed.
+        """
+        if self._metadata is None:
+            with trace.span('metadata.load'):
+                self._metadata = load_snapshot(self.path,
+                                               self._metadata_stamp())
+
+            if self._metadata is None:
+                with trace.span('metadata.build'):
+                    models = self.col.models.all()
+                    self._metadata = {
+                        'models': {m['name']: m['id'] for m in models},
+                        'fields': {m['name']: [f['name'] for f in m['flds']]
+                                   for m in models},
+                        'decks': {d['name']: d['id']
+                                  for d in self.col.decks.all()},
+                    }
+                self._metadata_changed = True
+
+        return self._metadata
+
+    def _metadata_stamp(self):
+        """Get stamp for the metadata snapshot"""
+        return f'{self.col.scm}:{self.col.mod}'
+
+    def _save_metadata(self, force=False):
+        """Save metadata snapshot (if it was loaded and changed)"""
+        if self._metadata is not None and (force or self._metadata_changed):
+            save_snapshot(self.path, self._metadata_stamp(),
+                          self._metadata)
+            self._metadata_changed = False
+
+    def _update_model_metadata(self, model, old_name=None):
+        """Update metadata in place after a model was changed"""
+        metadata = self._get_metadata()
+        if old_name is not None:
+            metadata['models'].pop(old_name, None)
+            metadata['fields'].pop(old_name, None)
+
+        metadata['models'][model['name']] = model['id']
+        metadata['fields'][model['name']] = [f['name'] for f in model['flds']]
+        self._metadata_changed = True
+
+    @property
+    def model_name_to_id(self):
+        """Map from model names to model ids"""
+        return self._get_metadata()['models']
+
+    @property
+    def model_names(self):
+        """Model names"""
+        return self.model_name_to_id.keys()
+
+    def model_field_names(self, model_name):
+        """Get field names for model (or None if there is no such model)"""
+        return self._get_metadata()['fields'].get(model_name)
+
+    @property
+    def deck_name_to_id(self):
+        """Map from deck names to deck ids"""
+        return self._get_metadata()['decks']
+
+    @property
+    def deck_names(self):
+        """Deck names"""
+        return self.deck_name_to_id.keys()
+
+    @property
+    def n_decks(self):
+        """Number of decks"""
+        return len(self.deck_name_to_id)
+
+
     def __enter__(self):
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        if self.modified:
+        try:
+            self._close_collection()
+        finally:
+            if self._query_cache is not None:
+                self._query_cache.close()
+            self._release()
+
+    def _close_collection(self):
+        """Close the collection (and save it if it was modified)"""
+        if self.modified and not self.read_only:
             click.echo('Database was modified.')
             if self.pm is not None and self.pm.profile['syncKey']:
                 click.secho('Remember to sync!', fg='blue')
-            self.col.close()
+            with trace.span('collection.close'):
+                # Save first to update the metadata snapshot with the new stamp
+                self.col.save()
+                self._save_metadata(force=True)
+                self.col.close()
         elif self.col.db:
-            self.col.close(False)
+            with trace.span('collection.close'):
+                if not self.modified:
+                    self._save_metadata()
+                self.col.close(False)
+
+
+    def mark_modified(self, n=1):
+        """Mark the collection as modified by n writes
+
+        Inside a batch, the writes are registered with the batch so that they
+        are committed when the current chunk is full.
+        """
+        self.modified = True
+        if self._batch is not None:
+            self._batch.step(n)
+
+    @contextmanager
+    def batch(self, chunk_size=None):
+        """Group writes into transactions that are committed in chunks
+
+        Writes inside the context are committed each time chunk_size writes
+        have been made (default: cfg['batch_size']; 0 means one single
+        transaction) and when the context exits. If an exception is raised,
+        the current (uncommitted) chunk is rolled back and the exception is
+        re-raised. Nested batches join the outermost batch.
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        if chunk_size is None:
+            chunk_size = cfg['batch_size']
+
+        self._batch = Batch(self, chunk_size)
+        try:
+            yield self._batch
+        except BaseException:
+            self._batch.rollback()
+            raise
+        else:
+            self._batch.commit()
+        finally:
+            self._batch = None
 
 
     def sync(self):
@@ -201,20 +417,104 @@ class Anki:
 
     def find_cards(self, query):
         """Find card ids in Collection that match query"""
-        return self.col.findCards(query)
+        with trace.span('search.cards'):
+            return self._cached_search('cards', query, self.col.findCards)
+
+    def find_note_ids(self, query):
+        """Find note ids in Collection that match query"""
+        with trace.span('search.notes'):
+            return self._cached_search('notes', query, self.col.findNotes)
 
     def find_notes(self, query):
         """Find notes in Collection and return Note objects"""
         return (Note(self, self.col.getNote(i))
-                for i in self.col.findNotes(query))
+                for i in self.find_note_ids(query))
+
+    def iter_note_views(self, query, chunk_size=1000):
+        """Find notes in Collection and return NoteView objects
+
+        The views are read in chunks directly from the database, so this is
+        much cheaper than find_notes() for listing many notes.
+        """
+        return self.iter_note_views_by_id(self.find_note_ids(query),
+                                          chunk_size)
+
+    def iter_note_views_by_id(self, nids, chunk_size=1000):
+        """Return NoteView objects for list of note ids (see iter_note_views)"""
+        for chunk in chunked(nids, chunk_size):
+            with trace.span('views.load'):
+                rows = self.col.db.all(f"""
+                    select n.id, n.mid,
+                           (select did from cards where nid = n.id
+                            order by ord limit 1),
+                           n.tags, max(c.flags),
+                           case when max(c.queue = -1) then -1
+                                else min(c.queue) end,
+                           substr(n.flds, 1,
+                                  instr(n.flds || char(31), char(31)) - 1)
+                    from notes n join cards c on c.nid = n.id
+                    where n.id in {ids2str(chunk)}
+                    group by n.id""")
+
+            views = {row[0]: NoteView(row[0], row[1], row[2],
+                                      row[3].split(), *row[4:])
+                     for row in rows}
+            trace.count('views.loaded', len(views))
+
+            for nid in chunk:
+                if nid in views:
+                    yield views[nid]
+
+    def _cached_search(self, kind, query, search):
+        """Search with results cached in the query cache
+
+        The cache is bypassed if the collection has unsaved modifications, for
+        time dependent queries (e.g. is:due), or if it is disabled
+        (cfg['query_cache_size'] is 0). Returns a list of ids.
+        """
+        if not cfg['query_cache_size'] or self.modified or self.col.db.mod \
+                or is_time_dependent(query):
+            return search(query)
+
+        if self._query_cache is None:
+            self._query_cache = QueryCache(self.path,
+                                           cfg['query_cache_size'])
+
+        stamp = f'{self.col.scm}:{self.col.mod}:{self.col.sched.today}'
+        ids = self._query_cache.get(kind, query, stamp)
+        if ids is None:
+            ids = self._query_cache.put(kind, query, stamp, search(query))
+
+        return list(ids)
+
+    def search_notes(self, text, limit=None):
+        """Full-text search of the decoded note source (see SearchIndex)
+
+        Returns list of (note id, rank, snippet) tuples, best match first.
+        """
+        with SearchIndex(self) as index:
+            index.update()
+            return index.search(text, limit)
+
+    def restrict_query(self, query, text):
+        """Restrict query to notes that match full-text search"""
+        nids = [nid for nid, _, _ in self.search_notes(text)]
+        restriction = f'nid:{",".join(map(str, nids))}' if nids else 'nid:0'
+
+        if not query:
+            return restriction
+
+        return f'({query}) {restriction}'
 
     def delete_notes(self, ids):
         """Delete notes by note ids"""
-        if not isinstance(ids, list):
+        if isinstance(ids, int):
             ids = [ids]
 
-        self.col.remNotes(ids)
-        self.modified = True
+        with self.batch() as batch:
+            for chunk in chunked(ids, batch.chunk_size):
+                self.col.remNotes(chunk)
+                self.mark_modified(len(chunk))
 
 
     def get_model(self, model_name):
@@ -246,19 +546,46 @@ class Anki:
         model = self.get_model(old_model_name)
         model['name'] = new_model_name
 
-        # Update local storage
-        self.model_name_to_id = {m['name']: m['id']
-                                 for m in self.col.models.all()}
-        self.model_names = self.model_name_to_id.keys()
-
-        # Save changes
+        # Save changes and update local storage
         self.col.models.save(model)
-        self.modified = True
+        self._update_model_metadata(model, old_model_name)
+        self.mark_modified()
+
+    def import_model(self, model):
+        """Add a copy of a model from another collection
+
+        The model id is kept if it is not used in this collection, otherwise
+        Anki assigns a new id. If a model with the same name exists, Anki
+        appends a random suffix to the name (e.g. Cloze-2a756). Returns the
+        new model.
+        """
+        model = copy.deepcopy(model)
+        model['mod'] = intTime()
+        model['usn'] = self.col.usn()
+        if self.col.models.get(model['id']) is None:
+            self.col.models.update(model)
+        else:
+            self.col.models.add(model)
+
+        self._update_model_metadata(model)
+        self.mark_modified()
+        return model
+
+    def ensure_deck(self, deck_name):
+        """Get id of deck (the deck is created if it does not exist)"""
+        did = self.deck_name_to_id.get(deck_name)
+        if did is None:
+            did = self.col.decks.id(deck_name)
+            self._get_metadata()['decks'][deck_name] = did
+            self._metadata_changed = True
+            self.mark_modified()
+
+        return did
 
 
     def list_tags(self):
         """List all tags"""
-        tags = [(t, len(self.col.findNotes(f'tag:{t}')))
+        tags = [(t, len(self.find_note_ids(f'tag:{t}')))
                 for t in self.col.tags.all()]
         width = len(max(tags, key=lambda x: len(x[0]))[0]) + 2
         filler = " "*(cfg['width'] - 2*width - 8)
@@ -270,8 +597,54 @@ class Anki:
 
     def change_tags(self, query, tags, add=True):
         """Add/Remove tags from notes that match query"""
-        self.col.tags.bulkAdd(self.col.findNotes(query), tags, add)
-        self.modified = True
+        with self.batch() as batch:
+            for chunk in chunked(self.find_note_ids(query), batch.chunk_size):
+                self.col.tags.bulkAdd(list(chunk), tags, add)
+                self.mark_modified(len(chunk))
+
+
+    def select_cards(self, query, where):
+        """Find ids of cards that match query and an SQL condition
+
+        Returns the number of cards that match query and the ids of those
+        that also satisfy the condition (e.g. cards that are not suspended).
+        """
+        cids = self.find_cards(query)
+        selected = []
+        for chunk in chunked(cids, cfg['batch_size']):
+            selected += self.col.db.list(
+                f'select id from cards where id in {ids2str(chunk)} '
+                f'and {where}')
+        return len(cids), selected
+
+    def suspend_cards(self, cids, suspend=True):
+        """Suspend or unsuspend cards in one transaction"""
+        with self.batch(0):
+            for chunk in chunked(cids, cfg['batch_size']):
+                if suspend:
+                    self.col.sched.suspendCards(chunk)
+                else:
+                    self.col.sched.unsuspendCards(chunk)
+                self.mark_modified(len(chunk))
+
+    def flag_cards(self, cids, flag):
+        """Set user flag of cards (0 removes the flag) in one transaction"""
+        with self.batch(0):
+            for chunk in chunked(cids, cfg['batch_size']):
+                self.col.setUserFlag(flag, chunk)
+                self.mark_modified(len(chunk))
+
+    def move_cards(self, cids, deck):
+        """Move cards to deck in one transaction"""
+        did = self.deck_name_to_id.get(deck)
+        if did is None:
+            click.echo(f'Deck "{deck}" was not recognized!')
+            raise click.Abort()
+
+        with self.batch(0):
+            for chunk in chunked(cids, cfg['batch_size']):
+                self.col.decks.setDeck(chunk, did)
+                self.mark_modified(len(chunk))
 
 
     def edit_model_css(self, model_name):
@@ -294,13 +667,122 @@ class Anki:
         if model['css'] != new_content:
             model['css'] = new_content
             self.col.models.save(model, templates=True)
-            self.modified = True
+            self._update_model_metadata(model)
+            self.mark_modified()
 
 
-    def list_notes(self, query, verbose=False):
-        """List notes that match a query"""
-        for note in self.find_notes(query):
-            first_field = html_to_screen(note.n.values()[0])
+    def ensure_highlight_css(self, model):
+        """Add highlight stylesheet to model CSS if it is missing or outdated
+
+        The stylesheet is needed for class-based highlighting, see
+        cfg['highlight_classes'].
+        """
+        css = with_highlight_css(model['css'])
+        if css != model['css']:
+            model['css'] = css
+            self.col.models.save(model, templates=True)
+            self._update_model_metadata(model)
+            self.mark_modified()
+
+    def transform_fields(self, query, transform, dry_run=False, jobs=1,
+                         progress=None, chunk_size=500):
+        """Apply transform to the fields of notes that match query
+
+        The transform is called with the HTML of each field and returns the
+        new HTML (or the same HTML to keep the field). With jobs other than
+        1, chunks of notes are transformed in a pool of processes (jobs=None
+        uses all CPUs), and transform must then be picklable. Changed notes
+        are written directly with SQL in chunked transactions, without
+        loading note objects. If given, progress is called with the number
+        of notes after each chunk.
+
+        Returns a dict with the number of checked and changed notes and
+        fields, the size of the changed fields before and after (in bytes),
+        and the ids of the models of the changed notes.
+        """
+        stats = {'notes': 0, 'changed': 0, 'fields': 0, 'before': 0,
+                 'after': 0, 'models': set()}
+        sort_index = {int(m['id']): self.col.models.sortIdx(m)
+                      for m in self.col.models.all()}
+        usn = self.col.usn()
+
+        tasks = ((transform, self.col.db.all(
+            f'select id, mid, flds from notes where id in {ids2str(chunk)}'))
+                 for chunk in chunked(self.find_note_ids(query), chunk_size))
+        results = map(_transform_chunk, tasks) if jobs == 1 \
+            else parallel_map(_transform_chunk, tasks, jobs)
+
+        with self.batch():
+            for n_notes, changed in results:
+                updates = []
+                for nid, mid, fields, n_fields, before, after in changed:
+                    stats['changed'] += 1
+                    stats['fields'] += n_fields
+                    stats['before'] += before
+                    stats['after'] += after
+                    stats['models'].add(mid)
+                    updates.append((joinFields(fields),
+                                    stripHTMLMedia(fields[sort_index[mid]]),
+                                    fieldChecksum(fields[0]),
+                                    intTime(), usn, nid))
+
+                if updates and not dry_run:
+                    self.col.db.executemany(
+                        'update notes set flds = ?, sfld = ?, csum = ?, '
+                        'mod = ?, usn = ? where id = ?', updates)
+                    self.mark_modified(len(updates))
+
+                stats['notes'] += n_notes
+                if progress is not None:
+                    progress(n_notes)
+
+        return stats
+
+    def sort_ids(self, kind, ids, sort=None, reverse=False, limit=None,
+                 offset=0):
+        """Sort and slice list of note or card ids
+
+        The sorting and slicing are done in the database, so that only the
+        selected ids are returned. The kind is 'notes' or 'cards', and sort
+        is one of the keys in SORT_KEYS (or None to keep the order of ids).
+        Notes are sorted by the values of their cards: lowest ease, most
+        lapses, first due date, lowest interval and note modification time.
+        """
+        if sort is None:
+            end = None if limit is None else offset + limit
+            return ids[offset:end]
+
+        card_expr, note_expr = SORT_KEYS[sort]
+        card_expr = card_expr.format(crt=self.col.crt)
+        note_expr = note_expr.format(card=card_expr)
+        direction = 'desc' if reverse else 'asc'
+
+        if kind == 'cards':
+            sql = (f'select c.id from cards c where c.id in {ids2str(ids)} '
+                   f'order by {card_expr} {direction}, c.id')
+        else:
+            sql = ('select n.id from notes n join cards c on c.nid = n.id '
+                   f'where n.id in {ids2str(ids)} group by n.id '
+                   f'order by {note_expr} {direction}, n.id')
+
+        with trace.span('search.sort'):
+            return self.col.db.list(sql + ' limit ? offset ?',
+                                    -1 if limit is None else limit, offset)
+
+    def list_notes(self, query, verbose=False, pager=False, **sort_args):
+        """List notes that match a query
+
+        The sort_args are passed on to sort_ids(). With pager=True, the
+        output is shown in a pager and the notes are loaded as the pager
+        reads the output.
+        """
+        nids = self.sort_ids('notes', self.find_note_ids(query), **sort_args)
+        echo_lines(self._note_lines(nids, verbose), pager)
+
+    def _note_lines(self, nids, verbose):
+        """Generate output lines for list_notes()"""
+        for note in self.iter_note_views_by_id(nids, chunk_size=100):
+            first_field = html_to_screen(note.first_field)
             first_field = first_field.replace('\n', ' ')
             first_field = re.sub(r'\s\s\s+', ' ', first_field)
             first_field = first_field[:cfg['width']-14] \
@@ -309,25 +791,35 @@ class Anki:
             first = 'Q: '
             if note.suspended:
                 first = click.style(first, fg='red')
-            elif 'marked' in note.n.tags:
+            elif 'marked' in note.tags:
                 first = click.style(first, fg='yellow')
 
-            click.echo(f'{first}{first_field}')
+            yield f'{first}{first_field}'
             if verbose:
-                click.echo(f'model: {note.model_name}\n')
+                yield f'model: {self.col.models.get(note.mid)["name"]}\n'
+
+    def list_cards(self, query, verbose=False, pager=False, **sort_args):
+        """List cards that match a query
 
-    def list_cards(self, query, verbose=False):
-        """List cards that match a query"""
-        for cid in self.find_cards(query):
+        The sort_args are passed on to sort_ids(). With pager=True, the
+        output is shown in a pager and the cards are loaded as the pager
+        reads the output.
+        """
+        cids = self.sort_ids('cards', self.find_cards(query), **sort_args)
+        echo_lines(self._card_lines(cids, verbose), pager)
+
+    def _card_lines(self, cids, verbose):
+        """Generate output lines for list_cards()"""
+        for cid in cids:
             c = self.col.getCard(cid)
             question = html_to_screen(c.q()).replace('\n', ' ')
             answer = html_to_screen(c.a()).replace('\n', ' ')
-            click.echo(f'Q: {question[:cfg["width"]]}')
+            yield f'Q: {question[:cfg["width"]]}'
             if verbose:
-                click.echo(f'A: {answer[:cfg["width"]]}')
-                click.echo(f'ease: {c.factor/10}% '
-                           f'lapses: {c.lapses} '
-                           f'model: {c.model()["name"]}\n')
+                yield f'A: {answer[:cfg["width"]]}'
+                yield (f'ease: {c.factor/10}% '
+                       f'lapses: {c.lapses} '
+                       f'model: {c.model()["name"]}\n')
 
 
     def add_notes_with_editor(self, tags='', model_name=None, deck_name=None,
@@ -387,30 +879,35 @@ class Anki:
     def add_notes_from_list(self, parsed_notes, tags=''):
         """Add new notes to collection from note list (from parsed file)"""
         notes = []
-        for note in parsed_notes:
-            model_name = note['model']
-            model = self.set_model(model_name)
-            model_field_names = [field['name'] for field in model['flds']]
+        with self.batch():
+            for note in parsed_notes:
+                notes.append(self._add_parsed_note(note, tags))
 
-            field_names = note['fields'].keys()
-            field_values = note['fields'].values()
+        return notes
 
-            if len(field_names) != len(model_field_names):
-                click.echo(f'Error: Not enough fields for model {model_name}!')
-                self.modified = False
-                raise click.Abort()
+    def _add_parsed_note(self, note, tags=''):
+        """Add new note to collection from parsed note"""
+        model_name = note['model']
+        model = self.set_model(model_name)
+        model_field_names = [field['name'] for field in model['flds']]
 
-            for x, y in zip(model_field_names, field_names):
-                if x != y:
-                    click.echo('Warning: Inconsistent field names '
-                               f'({x} != {y})')
+        field_names = note['fields'].keys()
+        field_values = note['fields'].values()
 
-            notes.append(self._add_note(field_values,
-                                        f"{tags} {note['tags']}",
-                                        note['markdown'],
-                                        note.get('deck')))
+        if len(field_names) != len(model_field_names):
+            click.echo(f'Error: Not enough fields for model {model_name}!')
+            self.modified = False
+            raise click.Abort()
 
-        return notes
+        for x, y in zip(model_field_names, field_names):
+            if x != y:
+                click.echo('Warning: Inconsistent field names '
+                           f'({x} != {y})')
+
+        return self._add_note(field_values,
+                              f"{tags} {note['tags']}",
+                              note['markdown'],
+                              note.get('deck'))
 
     def add_notes_single(self, fields, tags='', model=None, deck=None):
         """Add new note to collection from args"""
@@ -428,6 +925,8 @@ class Anki:
 
         if markdown:
             note.fields = [markdown_to_html(x) for x in fields]
+            if cfg['highlight_classes']:
+                self.ensure_highlight_css(note.model())
         else:
             note.fields = [plain_to_html(x) for x in fields]
 
@@ -437,10 +936,35 @@ class Anki:
 
         if not note.dupeOrEmpty():
             self.col.addNote(note)
-            self.modified = True
+            self.mark_modified()
         else:
             click.secho('Dupe detected, note was not added!', fg='red')
             click.echo('Question:')
             click.echo(list(fields)[0])
 
         return Note(self, note)
+
+
+def _transform_chunk(task):
+    """Transform fields of a chunk of notes (see Anki.transform_fields)
+
+    Returns the number of notes and a list with the new fields, the number
+    of changed fields and their size before and after for changed notes.
+    """
+    transform, rows = task
+    changed = []
+    for nid, mid, flds in rows:
+        fields = splitFields(flds)
+        n_fields = before = after = 0
+        for i, old in enumerate(fields):
+            new = transform(old)
+            if new != old:
+                fields[i] = new
+                n_fields += 1
+                before += len(old.encode())
+                after += len(new.encode())
+
+        if n_fields > 0:
+            changed.append((nid, mid, fields, n_fields, before, after))
+
+    return len(rows), changed
@@ -0,0 +1,39 @@
+"""Chunked transactions for bulk writes to a collection"""
+
+
+class Batch:
+    """A group of writes that is committed in chunks (see Anki.batch)"""
+
+    def __init__(self, a, chunk_size):
+        self.a = a
+        self.chunk_size = chunk_size
+        self.pending = 0
+        self.committed = 0
+        self._was_modified = a.modified
+
+    def step(self, n=1):
+        """Register n writes and commit if the current chunk is full"""
+        self.pending += n
+        if self.chunk_size and self.pending >= self.chunk_size:
+            self.commit()
+
+    def commit(self):
+        """Commit the current chunk"""
+        if self.pending == 0:
+            return
+
+        # Ensure that Anki flushes and commits (writes done through the
+        # backend do not always mark the database as modified)
+        self.a.col.db.mod = True
+        self.a.col.save()
+
+        self.committed += self.pending
+        self.pending = 0
+
+    def rollback(self):
+        """Roll back the current (uncommitted) chunk"""
+        if self.pending > 0:
+            self.a.col.rollback()
+            self.pending = 0
+
+        self.a.modified = self._was_modified or self.committed > 0
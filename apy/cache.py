@@ -0,0 +1,147 @@
+"""Caches of collection data in the sidecar database
+
+The results of note and card searches are stored compactly (as arrays of 64
+bit ids) in the sidecar database. Each result is keyed by the query string
+and a stamp of the collection state (schema and modification times, and the
+scheduler day, since queries like added:1 depend on the date). Queries
+whose results change within a day without a change of the collection (e.g.
+when learning cards become due) are not cached. The least recently used
+results are evicted when the cache grows beyond its size limit.
+
+A snapshot of collection metadata (model and deck names and ids) is also kept
+to avoid rebuilding it on every start.
+"""
+import re
+import json
+from array import array
+
+from apy import sidecar
+from apy import trace
+
+# Search terms that depend on the time of day (e.g. intraday learning cards)
+TIME_DEPENDENT = re.compile(r'(^|[\s("-])(is:due|is:learn|prop:|rated:)',
+                            re.IGNORECASE)
+
+
+def is_time_dependent(query):
+    """Check if results of query may change without a change of collection"""
+    return TIME_DEPENDENT.search(query) is not None
+
+
+class QueryCache:
+    """Cache of search results for a collection"""
+
+    def __init__(self, collection_path, max_size):
+        self.max_size = max_size
+        self.db = sidecar.connect(collection_path)
+        self.db.execute('''
+            create table if not exists query_cache (
+                kind text not null,
+                query text not null,
+                stamp text not null,
+                ids blob not null,
+                size integer not null,
+                atime integer not null,
+                primary key (kind, query)
+            )''')
+        self._clock = self.db.execute(
+            'select coalesce(max(atime), 0) from query_cache').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the cache database"""
+        sidecar.close(self.db)
+
+    def get(self, kind, query, stamp):
+        """Get cached ids (or None if there is no valid result)"""
+        row = self.db.execute(
+            'select ids from query_cache '
+            'where kind = ? and query = ? and stamp = ?',
+            (kind, query, stamp)).fetchone()
+        if row is None:
+            trace.count('cache.query.miss')
+            return None
+
+        trace.count('cache.query.hit')
+        with self.db:
+            self.db.execute(
+                'update query_cache set atime = ? where kind = ? and query = ?',
+                (self._tick(), kind, query))
+
+        ids = array('q')
+        ids.frombytes(row[0])
+        return ids
+
+    def put(self, kind, query, stamp, ids):
+        """Store ids and evict old results if the cache is too large"""
+        ids = array('q', ids)
+        blob = ids.tobytes()
+        if len(blob) > self.max_size:
+            return ids
+
+        with self.db:
+            self.db.execute(
+                'insert or replace into query_cache '
+                '(kind, query, stamp, ids, size, atime) '
+                'values (?, ?, ?, ?, ?, ?)',
+                (kind, query, stamp, blob, len(blob), self._tick()))
+            self.db.execute('''
+                delete from query_cache where rowid in (
+                    select rowid from (
+                        select rowid,
+                               sum(size) over (order by atime desc) as total
+                        from query_cache
+                    ) where total > ?
+                )''', (self.max_size,))
+
+        return ids
+
+    def _tick(self):
+        """Get next access time (a counter is used to avoid clock issues)"""
+        self._clock += 1
+        return self._clock
+
+
+def load_snapshot(collection_path, stamp):
+    """Load metadata snapshot (or None if there is no snapshot for stamp)"""
+    db = _connect_snapshot(collection_path)
+    try:
+        row = db.execute(
+            "select data from snapshot where key = 'metadata' and stamp = ?",
+            (stamp,)).fetchone()
+    finally:
+        sidecar.close(db)
+
+    if row is None:
+        trace.count('cache.snapshot.miss')
+        return None
+
+    trace.count('cache.snapshot.hit')
+    return json.loads(row[0])
+
+def save_snapshot(collection_path, stamp, data):
+    """Save metadata snapshot"""
+    db = _connect_snapshot(collection_path)
+    try:
+        with db:
+            db.execute(
+                'insert or replace into snapshot (key, stamp, data) '
+                "values ('metadata', ?, ?)", (stamp, json.dumps(data)))
+    finally:
+        sidecar.close(db)
+
+def _connect_snapshot(collection_path):
+    """Open sidecar database and ensure that the snapshot table exists"""
+    db = sidecar.connect(collection_path)
+    db.execute('''
+        create table if not exists snapshot (
+            key text primary key,
+            stamp text not null,
+            data text not null
+        )''')
+    return db
@@ -0,0 +1,137 @@
+"""Changefeed of added, modified and deleted notes and cards
+
+Changes are found from the modification times of notes and cards (in
+seconds) and from the graves table, where Anki records deleted objects. A
+cursor holds the time and the last grave at the end of a feed, so that the
+next feed only contains what changed since. Changes in the current second
+are left for the next feed, since more changes may follow within the same
+second.
+
+The cursor is opaque to consumers (base64 encoded JSON). It also holds the
+schema modification time, because a schema change (e.g. a full sync) may
+rewrite the graves table, and the id of the last grave, because the rows of
+the graves table may be renumbered (e.g. by Check Database, which vacuums
+the database). In both cases a full feed is needed.
+"""
+import json
+import base64
+import binascii
+
+import click
+from anki.utils import intTime, splitFields
+
+from apy import trace
+
+CURSOR_VERSION = 2
+
+# Types of objects in the graves table
+GRAVE_TYPES = {0: 'card', 1: 'note'}
+
+
+def encode_cursor(state):
+    """Encode cursor state as an opaque string"""
+    data = json.dumps({'v': CURSOR_VERSION, **state}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode cursor string (abort if it is not valid)"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        state = None
+
+    if not isinstance(state, dict) or state.pop('v', None) != CURSOR_VERSION:
+        click.echo(f'Invalid cursor: {cursor}')
+        raise click.Abort()
+
+    return state
+
+def iter_changes(a, cursor=None, fields=False, chunk_size=1000):
+    """Yield records of changes since cursor (or all notes and cards)
+
+    The records are dicts with the operation ('add', 'modify' or 'delete'),
+    the type ('note' or 'card') and the id, and the main properties of added
+    and modified objects (with the field values of notes if fields is True).
+    The last record holds the cursor for the next call.
+    """
+    db = a.col.db
+    now = intTime()
+    grave = db.scalar('select coalesce(max(rowid), 0) from graves')
+    state = {'scm': a.col.scm, 'mod': now, 'grave': grave,
+             'grave_oid': _grave_oid(db, grave)}
+
+    # A full feed has all existing objects, thus no deletions
+    if cursor is None:
+        since = {'scm': a.col.scm, 'mod': 0, 'grave': grave}
+    else:
+        since = decode_cursor(cursor)
+        if since['scm'] != a.col.scm:
+            click.echo('The collection schema changed since the cursor was '
+                       'created, a full feed is needed!')
+            raise click.Abort()
+        if _grave_oid(db, since['grave']) != since['grave_oid']:
+            click.echo('The graves were renumbered (e.g. by Check Database) '
+                       'since the cursor was created, a full feed is needed!')
+            raise click.Abort()
+
+    with trace.span('changes.notes'):
+        models = {int(m['id']): m for m in a.col.models.all()}
+        for nid, guid, mid, mod, tags, flds in _iter_modified(
+                db, 'select id, guid, mid, mod, tags, flds from notes',
+                since['mod'], now, chunk_size):
+            record = {
+                'op': 'add' if nid//1000 >= since['mod'] else 'modify',
+                'type': 'note',
+                'id': nid,
+                'mod': mod,
+                'guid': guid,
+                'model': models[mid]['name'],
+                'tags': tags.split(),
+            }
+            if fields:
+                record['fields'] = dict(zip(
+                    [x['name'] for x in models[mid]['flds']],
+                    splitFields(flds)))
+            yield record
+
+    with trace.span('changes.cards'):
+        decks = {int(d['id']): d['name'] for d in a.col.decks.all()}
+        for cid, nid, did, ordinal, mod, queue, due, ivl in _iter_modified(
+                db, 'select id, nid, did, ord, mod, queue, due, ivl '
+                'from cards', since['mod'], now, chunk_size):
+            yield {
+                'op': 'add' if cid//1000 >= since['mod'] else 'modify',
+                'type': 'card',
+                'id': cid,
+                'mod': mod,
+                'nid': nid,
+                'deck': decks.get(did),
+                'ord': ordinal,
+                'queue': queue,
+                'due': due,
+                'ivl': ivl,
+            }
+
+    with trace.span('changes.graves'):
+        for oid, kind in db.all('select oid, type from graves '
+                                'where rowid > ? and rowid <= ? order by rowid',
+                                since['grave'], state['grave']):
+            if kind in GRAVE_TYPES:
+                yield {'op': 'delete', 'type': GRAVE_TYPES[kind], 'id': oid}
+
+    yield {'cursor': encode_cursor(state)}
+
+def _grave_oid(db, rowid):
+    """Get object id of grave with rowid (None if there is none)"""
+    return db.scalar('select oid from graves where rowid = ?', rowid)
+
+def _iter_modified(db, select, since, until, chunk_size):
+    """Yield rows with since <= mod < until in chunks (ordered by id)"""
+    last = -2**63
+    while True:
+        rows = db.all(f'{select} where mod >= ? and mod < ? and id > ? '
+                      'order by id limit ?', since, until, last, chunk_size)
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield from rows
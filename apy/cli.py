@@ -1,12 +1,29 @@
 """A script to interact with the Anki database"""
 import os
 import sys
+import json
+import time
 
 import click
 
 from apy import __version__
-from apy.anki import Anki
+from apy import trace
+from apy.anki import Anki, SORT_KEYS, FLAGS
+from apy.changes import iter_changes
 from apy.config import cfg, cfg_file
+from apy.convert import rerender_highlight, rerender_markdown
+from apy.convert import reencode_markdown
+from apy.diff import iter_diff, summarize, print_summary
+from apy.dupes import find_duplicates, print_duplicates
+from apy.importer import FORMATS, iter_records, parse_mapping
+from apy.importer import prepare_notes, import_notes
+from apy.merge import merge_collection, count_notes
+from apy.package import export_package
+from apy.schedule import forecast as compute_forecast, print_forecast
+from apy.schedule import plan_reschedule, apply_reschedule, print_load
+from apy.search import SNIPPET_START, SNIPPET_END
+from apy.stats import compute_stats, print_stats
+from apy.verify import verify as verify_notes, Checkpoint
 
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
@@ -15,8 +32,12 @@ CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 @click.option('-b', '--base', help="Set Anki base directory")
 @click.option('-p', '--profile', help="Set Anki profile to be used")
 @click.option('-V', '--version', is_flag=True, help="Show apy version")
+@click.option('--trace', 'trace_target', is_flag=False, flag_value='-',
+              envvar='APY_TRACE', metavar='[FILE]',
+              help="Trace timings; print a summary or write Chrome trace "
+                   "events to FILE")
 @click.pass_context
-def main(ctx, base, profile, version):
+def main(ctx, base, profile, version, trace_target):
     """A script to interact with the Anki database.
 
     The base directory may be specified with the -b / --base option. For
@@ -38,6 +59,11 @@ def main(ctx, base, profile, version):
 
         export EDITOR=emacs
 
+    To see where time is spent, use --trace (or set APY_TRACE=-) to print a
+    summary of timings and counters to stderr, or --trace=FILE.json (or
+    APY_TRACE=FILE.json) to write Chrome trace events that may be viewed in
+    chrome://tracing or Perfetto.
+
     Note: Use `apy subcmd --help` to get detailed help for a given subcommand.
     """
     if version:
@@ -50,6 +76,10 @@ def main(ctx, base, profile, version):
     if profile:
         cfg['profile'] = profile
 
+    if trace_target:
+        trace.enable()
+        ctx.call_on_close(lambda: trace.report(trace_target))
+
     if ctx.invoked_subcommand is None:
         ctx.invoke(info)
 
@@ -176,12 +206,136 @@ def add_from_file(file, tags):
             for i, note in enumerate(notes):
                 note.review(i, n_notes, remove_actions=['Abort'])
 
+@main.command()
+@click.option('-s', '--since', 'cursor',
+              help='Cursor from the previous call.')
+@click.option('-f', '--fields', is_flag=True,
+              help='Include the fields of notes.')
+def changes(cursor, fields):
+    """Print changes to notes and cards as JSON lines.
+
+    Without --since, all notes and cards are printed as added. The last line
+    holds a cursor: pass it with --since in the next call to get only the
+    notes and cards that were added, modified or deleted in the meantime.
+    After a schema change or Check Database, a full feed is needed.
+    """
+    with Anki(**cfg, read_only=True) as a:
+        for record in iter_changes(a, cursor, fields):
+            click.echo(json.dumps(record))
+
 @main.command('check-media')
 def check_media():
     """Check media"""
     with Anki(**cfg) as a:
         a.check_media()
 
+@main.command()
+@click.argument('old', type=click.Path(exists=True, dir_okay=False))
+@click.argument('new', type=click.Path(exists=True, dir_okay=False))
+@click.option('-j', '--json', 'as_json', is_flag=True,
+              help='Print differences as JSON lines.')
+def diff(old, new, as_json):
+    """Print differences between two collection files.
+
+    The files (e.g. backups of collection.anki2) are opened read-only. Notes
+    are matched by their guid and cards by their id. By default, the number
+    of added, deleted and modified notes and cards is printed; with --json,
+    each difference is printed as a JSON line, with the changed fields and
+    tags of notes and the changed scheduling properties of cards.
+    """
+    records = iter_diff(old, new)
+    if as_json:
+        for record in records:
+            click.echo(json.dumps(record))
+    else:
+        print_summary(summarize(records))
+
+@main.command('export-apkg')
+@click.argument('query')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--no-scheduling', is_flag=True,
+              help='Export cards as new cards without review history.')
+@click.option('--no-media', is_flag=True, help='Do not include media files.')
+def export_apkg(query, output, no_scheduling, no_media):
+    """Export notes that match query to an Anki package (.apkg).
+
+    The package contains the notes, their cards and review history, and the
+    models, decks and media files that the notes use.
+    """
+    with Anki(**cfg, read_only=True) as a:
+        n_notes = len(a.find_note_ids(query))
+        with click.progressbar(length=n_notes, label='Exporting notes',
+                               file=sys.stderr) as progress:
+            counts = export_package(a, query, output, not no_scheduling,
+                                    not no_media, progress.update)
+
+    click.echo(f"Exported {counts['notes']} notes with {counts['cards']} "
+               f"cards, {counts['reviews']} reviews and {counts['media']} "
+               f"media files to {output}")
+
+@main.command('import')
+@click.argument('file', type=click.Path(exists=True, dir_okay=False,
+                                        allow_dash=True))
+@click.option('-f', '--format', 'fmt',
+              type=click.Choice(['csv', 'tsv', 'jsonl']),
+              help='Format of FILE [default: from the file extension].')
+@click.option('-m', '--model', 'model_name',
+              help='Model of notes without a model column '
+                   '[default: current model].')
+@click.option('-d', '--deck', help='Deck of notes without a deck column.')
+@click.option('-t', '--tags', default='', help='Tags to add to all notes.')
+@click.option('--markdown', is_flag=True,
+              help='Convert fields from Markdown for notes without a '
+                   'markdown column.')
+@click.option('--map', 'mapping', multiple=True,
+              metavar='[MODEL:]FIELD=COLUMN',
+              help='Read field from another column (may be repeated).')
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              show_default=True, help='Number of processes for conversion.')
+def import_file(file, fmt, model_name, deck, tags, markdown, mapping, jobs):
+    """Import notes from CSV, TSV or JSONL file.
+
+    Use "-" to read from stdin. The first row of CSV and TSV files holds the
+    column names, and each line of JSONL files is an object. By default, the
+    fields are read from the columns with the same names; use --map to read
+    a field from another column, e.g. --map Front=question (for all models)
+    or --map Cloze:Text=question. The columns model, deck, tags and markdown
+    set the model, deck, extra tags and Markdown flag of each note.
+
+    Empty notes and duplicates are skipped.
+
+    Examples:
+
+    \b
+        # Import notes with Markdown fields to deck "MyDeck"
+        apy import -d MyDeck --markdown notes.csv
+
+    \b
+        # Import from the output of another program
+        generate-cards | apy import -f jsonl -
+    """
+    if fmt is None:
+        fmt = FORMATS.get(os.path.splitext(file)[1].lower())
+        if fmt is None:
+            click.echo('Please specify the format with --format!')
+            raise click.Abort()
+
+    mapping = parse_mapping(mapping)
+    with Anki(**cfg) as a, \
+            click.open_file(file, encoding='utf-8') as stream:
+        if model_name is None:
+            model_name = a.col.models.current(forDeck=False)['name']
+
+        notes = prepare_notes(a, iter_records(stream, fmt), model_name, deck,
+                              tags, markdown, mapping)
+        start = time.time()
+        counts = import_notes(a, notes, jobs)
+
+    elapsed = time.time() - start
+    click.echo(f"Added {counts['added']} of {counts['notes']} notes "
+               f"({counts['skipped']} empty or duplicate) in {elapsed:.1f} s "
+               f"({counts['notes']/max(elapsed, 1e-6):.0f} notes/s)")
+
 @main.command()
 def info():
     """Print some basic statistics."""
@@ -192,8 +346,8 @@ def info():
     else:
         click.echo("Config file:             Not found")
 
-    with Anki(**cfg) as a:
-        click.echo(f"Collecton path:          {a.col.path}")
+    with Anki(**cfg, read_only=True) as a:
+        click.echo(f"Collecton path:          {a.path}")
         click.echo(f"Scheduler version:       {a.col.schedVer()}")
 
         if a.col.decks.count() > 1:
@@ -203,16 +357,16 @@ def info():
 
         sum_notes = a.col.noteCount()
         sum_cards = a.col.cardCount()
-        sum_due = len(a.col.findNotes('is:due'))
-        sum_marked = len(a.col.findNotes('tag:marked'))
-        sum_flagged = len(a.col.findNotes('-flag:0'))
+        sum_due = len(a.find_note_ids('is:due'))
+        sum_marked = len(a.find_note_ids('tag:marked'))
+        sum_flagged = len(a.find_note_ids('-flag:0'))
 
         click.echo(f"\n{'Model':26s} {'notes':>8s} {'cards':>8s} "
                    f"{'due':>8s} {'marked':>8s} {'flagged':>8s}")
         click.echo("-"*71)
         models = sorted(a.model_names)
         for m in models:
-            nnotes = len(a.col.findNotes(f'"note:{m}"'))
+            nnotes = len(a.find_note_ids(f'"note:{m}"'))
             ncards = len(a.find_cards(f'"note:{m}"'))
             ndue = len(a.find_cards(f'"note:{m}" is:due'))
             nmarked = len(a.find_cards(f'"note:{m}" tag:marked'))
@@ -252,27 +406,435 @@ def rename(old_name, new_name):
         a.rename_model(old_name, new_name)
 
 
+
+@main.group(context_settings=CONTEXT_SETTINGS, invoke_without_command=True)
+def migrate():
+    """Migrate existing notes to new formats."""
+
+def _print_migration(counts, dry_run):
+    """Print summary of a field migration"""
+    saved = counts['before'] - counts['after']
+    percent = 100*saved/counts['before'] if counts['before'] else 0
+    action = 'Would change' if dry_run else 'Changed'
+    click.echo(f"{action} {counts['fields']} fields in {counts['changed']} of "
+               f"{counts['notes']} notes: {counts['before']} -> "
+               f"{counts['after']} bytes ({saved} bytes or {percent:.1f}% "
+               "saved)")
+
+@migrate.command()
+@click.argument('query', default='deck:*')
+@click.option('--dry-run', is_flag=True,
+              help='Only report the size reduction, do not change notes.')
+def highlight(query, dry_run):
+    """Use class-based highlighting for code blocks.
+
+    Re-renders code blocks in notes that match query with CSS classes
+    instead of inline styles, and adds the highlight stylesheet to the CSS
+    of the affected models. Set highlight_classes to true in the config file
+    to also use classes for new and edited notes.
+    """
+    with Anki(**cfg, read_only=dry_run) as a:
+        counts = a.transform_fields(query, rerender_highlight, dry_run)
+        if not dry_run:
+            for mid in counts['models']:
+                a.ensure_highlight_css(a.col.models.get(mid))
+
+    _print_migration(counts, dry_run)
+
+@migrate.command()
+@click.argument('query', default='deck:*')
+@click.option('-e', '--encoding', 'target',
+              type=click.Choice(['compact', 'base64']),
+              default='compact', show_default=True,
+              help='Encoding to convert to.')
+@click.option('--dry-run', is_flag=True,
+              help='Only report the size reduction, do not change notes.')
+def encoding(query, target, dry_run):
+    """Change encoding of the original Markdown.
+
+    Re-encodes the original Markdown that is stored in the fields of notes
+    that match query. The compact encoding compresses the Markdown, and is
+    only used where it is smaller than the base64 encoding. Set
+    markdown_encoding in the config file to also use it for new and edited
+    notes.
+    """
+    with Anki(**cfg, read_only=dry_run) as a:
+        counts = a.transform_fields(
+            query, lambda x: reencode_markdown(x, target), dry_run)
+
+    _print_migration(counts, dry_run)
+
 @main.command('list')
 @click.argument('query', required=False, default='tag:marked OR -flag:0')
 @click.option('-v', '--verbose', is_flag=True,
               help='Be verbose, show more info')
-def list_cards(query, verbose):
-    """List cards that match a given query."""
-    with Anki(**cfg) as a:
-        a.list_cards(query, verbose)
+@click.option('-S', '--search', 'search_text',
+              help='Restrict to notes that match full-text search.')
+@click.option('--sort', type=click.Choice(list(SORT_KEYS)),
+              help='Sort cards by given key.')
+@click.option('--desc', 'reverse', is_flag=True,
+              help='Sort in descending order.')
+@click.option('-n', '--limit', type=click.IntRange(0),
+              help='Show at most LIMIT cards.')
+@click.option('--offset', type=click.IntRange(0), default=0,
+              help='Skip the first OFFSET cards.')
+@click.option('-p', '--pager', is_flag=True, help='Show output in pager.')
+def list_cards(query, verbose, search_text, sort, reverse, limit, offset,
+               pager):
+    """List cards that match a given query.
+
+    The cards are sorted and limited in the database, so that only the cards
+    that are shown are loaded. E.g., to show the 10 cards with the most
+    lapses:
+
+    \b
+        apy list --sort lapses --desc -n 10 deck:MyDeck
+    """
+    with Anki(**cfg, read_only=True) as a:
+        if search_text:
+            query = a.restrict_query(query, search_text)
+
+        a.list_cards(query, verbose, pager, sort=sort, reverse=reverse,
+                     limit=limit, offset=offset)
 
 @main.command()
 @click.option('-q', '--query', default='tag:marked OR -flag:0',
               help=('Review cards that match query [default: marked cards].'))
-def review(query):
+@click.option('-S', '--search', 'search_text',
+              help='Restrict to notes that match full-text search.')
+def review(query, search_text):
     """Review marked notes."""
     with Anki(**cfg) as a:
+        if search_text:
+            query = a.restrict_query(query, search_text)
+
         notes = list(a.find_notes(query))
         number_of_notes = len(notes)
         for i, note in enumerate(notes):
             if not note.review(i, number_of_notes):
                 break
 
+@main.command()
+@click.argument('other', type=click.Path(exists=True, dir_okay=False))
+@click.option('-u', '--update', is_flag=True,
+              help='Update notes that were modified later in OTHER.')
+@click.option('--no-media', is_flag=True, help='Do not copy media files.')
+def merge(other, update, no_media):
+    """Merge notes and cards of another collection file.
+
+    Notes are matched by guid: notes that already exist are skipped, or with
+    --update, updated if they were modified later in OTHER. Models are
+    matched by name and fields (other models are imported) and decks by
+    name. The cards keep their scheduling and review history, and the media
+    files that the notes refer to are copied from the media folder of OTHER.
+    """
+    n_notes = count_notes(other)
+    with Anki(**cfg) as a:
+        start = time.time()
+        with click.progressbar(length=n_notes, label='Merging notes',
+                               file=sys.stderr) as progress:
+            counts = merge_collection(a, other, update, not no_media,
+                                      progress.update)
+
+    elapsed = time.time() - start
+    for name in counts['models']:
+        click.echo(f'Imported model: {name}')
+    for name, local_name in counts['renamed']:
+        click.echo(f'Matched model: {name} (renamed to {local_name})')
+    click.echo(f"Added {counts['added']} notes with {counts['cards']} cards "
+               f"and {counts['reviews']} reviews")
+    click.echo(f"Updated {counts['updated']} notes, "
+               f"skipped {counts['skipped']} existing notes")
+    click.echo(f"Copied {counts['media']} media files")
+    click.echo(f"Merged {counts['notes']} notes in {elapsed:.1f} s "
+               f"({counts['notes']/max(elapsed, 1e-6):.0f} notes/s)")
+
+@main.command()
+@click.argument('query', default='deck:*')
+@click.option('-j', '--jobs', type=click.IntRange(1),
+              help='Number of processes [default: number of CPUs].')
+@click.option('--dry-run', is_flag=True,
+              help='Only report what would change, do not change notes.')
+def rerender(query, jobs, dry_run):
+    """Convert the Markdown of generated notes again.
+
+    Use this after upgrading Markdown or Pygments, or after changing the
+    highlight_classes option, to update the HTML of existing notes that
+    match query. The conversion runs in parallel processes, and only fields
+    whose HTML changed are written.
+    """
+    with Anki(**cfg, read_only=dry_run) as a:
+        n_notes = len(a.find_note_ids(query))
+        start = time.time()
+        with click.progressbar(length=n_notes, label='Rendering notes',
+                               file=sys.stderr) as progress:
+            counts = a.transform_fields(query, rerender_markdown, dry_run,
+                                        jobs, progress.update)
+
+        if not dry_run and cfg['highlight_classes']:
+            for mid in counts['models']:
+                a.ensure_highlight_css(a.col.models.get(mid))
+
+    elapsed = time.time() - start
+    _print_migration(counts, dry_run)
+    click.echo(f"Rendered {counts['notes']} notes in {elapsed:.1f} s "
+               f"({counts['notes']/max(elapsed, 1e-6):.0f} notes/s)")
+
+@main.command()
+@click.argument('query')
+@click.option('-s', '--spread', type=click.IntRange(1, 365), required=True,
+              help='Number of days to spread the reviews over.')
+@click.option('-t', '--tolerance', type=click.FloatRange(0, 1), default=0.1,
+              show_default=True,
+              help='Maximum shift of due dates relative to the interval.')
+@click.option('--dry-run', is_flag=True,
+              help='Only show the load, do not change the cards.')
+def reschedule(query, spread, tolerance, dry_run):
+    """Spread reviews of matched cards evenly over the next days.
+
+    Review cards that match the query and are due within the next SPREAD days
+    (including overdue cards) are moved to the days with the lowest load. Each
+    card is moved by at most TOLERANCE times its interval, e.g. a card with
+    an interval of 30 days is moved by at most 3 days for the default
+    tolerance. The daily load before and after is shown before the cards are
+    changed.
+
+    This command requires NumPy.
+    """
+    with Anki(**cfg, read_only=dry_run) as a:
+        cid, old, new, before, after = plan_reschedule(a, query, spread,
+                                                       tolerance)
+        print_load(before, after)
+
+        changed = old != new
+        n_changed = int(changed.sum())
+        click.echo(f'\n{n_changed} of {len(cid)} matched cards will be moved.')
+        if dry_run or n_changed == 0:
+            return
+
+        if not click.confirm(click.style('Continue?', fg='blue')):
+            raise click.Abort()
+
+        apply_reschedule(a, cid[changed], new[changed])
+
+@main.command()
+@click.argument('text')
+@click.option('-n', '--limit', type=click.IntRange(0), default=20,
+              show_default=True,
+              help='Maximum number of results.')
+def search(text, limit):
+    """Full-text search in the source of notes.
+
+    In contrast to the Anki queries used by other commands, this searches the
+    original Markdown of fields generated by apy (and the plain text of other
+    fields). The results are ranked by relevance.
+
+    TEXT uses the SQLite FTS5 query syntax, e.g. 'word1 word2' (both words),
+    'word1 OR word2', '"a phrase"', 'prefix*' or 'tags:sometag'.
+
+    The search index is stored next to the collection and is updated
+    incrementally before each search. The same search may be used to restrict
+    the notes for the list, review and tag commands with the option --search.
+    """
+    with Anki(**cfg, read_only=True) as a:
+        results = a.search_notes(text, limit)
+        if not results:
+            click.echo('No matching notes!')
+            return
+
+        for nid, rank, snippet in results:
+            snippet = ' '.join(snippet.split())
+            snippet = snippet.replace(SNIPPET_START, click.style('', bold=True,
+                                                                 reset=False))
+            snippet = snippet.replace(SNIPPET_END, click.style('', reset=True))
+            click.echo(click.style(f'{nid} ', fg='green')
+                       + click.style(f'({-rank:.2f}) ', fg='yellow')
+                       + snippet)
+
+@main.command()
+@click.argument('query', required=False)
+@click.option('-t', '--threshold', type=click.FloatRange(0, 1), default=0.8,
+              show_default=True,
+              help='Minimum estimated similarity of near-duplicates.')
+@click.option('-e', '--exact', is_flag=True,
+              help='Only find exact duplicates.')
+@click.option('--tag', 'add_tag', help='Add tag to all duplicates.')
+@click.option('-r', '--review', 'do_review', is_flag=True,
+              help='Review the duplicates.')
+@click.option('-j', '--json', 'as_json', is_flag=True,
+              help='Print clusters as JSON.')
+def dupes(query, threshold, exact, add_tag, do_review, as_json):
+    """Find duplicate notes that match query.
+
+    The text of the fields (the original Markdown for notes generated by apy)
+    is compared after folding whitespace and case. Exact duplicates are found
+    by hashing, near-duplicates by comparing MinHash signatures of the text.
+
+    Finding near-duplicates requires NumPy.
+    """
+    with Anki(**cfg, read_only=add_tag is None and not do_review) as a:
+        clusters = find_duplicates(a, query, threshold, near=not exact)
+        if as_json:
+            click.echo(json.dumps(clusters, indent=2))
+        else:
+            print_duplicates(clusters)
+
+        if not clusters:
+            return
+
+        query = 'nid:' + ','.join(str(nid) for cluster in clusters
+                                  for nid in cluster['nids'])
+        if add_tag is not None:
+            a.change_tags(query, add_tag)
+
+        if do_review:
+            notes = list(a.find_notes(query))
+            for i, note in enumerate(notes):
+                if not note.review(i, len(notes)):
+                    break
+
+@main.command()
+@click.argument('query', required=False)
+@click.option('-d', '--days', type=click.IntRange(1, 365), default=30,
+              show_default=True, help='Number of days to forecast.')
+@click.option('-n', '--new', 'n_new', type=click.IntRange(0), default=0,
+              show_default=True, help='Hypothetical new cards per day.')
+@click.option('--sims', type=click.IntRange(1), default=100,
+              show_default=True, help='Number of simulations.')
+@click.option('--retention', type=click.FloatRange(0, 1),
+              help='Retention to simulate (default: estimated from reviews).')
+@click.option('--seed', type=int, help='Seed for the random numbers.')
+@click.option('-j', '--json', 'as_json', is_flag=True,
+              help='Print forecast as JSON.')
+def forecast(query, days, n_new, sims, retention, seed, as_json):
+    """Forecast review load for cards that match query.
+
+    Simulates future reviews of review and learning cards, where each review
+    is passed with the given retention (by default the retention of the last
+    90 days). The output shows the mean and the 10th to 90th percentile range
+    of the number of reviews per day (per week for more than 60 days).
+
+    Use --new to see how the load changes when adding new cards every day,
+    e.g. before importing a large file with add-from-file.
+
+    This command requires NumPy.
+    """
+    bucket = 7 if days > 60 and not as_json else 1
+    with Anki(**cfg, read_only=True) as a:
+        result = compute_forecast(a, query, days, n_new, sims, retention,
+                                  seed, bucket)
+
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+    else:
+        print_forecast(result)
+
+@main.command()
+@click.argument('query', required=False)
+@click.option('-n', '--top', type=int, default=10, show_default=True,
+              help='Number of lapse hot spots to show.')
+@click.option('-j', '--json', 'as_json', is_flag=True,
+              help='Print statistics as JSON.')
+@click.option('--chunk-size', type=int, default=100000, show_default=True,
+              help='Number of rows to load at a time.')
+def stats(query, top, as_json, chunk_size):
+    """Print review statistics for cards that match query.
+
+    Shows retention (share of reviews that were not answered with "Again")
+    by deck, model and tag, the distribution of ease factors and intervals of
+    review cards, the cards and decks with the most lapses, and percentiles of
+    the time spent per review.
+
+    This command requires NumPy. The review log is read in chunks, so the
+    memory usage is bounded by the number of cards.
+    """
+    with Anki(**cfg, read_only=True) as a:
+        result = compute_stats(a, query, chunk_size, top)
+
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+    else:
+        print_stats(result)
+
+def _change_cards(query, where, verbs, apply, dry_run):
+    """Apply change to cards that match query and need to be changed
+
+    The argument where is an SQL condition for cards that need to be
+    changed (or a function that returns it), and verbs is a tuple of the
+    present and past tense of the change (e.g. ('suspend', 'suspended')).
+    """
+    with Anki(**cfg, read_only=dry_run) as a:
+        if callable(where):
+            where = where(a)
+
+        n_matched, cids = a.select_cards(query, where)
+        if n_matched == 0:
+            click.echo('No matching cards!')
+            raise click.Abort()
+
+        if dry_run:
+            click.echo(f'Would {verbs[0]} {len(cids)} of {n_matched} '
+                       'matched cards.')
+            return
+
+        apply(a, cids)
+        click.echo(f'{verbs[1].capitalize()} {len(cids)} of {n_matched} '
+                   'matched cards.')
+
+@main.command()
+@click.argument('query')
+@click.option('--dry-run', is_flag=True,
+              help='Only print the number of cards that would change.')
+def suspend(query, dry_run):
+    """Suspend cards that match query."""
+    _change_cards(query, 'queue != -1', ('suspend', 'suspended'),
+                  lambda a, cids: a.suspend_cards(cids), dry_run)
+
+@main.command()
+@click.argument('query')
+@click.option('--dry-run', is_flag=True,
+              help='Only print the number of cards that would change.')
+def unsuspend(query, dry_run):
+    """Unsuspend cards that match query."""
+    _change_cards(query, 'queue = -1', ('unsuspend', 'unsuspended'),
+                  lambda a, cids: a.suspend_cards(cids, False), dry_run)
+
+@main.command()
+@click.argument('query')
+@click.argument('color', type=click.Choice(FLAGS))
+@click.option('--dry-run', is_flag=True,
+              help='Only print the number of cards that would change.')
+def flag(query, color, dry_run):
+    """Flag cards that match query with COLOR."""
+    _change_cards(query, f'flags & 7 != {FLAGS[color]}', ('flag', 'flagged'),
+                  lambda a, cids: a.flag_cards(cids, FLAGS[color]), dry_run)
+
+@main.command()
+@click.argument('query')
+@click.option('--dry-run', is_flag=True,
+              help='Only print the number of cards that would change.')
+def unflag(query, dry_run):
+    """Remove flags from cards that match query."""
+    _change_cards(query, 'flags & 7 != 0', ('unflag', 'unflagged'),
+                  lambda a, cids: a.flag_cards(cids, 0), dry_run)
+
+@main.command()
+@click.argument('query')
+@click.argument('deck')
+@click.option('--dry-run', is_flag=True,
+              help='Only print the number of cards that would change.')
+def move(query, deck, dry_run):
+    """Move cards that match query to DECK."""
+    def where(a):
+        did = a.deck_name_to_id.get(deck)
+        if did is None:
+            click.echo(f'Deck "{deck}" was not recognized!')
+            raise click.Abort()
+        return f'did != {did}'
+
+    _change_cards(query, where, ('move', 'moved'),
+                  lambda a, cids: a.move_cards(cids, deck), dry_run)
+
 @main.command()
 def sync():
     """Synchronize collection with AnkiWeb."""
@@ -285,18 +847,24 @@ def sync():
               help='Add specified tags to matched notes.')
 @click.option('-r', '--remove-tags',
               help='Add specified tags to matched notes.')
-def tag(query, add_tags, remove_tags):
+@click.option('-S', '--search', 'search_text',
+              help='Restrict to notes that match full-text search.')
+def tag(query, add_tags, remove_tags, search_text):
     """List tags or add/remove tags from matching notes.
 
     If neither of the options --add-tags or --remove-tags are supplied, then
     this command simply lists all tags.
     """
-    with Anki(**cfg) as a:
-        if add_tags is None and remove_tags is None:
+    read_only = add_tags is None and remove_tags is None
+    with Anki(**cfg, read_only=read_only) as a:
+        if read_only:
             a.list_tags()
             return
 
-        n_notes = len(list(a.find_notes(query)))
+        if search_text:
+            query = a.restrict_query(query, search_text)
+
+        n_notes = len(a.find_note_ids(query))
         if n_notes == 0:
             click.echo('No matching notes!')
             raise click.Abort()
@@ -319,6 +887,47 @@ def tag(query, add_tags, remove_tags):
         if remove_tags is not None:
             a.change_tags(query, remove_tags, add=False)
 
+@main.command()
+@click.argument('query', default='deck:*')
+@click.option('-o', '--output', type=click.Path(dir_okay=False),
+              help='Write JSON lines to file instead of stdout.')
+@click.option('-c', '--checkpoint', type=click.Path(dir_okay=False),
+              help='Save progress to file and resume from it.')
+@click.option('-j', '--jobs', type=click.IntRange(1),
+              help='Number of processes [default: number of CPUs].')
+@click.option('--chunk-size', type=click.IntRange(1), default=200,
+              show_default=True, help='Number of notes per task.')
+def verify(query, output, checkpoint, jobs, chunk_size):
+    """Verify that generated notes match their Markdown.
+
+    Converts the original Markdown of generated fields in notes that match
+    query again, and compares the result with the stored HTML. Fields that
+    differ (e.g. because they were edited in Anki) are printed as JSON lines
+    while the verification runs.
+
+    With --checkpoint, the progress is saved after each chunk of notes, and
+    an interrupted run with the same query continues where it stopped (the
+    output file is then appended to). The checkpoint file is removed when
+    the run completes.
+    """
+    state = Checkpoint(checkpoint, query)
+    resume = state.last is not None
+    if resume:
+        click.echo(f'Resuming after note {state.last}', err=True)
+
+    with Anki(**cfg, read_only=True) as a, \
+            click.open_file(output or '-', 'a' if resume else 'w',
+                            encoding='utf-8') as out:
+        def emit(result):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+
+        counts = verify_notes(a, query, emit, state, jobs, chunk_size)
+
+    click.echo(f"Verified {counts['fields']} generated fields in "
+               f"{counts['notes']} notes: {counts['drifting']} differ",
+               err=True)
+
 
 if __name__ == '__main__':
     # pylint: disable=no-value-for-parameter
@@ -18,6 +18,11 @@ else:
 for required, default in [('base', None),
                           ('profile', None),
                           ('path', None),
+                          ('batch_size', 1000),
+                          ('highlight_classes', False),
+                          ('lock_timeout', 30),
+                          ('markdown_encoding', 'base64'),
+                          ('query_cache_size', 2**25),
                           ('presets', {})]:
     if required not in cfg:
         cfg[required] = default
@@ -1,7 +1,11 @@
 """Convert between formats/targets"""
 
 import re
+import zlib
 import base64
+from functools import lru_cache
+from html import escape
+from html.parser import HTMLParser
 import markdown
 import click
 from bs4 import BeautifulSoup, Tag
@@ -11,6 +15,32 @@ from markdown.extensions.def_list import DefListExtension
 from markdown.extensions.fenced_code import FencedCodeExtension
 from markdown.extensions.footnotes import FootnoteExtension
 
+from apy import trace
+from apy.config import cfg
+
+# Pygments style for syntax highlighting of code blocks
+HIGHLIGHT_STYLE = 'friendly'
+
+# Parser backend for BeautifulSoup (lxml is much faster than html.parser)
+try:
+    import lxml  # pylint: disable=unused-import
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# Pygments is optional, without it code blocks are not highlighted
+try:
+    from pygments.formatters import HtmlFormatter
+except ImportError:
+    HtmlFormatter = None
+
+# Prefix of compact (zlib compressed) original Markdown
+COMPACT_PREFIX = 'z:'
+
+# Markers around the highlight stylesheet in the model CSS
+HIGHLIGHT_CSS_START = '/* apy highlight start */'
+HIGHLIGHT_CSS_END = '/* apy highlight end */'
+
 
 def markdown_file_to_notes(filename):
     """Parse notes data from Markdown file
@@ -160,8 +190,15 @@ def _parse_file(filename):
     return defaults, notes
 
 
-def markdown_to_html(plain):
-    """Convert Markdown to HTML"""
+@trace.traced('convert.markdown_to_html')
+def markdown_to_html(plain, highlight_classes=None):
+    """Convert Markdown to HTML
+
+    Code blocks are highlighted with inline styles, or with CSS classes if
+    highlight_classes is True (default: cfg['highlight_classes']). The
+    stylesheet for the classes must then be in the model CSS (see
+    with_highlight_css).
+    """
     # Don't convert if plain text is really plain
     if re.match(r"[a-zA-Z0-9æøåÆØÅ ,.?+-]*$", plain):
         return plain
@@ -181,13 +218,26 @@ def markdown_to_html(plain):
     plain = plain.replace(r"\(", r"\\(")
     plain = plain.replace(r"\)", r"\\)")
 
+    return _render_markdown(plain, highlight_classes)
+
+def _render_markdown(plain, highlight_classes=None):
+    """Convert escaped Markdown to HTML and store it in the HTML
+
+    The Markdown is stored as is in the data-original-markdown attribute,
+    so that generated HTML can be rendered again from the stored value.
+    """
+    if highlight_classes is None:
+        highlight_classes = cfg['highlight_classes']
+
+    trace.count('fields.converted')
+
     html = markdown.markdown(plain, extensions=[
         'tables',
         AbbrExtension(),
         CodeHiliteExtension(
-            noclasses=True,
+            noclasses=not highlight_classes,
             linenums=False,
-            pygments_style='friendly',
+            pygments_style=HIGHLIGHT_STYLE,
             guess_lang=False,
         ),
         DefListExtension(),
@@ -195,23 +245,105 @@ def markdown_to_html(plain):
         FootnoteExtension(),
         ], output_format="html5")
 
-    html_tree = BeautifulSoup(html, 'html.parser')
+    html_tree = parse_html(html)
 
     tag = _get_first_tag(html_tree)
     if not tag:
         if not html:
             # Add space to prevent input field from shrinking in UI
             html = "&nbsp;"
-        html_tree = BeautifulSoup(f"<div>{html}</div>", "html.parser")
+        html_tree = parse_html(f"<div>{html}</div>")
         tag = _get_first_tag(html_tree)
 
     # Store original text as data-attribute on tree root
-    # Note: convert newlines to <br> to make text readable in the Anki viewer
-    original_html = base64.b64encode(
+    tag['data-original-markdown'] = encode_markdown(plain)
+
+    return serialize_html(html_tree)
+
+def encode_markdown(plain, encoding=None):
+    """Encode original Markdown for the data-original-markdown attribute
+
+    The encoding is 'base64' (of the text with newlines converted to <br> to
+    make it readable in the Anki viewer) or 'compact' (zlib compressed and
+    base64 encoded, with a prefix). The compact encoding is only used if it
+    is actually smaller. Default: cfg['markdown_encoding'].
+    """
+    if encoding is None:
+        encoding = cfg['markdown_encoding']
+
+    legacy = base64.b64encode(
         plain.replace("\n", "<br />").encode('utf-8')).decode()
-    tag['data-original-markdown'] = original_html
+    if encoding != 'compact':
+        return legacy
+
+    compact = COMPACT_PREFIX + base64.b64encode(
+        zlib.compress(plain.encode('utf-8'), 9)).decode()
+    return compact if len(compact) < len(legacy) else legacy
+
+def decode_markdown(encoded):
+    """Decode value of the data-original-markdown attribute"""
+    if encoded.startswith(COMPACT_PREFIX):
+        return zlib.decompress(base64.b64decode(
+            encoded[len(COMPACT_PREFIX):])).decode('utf-8')
+
+    converted = base64.b64decode(encoded.encode()).decode('utf-8')
+    return converted.replace("<br>", "\n").replace("<br />", "\n")
+
+def reencode_markdown(html, encoding=None):
+    """Change encoding of the original Markdown in generated HTML
+
+    Only the attribute value is replaced, the rest of the HTML is kept as is.
+    """
+    if not is_generated_html(html):
+        return html
+
+    match = re.search(r'data-original-markdown="([^"]*)"', html)
+    if match is None:
+        return html
+
+    encoded = encode_markdown(decode_markdown(match[1]), encoding)
+    return html[:match.start(1)] + encoded + html[match.end(1):]
+
+@lru_cache(maxsize=None)
+def highlight_css():
+    """Get stylesheet for class-based highlighting (enclosed by markers)"""
+    css = ''
+    if HtmlFormatter is not None:
+        css = HtmlFormatter(style=HIGHLIGHT_STYLE).get_style_defs('.codehilite')
+
+    return f'{HIGHLIGHT_CSS_START}\n{css}\n{HIGHLIGHT_CSS_END}'
+
+def with_highlight_css(css):
+    """Add or update the highlight stylesheet in model CSS"""
+    block = highlight_css()
+    pattern = re.escape(HIGHLIGHT_CSS_START) + '.*?' \
+        + re.escape(HIGHLIGHT_CSS_END)
+    if re.search(pattern, css, flags=re.S):
+        return re.sub(pattern, lambda _: block, css, flags=re.S)
+
+    return css.rstrip('\n') + '\n\n' + block + '\n'
 
-    return str(html_tree)
+def rerender_markdown(html, highlight_classes=None):
+    """Convert the original Markdown of generated HTML again
+
+    The stored original Markdown is converted as is. Returns the HTML
+    unchanged if it was not generated from Markdown.
+    """
+    if not is_generated_html(html):
+        return html
+
+    return _render_markdown(html_to_markdown(html), highlight_classes)
+
+def rerender_highlight(html, highlight_classes=True):
+    """Re-render generated HTML with highlighted code blocks
+
+    Returns the HTML unchanged if it has no highlighted code blocks or was
+    not generated from Markdown.
+    """
+    if 'codehilite' not in html:
+        return html
+
+    return rerender_markdown(html, highlight_classes)
 
 def plain_to_html(plain):
     """Convert plain text to html"""
@@ -231,18 +363,16 @@ def plain_to_html(plain):
 
 def html_to_markdown(html):
     """Extract Markdown from generated HTML"""
-    tag = _get_first_tag(BeautifulSoup(html, 'html.parser'))
-    encoded_bytes = tag['data-original-markdown'].encode()
-    converted = base64.b64decode(encoded_bytes).decode('utf-8')
-    return converted.replace("<br>", "\n").replace("<br />", "\n")
+    return decode_markdown(_first_tag_attrs(html)['data-original-markdown'])
 
+@trace.traced('convert.html_to_screen')
 def html_to_screen(html, pprint=True, parseable=False):
     """Convert html for printing to screen"""
     if not pprint:
-        soup = BeautifulSoup(html.replace('\n', ''),
-                             features='html5lib').next.next.next
-        return "".join([el.prettify() if isinstance(el, Tag) else el
-                        for el in soup.contents])
+        printer = _PrettyPrinter()
+        printer.feed(html.replace('\n', ''))
+        printer.close()
+        return printer.result()
 
     html = re.sub(r'\<style\>.*\<\/style\>', '', html, flags=re.S)
 
@@ -296,17 +426,63 @@ def html_to_screen(html, pprint=True, parseable=False):
 
     return plain.strip()
 
+def html_to_text(html):
+    """Extract plain text from field HTML
+
+    Generated HTML is decoded to the original Markdown, other HTML is
+    stripped of tags (line breaks are kept as newlines).
+    """
+    if is_generated_html(html):
+        return html_to_markdown(html)
+
+    if '<' not in html and '&' not in html:
+        return html.strip()
+
+    html = re.sub(r'\<br\s*/?\>|\<div[^>]*\>|\</p\>|\</li\>', '\n', html)
+    return parse_html(html).get_text().strip()
+
 def is_generated_html(html):
     """Check if text is a generated HTML"""
-    if html is None:
+    if html is None or 'data-original-markdown' not in html:
         return False
 
-    tag = _get_first_tag(BeautifulSoup(html, 'html.parser'))
+    attrs = _first_tag_attrs(html)
+    return attrs is not None and 'data-original-markdown' in attrs
+
 
-    return (tag is not None
-            and tag.attrs is not None
-            and 'data-original-markdown' in tag.attrs)
+def parse_html(html, parser=None):
+    """Parse HTML fragment (default parser: HTML_PARSER)
+
+    Returns a tree whose children are the top level nodes of the fragment.
+    Since lxml parses complete documents, the fragment is then wrapped in a
+    custom element (which also prevents lxml from wrapping text in <p>), and
+    the wrapper is returned.
+    """
+    parser = parser or HTML_PARSER
+    if parser == 'html.parser':
+        return BeautifulSoup(html, parser)
 
+    tree = BeautifulSoup(f'<apy-fragment>{html}</apy-fragment>', parser)
+    return tree.find('apy-fragment')
+
+def serialize_html(tree):
+    """Convert tree from parse_html back to HTML"""
+    return ''.join(str(x) for x in tree.contents)
+
+def _first_tag_attrs(html):
+    """Get attributes of the first tag in HTML (None if there is no tag)
+
+    This is equivalent to _get_first_tag(parse_html(html)).attrs, but only
+    parses the HTML up to the first tag.
+    """
+    parser = _FirstTagParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except _FirstTagParser.Found:
+        pass
+
+    return parser.attrs
 
 def _get_first_tag(tree):
     """Get first tag among children of tree"""
@@ -315,3 +491,107 @@ def _get_first_tag(tree):
             return child
 
     return None
+
+
+class _FirstTagParser(HTMLParser):
+    """Parser that stops at the first tag (see _first_tag_attrs)"""
+
+    class Found(Exception):
+        """Raised to stop parsing"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.attrs = None
+
+    def handle_starttag(self, tag, attrs):
+        self.attrs = {k: '' if v is None else v for k, v in attrs}
+        raise self.Found()
+
+    def error(self, message):
+        """Raise parse errors (only called by older Python versions)"""
+        raise ValueError(message)
+
+
+class _PrettyPrinter(HTMLParser):
+    """Fast pretty printer for HTML
+
+    Tags and text are written on separate lines and indented by depth (like
+    BeautifulSoup.prettify), except for text at the top level and the
+    content of <pre> blocks, which is kept as is. End tags without a start
+    tag are ignored, and open tags are closed at the end.
+    """
+    VOID = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+            'link', 'meta', 'param', 'source', 'track', 'wbr'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.stack = []
+        self.pre = 0
+
+    def result(self):
+        """Get the pretty printed HTML"""
+        while self.stack:
+            self.handle_endtag(self.stack[-1])
+        return ''.join(self.out)
+
+    def error(self, message):
+        """Raise parse errors (only called by older Python versions)"""
+        raise ValueError(message)
+
+    def _line(self, text, depth=None):
+        depth = len(self.stack) if depth is None else depth
+        self.out.append(' '*depth + text + '\n')
+
+    def handle_starttag(self, tag, attrs):
+        text = '<' + tag + ''.join(
+            f' {k}' if v is None else f' {k}="{escape(v)}"'
+            for k, v in attrs)
+
+        if tag in self.VOID:
+            if self.pre:
+                self.out.append(text + '/>')
+            else:
+                self._line(text + '/>')
+            return
+
+        if self.pre:
+            self.out.append(text + '>')
+        elif tag == 'pre':
+            self.out.append(' '*len(self.stack) + text + '>')
+        else:
+            self._line(text + '>')
+
+        self.stack.append(tag)
+        if tag == 'pre' or self.pre:
+            self.pre += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in self.VOID:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+
+        while self.stack:
+            current = self.stack.pop()
+            if self.pre:
+                self.pre -= 1
+                self.out.append(f'</{current}>')
+                if not self.pre:
+                    self.out.append('\n')
+            else:
+                self._line(f'</{current}>')
+
+            if current == tag:
+                break
+
+    def handle_data(self, data):
+        if self.pre:
+            self.out.append(escape(data, quote=False))
+        elif not self.stack:
+            self.out.append(data)
+        elif data.strip():
+            self._line(escape(data.strip(), quote=False))
@@ -0,0 +1,186 @@
+"""Differences between two snapshots of a collection
+
+Both collection files are opened read-only with sqlite3 (not through Anki),
+and the notes and cards are streamed in sorted order and merge-joined: notes
+by guid, cards by id. Only the keys and modification times are read for the
+join, so unchanged notes are skipped without reading their fields, and the
+memory usage does not depend on the size of the collections (there is no
+index on the guid, but SQLite sorts large results in temporary files).
+"""
+import json
+import sqlite3
+from pathlib import Path
+
+import click
+
+from apy import trace
+from apy.convert import html_to_text
+
+# Card properties that are compared for scheduling changes
+CARD_COLUMNS = ['nid', 'did', 'ord', 'type', 'queue', 'due', 'ivl', 'factor',
+                'reps', 'lapses', 'flags']
+
+
+def connect_read_only(path):
+    """Open collection file read-only
+
+    Snapshots without a write-ahead log are opened as immutable, so that
+    SQLite does not create -wal and -shm files next to them.
+    """
+    path = Path(path)
+    if not path.is_file():
+        click.echo(f'No such collection: {path}')
+        raise click.Abort()
+
+    wal = path.with_name(path.name + '-wal')
+    mode = 'mode=ro' if wal.exists() else 'immutable=1'
+    return sqlite3.connect(f'{path.resolve().as_uri()}?{mode}', uri=True)
+
+def field_names(db):
+    """Map from model ids to lists of field names"""
+    models = db.execute('select models from col').fetchone()[0]
+    if models:
+        return {int(mid): [x['name'] for x in model['flds']]
+                for mid, model in json.loads(models).items()}
+
+    # Newer schema versions store the fields in a separate table
+    names = {}
+    for mid, name in db.execute('select ntid, name from fields '
+                                'order by ntid, ord'):
+        names.setdefault(mid, []).append(name)
+    return names
+
+def merge_join(old_rows, new_rows):
+    """Join rows that are sorted by their first column
+
+    Yields pairs (old, new), where old or new is None for rows that only
+    exist on one side.
+    """
+    old = next(old_rows, None)
+    new = next(new_rows, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield old, None
+            old = next(old_rows, None)
+        elif old is None or new[0] < old[0]:
+            yield None, new
+            new = next(new_rows, None)
+        else:
+            yield old, new
+            old = next(old_rows, None)
+            new = next(new_rows, None)
+
+def iter_diff(old_path, new_path):
+    """Yield records of differences between two collection files
+
+    The records are dicts with the operation ('add', 'delete' or 'modify'),
+    the type ('note' or 'card') and the ids. Modified notes have the old and
+    new text of changed fields and the added and removed tags, modified
+    cards have the old and new values of changed scheduling properties.
+    """
+    old_db = connect_read_only(old_path)
+    new_db = connect_read_only(new_path)
+    try:
+        with trace.span('diff.notes'):
+            yield from _diff_notes(old_db, new_db)
+        with trace.span('diff.cards'):
+            yield from _diff_cards(old_db, new_db)
+    finally:
+        old_db.close()
+        new_db.close()
+
+def _diff_notes(old_db, new_db):
+    """Yield differences between notes (see iter_diff)"""
+    old_names = field_names(old_db)
+    new_names = field_names(new_db)
+
+    sql = 'select guid, id, mod from notes order by guid'
+    for old, new in merge_join(iter(old_db.execute(sql)),
+                               iter(new_db.execute(sql))):
+        if old is None:
+            yield {'op': 'add', 'type': 'note', 'guid': new[0], 'id': new[1]}
+        elif new is None:
+            yield {'op': 'delete', 'type': 'note', 'guid': old[0],
+                   'id': old[1]}
+        elif old[1:] != new[1:]:
+            record = _compare_notes(
+                old_db.execute('select mid, tags, flds from notes '
+                               'where id = ?', (old[1],)).fetchone(),
+                new_db.execute('select mid, tags, flds from notes '
+                               'where id = ?', (new[1],)).fetchone(),
+                old_names, new_names)
+            if record:
+                yield {'op': 'modify', 'type': 'note', 'guid': new[0],
+                       'id': new[1], **record}
+
+def _compare_notes(old, new, old_names, new_names):
+    """Compare note rows (mid, tags, flds) and return dict of differences"""
+    record = {}
+
+    old_fields = dict(zip(old_names.get(old[0], []), old[2].split('\x1f')))
+    new_fields = dict(zip(new_names.get(new[0], []), new[2].split('\x1f')))
+    fields = {}
+    for name in list(old_fields) + [x for x in new_fields
+                                    if x not in old_fields]:
+        old_html = old_fields.get(name)
+        new_html = new_fields.get(name)
+        if old_html != new_html:
+            fields[name] = {
+                'old': None if old_html is None else html_to_text(old_html),
+                'new': None if new_html is None else html_to_text(new_html),
+            }
+    if fields:
+        record['fields'] = fields
+
+    old_tags = set(old[1].split())
+    new_tags = set(new[1].split())
+    if old_tags != new_tags:
+        record['tags'] = {'added': sorted(new_tags - old_tags),
+                          'removed': sorted(old_tags - new_tags)}
+
+    if old[0] != new[0]:
+        record['model'] = {'old': old[0], 'new': new[0]}
+
+    return record
+
+def _diff_cards(old_db, new_db):
+    """Yield differences between cards (see iter_diff)"""
+    sql = f"select id, mod, {', '.join(CARD_COLUMNS)} from cards order by id"
+    for old, new in merge_join(iter(old_db.execute(sql)),
+                               iter(new_db.execute(sql))):
+        if old is None:
+            yield {'op': 'add', 'type': 'card', 'id': new[0], 'nid': new[2]}
+        elif new is None:
+            yield {'op': 'delete', 'type': 'card', 'id': old[0],
+                   'nid': old[2]}
+        elif old[1] != new[1]:
+            changes = {name: [x, y] for name, x, y
+                       in zip(CARD_COLUMNS, old[2:], new[2:]) if x != y}
+            if changes:
+                yield {'op': 'modify', 'type': 'card', 'id': new[0],
+                       'nid': new[2], 'changes': changes}
+
+def summarize(records):
+    """Count records by type and kind of change"""
+    counts = {}
+    for record in records:
+        kinds = [record['op']]
+        if record['op'] == 'modify':
+            kinds = [x for x in ('fields', 'tags', 'model')
+                     if x in record] or list(record.get('changes', {}))
+        for kind in kinds:
+            key = (record['type'], kind)
+            counts[key] = counts.get(key, 0) + 1
+
+    return counts
+
+def print_summary(counts):
+    """Print summary of differences"""
+    if not counts:
+        click.echo('No differences')
+        return
+
+    click.echo(f"{'Type':8s} {'Change':12s} {'Count':>8s}")
+    click.echo('-'*30)
+    for (kind, change), count in sorted(counts.items()):
+        click.echo(f'{kind:8s} {change:12s} {count:8d}')
@@ -0,0 +1,232 @@
+"""Detection of exact and near-duplicate notes
+
+The fields of each note are decoded (the original Markdown of generated
+fields, the plain text of other fields) and normalized by folding whitespace
+and case. Exact duplicates are found by hashing the normalized text. Near
+duplicates are found with MinHash signatures of character shingles and
+locality sensitive hashing (LSH): notes that share a band of their signature
+are candidates, and candidates are accepted if the estimated similarity is
+above a threshold. Each note is hashed once, in blocks of shingles, so the
+memory usage does not depend on the length of the notes.
+"""
+import hashlib
+
+import click
+from anki.utils import ids2str
+
+from apy import trace
+from apy.convert import html_to_text
+from apy.stats import require_numpy, np
+from apy.utilities import chunked
+
+# Number of bytes per shingle (at most 8, a shingle is packed into 64 bits)
+SHINGLE_SIZE = 5
+
+# Number of MinHash permutations, and number of rows per LSH band
+NUM_PERM = 64
+BAND_ROWS = 4
+
+# Number of texts to compute MinHash signatures for at a time
+SIGNATURE_CHUNK = 256
+
+# Number of shingles to hash at a time
+SHINGLE_BLOCK = 4096
+
+
+def normalize(fields):
+    """Normalize list of field HTML to comparable text"""
+    text = ' '.join(html_to_text(x) for x in fields)
+    return ' '.join(text.casefold().split())
+
+def iter_normalized(a, query=None, chunk_size=1000):
+    """Yield (note id, normalized text) for notes that match query"""
+    if query:
+        nids = sorted(a.find_note_ids(query))
+        chunks = (a.col.db.all(f'select id, flds from notes '
+                               f'where id in {ids2str(chunk)}')
+                  for chunk in chunked(nids, chunk_size))
+    else:
+        chunks = _iter_all_notes(a.col.db, chunk_size)
+
+    for rows in chunks:
+        for nid, flds in rows:
+            yield nid, normalize(flds.split('\x1f'))
+
+def _iter_all_notes(db, chunk_size):
+    """Yield all notes as lists of (id, flds) rows in chunks"""
+    last = -2**63
+    while True:
+        rows = db.all('select id, flds from notes where id > ? '
+                      'order by id limit ?', last, chunk_size)
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield rows
+
+
+class MinHasher:
+    """MinHash signatures of byte shingles (multiply-shift hashing)"""
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2**63, num_perm, dtype='uint64') | 1
+        self.b = rng.integers(0, 2**63, num_perm, dtype='uint64')
+        self.shifts = np.arange(SHINGLE_SIZE, dtype='uint64')*8
+
+    def shingles(self, text):
+        """Get array of shingles (packed into uint64) of text"""
+        data = np.frombuffer(text.encode(), dtype='uint8').astype('uint64')
+        if len(data) < SHINGLE_SIZE:
+            data = np.pad(data, (0, SHINGLE_SIZE - len(data)))
+
+        windows = np.lib.stride_tricks.sliding_window_view(data, SHINGLE_SIZE)
+        return (windows << self.shifts).sum(axis=1)
+
+    def signature(self, text):
+        """Get signature (array of uint32) of text
+
+        The shingles are hashed in blocks and reduced to the minimum per
+        permutation.
+        """
+        shingles = self.shingles(text)
+        minima = np.full(len(self.a), np.iinfo('uint64').max, dtype='uint64')
+        for start in range(0, len(shingles), SHINGLE_BLOCK):
+            block = shingles[start:start + SHINGLE_BLOCK]
+            hashes = self.a[:, None]*block[None, :] + self.b[:, None]
+            np.minimum(minima, hashes.min(axis=1), out=minima)
+
+        return (minima >> np.uint64(32)).astype('uint32')
+
+    def signatures(self, texts):
+        """Get signatures (2D array of uint32, one row per text) of texts"""
+        return np.array([self.signature(x) for x in texts],
+                        dtype='uint32').reshape(-1, len(self.a))
+
+
+class UnionFind:
+    """Disjoint sets of integers 0..n-1"""
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        """Get representative of set that contains i"""
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i, j):
+        """Merge sets that contain i and j"""
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+    def groups(self):
+        """List of sets with more than one element"""
+        groups = {}
+        for i in range(len(self.parent)):
+            groups.setdefault(self.find(i), []).append(i)
+        return [x for x in groups.values() if len(x) > 1]
+
+
+def find_duplicates(a, query=None, threshold=0.8, near=True, chunk_size=1000):
+    """Find clusters of duplicate notes
+
+    Returns a list of clusters, each a dict with the note ids, whether the
+    notes are exact duplicates and the normalized text of the first note.
+    Empty notes are ignored.
+    """
+    if near:
+        require_numpy()
+        hasher = MinHasher()
+
+    nids = []
+    first_by_hash = {}
+    exact_of = {}
+    unique = []
+    pending = []
+    signatures = []
+    with trace.span('dupes.hash'):
+        for nid, text in iter_normalized(a, query, chunk_size):
+            if not text:
+                continue
+
+            digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+            first = first_by_hash.get(digest)
+            if first is not None:
+                exact_of[len(nids)] = first
+            else:
+                first_by_hash[digest] = len(nids)
+                unique.append(len(nids))
+                if near:
+                    pending.append(text)
+                    if len(pending) == SIGNATURE_CHUNK:
+                        signatures.append(hasher.signatures(pending))
+                        pending = []
+
+            nids.append(nid)
+
+        if pending:
+            signatures.append(hasher.signatures(pending))
+
+    sets = UnionFind(len(nids))
+    for i, first in exact_of.items():
+        sets.union(i, first)
+
+    if signatures:
+        with trace.span('dupes.lsh'):
+            _union_similar(sets, unique, np.concatenate(signatures),
+                           threshold)
+
+    clusters = [{
+        'nids': [nids[i] for i in group],
+        'exact': len({exact_of.get(i, i) for i in group}) == 1,
+    } for group in sets.groups()]
+
+    texts = {}
+    for chunk in chunked([x['nids'][0] for x in clusters], chunk_size):
+        for nid, flds in a.col.db.all('select id, flds from notes '
+                                      f'where id in {ids2str(chunk)}'):
+            texts[nid] = normalize(flds.split('\x1f'))
+    for cluster in clusters:
+        cluster['text'] = texts[cluster['nids'][0]]
+
+    trace.count('dupes.notes', len(nids))
+    return clusters
+
+def _union_similar(sets, index, matrix, threshold):
+    """Merge sets of notes with similar signatures (LSH candidates)
+
+    The signature in row k of matrix belongs to note index[k]. Each bucket
+    keeps one representative row per set, and each row is only compared with
+    the representatives of the other sets in its bucket.
+    """
+    for start in range(0, matrix.shape[1], BAND_ROWS):
+        buckets = {}
+        band = np.ascontiguousarray(matrix[:, start:start + BAND_ROWS])
+        for row, key in enumerate(band.view(f'V{band.itemsize*BAND_ROWS}')
+                                  .ravel().tolist()):
+            members = buckets.setdefault(key, {})
+            for other in members.values():
+                if sets.find(index[row]) != sets.find(index[other]) \
+                        and (matrix[row] == matrix[other]).mean() >= threshold:
+                    sets.union(index[row], index[other])
+
+            # Sets may have been merged, also by other bands and buckets
+            buckets[key] = {sets.find(index[other]): other
+                            for other in [row, *members.values()]}
+
+def print_duplicates(clusters, width=70):
+    """Print clusters of duplicates"""
+    for cluster in clusters:
+        kind = 'exact' if cluster['exact'] else 'similar'
+        click.secho(f"{len(cluster['nids'])} {kind}: ", fg='yellow', nl=False)
+        text = cluster['text']
+        click.echo(text[:width] + ('...' if len(text) > width else ''))
+        click.echo('  ' + ' '.join(str(x) for x in cluster['nids']))
+
+    n_notes = sum(len(x['nids']) for x in clusters)
+    click.echo(f'\n{len(clusters)} clusters with {n_notes} notes')
@@ -0,0 +1,166 @@
+"""Import of notes from CSV, TSV and JSONL files
+
+The records of the file are read one at a time and mapped to the fields of
+their model, converted to HTML in chunks (optionally in a pool of
+processes), and added in chunked transactions. Only one chunk of records is
+kept in memory at a time.
+
+Each record is a row (CSV, TSV) or an object (JSONL) with one value per
+column. The columns are read into the fields of the same names, unless they
+are mapped to other fields. The columns model, deck, tags and markdown are
+special: they set the model, deck and extra tags of the note, and whether
+the fields are Markdown.
+"""
+import csv
+import json
+
+import click
+
+from apy import trace
+from apy.config import cfg
+from apy.convert import markdown_to_html, plain_to_html
+from apy.utilities import chunked_iter, parallel_map
+
+# File formats by file extension
+FORMATS = {'.csv': 'csv', '.tsv': 'tsv', '.tab': 'tsv', '.jsonl': 'jsonl',
+           '.ndjson': 'jsonl'}
+
+
+def iter_records(stream, fmt):
+    """Yield records (dicts from columns to values) from file stream"""
+    if fmt != 'jsonl':
+        dialect = 'excel' if fmt == 'csv' else 'excel-tab'
+        yield from csv.DictReader(stream, dialect=dialect)
+        return
+
+    for i, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            click.echo(f'Invalid JSON on line {i}: {e}')
+            raise click.Abort()
+
+        if not isinstance(record, dict):
+            click.echo(f'Line {i} is not a JSON object!')
+            raise click.Abort()
+
+        yield record
+
+def parse_mapping(specs):
+    """Parse mapping specs [MODEL:]FIELD=COLUMN
+
+    Returns a dict from (model name or None, field name) to column names.
+    """
+    mapping = {}
+    for spec in specs:
+        target, sep, column = spec.partition('=')
+        model, _, field = target.rpartition(':')
+        if not sep or not field or not column:
+            click.echo(f'Invalid mapping: {spec}')
+            raise click.Abort()
+        mapping[(model or None, field)] = column
+
+    return mapping
+
+def prepare_notes(a, records, model_name, deck=None, tags='',
+                  markdown=False, mapping=None):
+    """Map records to tuples (model name, deck, tags, markdown, fields)
+
+    The arguments give the defaults for records without model, deck and
+    markdown columns; the tags are added to the tags of each record.
+    """
+    mapping = mapping or {}
+    columns = {}
+    for i, record in enumerate(records, 1):
+        model = record.get('model') or model_name
+        if model not in columns:
+            field_names = a.model_field_names(model)
+            if field_names is None:
+                click.echo(f'Model "{model}" of record {i} was not '
+                           'recognized!')
+                raise click.Abort()
+            columns[model] = [
+                mapping.get((model, x), mapping.get((None, x), x))
+                for x in field_names]
+
+        record_tags = record.get('tags') or ''
+        if isinstance(record_tags, list):
+            record_tags = ' '.join(record_tags)
+
+        yield (model,
+               record.get('deck') or deck,
+               f'{tags} {record_tags}'.strip(),
+               _is_true(record.get('markdown', markdown)),
+               ['' if record.get(x) is None else str(record.get(x))
+                for x in columns[model]])
+
+def _is_true(value):
+    """Interpret value of markdown column (or option)"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+def convert_chunk(notes):
+    """Convert fields of prepared notes to HTML (run in worker processes)"""
+    return [(model, deck, tags, markdown,
+             [markdown_to_html(x) if markdown else plain_to_html(x)
+              for x in fields])
+            for model, deck, tags, markdown, fields in notes]
+
+def import_notes(a, notes, jobs=1, progress=None, chunk_size=500):
+    """Add prepared notes (see prepare_notes) to the collection
+
+    The fields are converted in chunks, in a pool of processes if jobs is
+    not 1 (None uses all CPUs). Empty notes and duplicates (by the first
+    field) are skipped. If given, progress is called with the number of
+    notes after each chunk.
+
+    Returns a dict with the number of read, added and skipped notes.
+    """
+    stats = {'notes': 0, 'added': 0, 'skipped': 0}
+    chunks = chunked_iter(notes, chunk_size)
+    results = map(convert_chunk, chunks) if jobs == 1 \
+        else parallel_map(convert_chunk, chunks, jobs)
+
+    home_decks = {}
+    styled = set()
+    try:
+        with a.batch():
+            for chunk in results:
+                with trace.span('import.chunk'):
+                    for model_name, deck, tags, markdown, fields in chunk:
+                        model = a.set_model(model_name)
+                        home_decks.setdefault(model['id'], model['did'])
+                        model['did'] = a.ensure_deck(deck) if deck \
+                            else home_decks[model['id']]
+
+                        if markdown and cfg['highlight_classes'] \
+                                and model['id'] not in styled:
+                            a.ensure_highlight_css(model)
+                            styled.add(model['id'])
+
+                        note = a.col.newNote(forDeck=False)
+                        note.fields = fields
+                        for tag in tags.split():
+                            note.addTag(tag)
+
+                        if note.dupeOrEmpty():
+                            stats['skipped'] += 1
+                            continue
+
+                        a.col.addNote(note)
+                        a.mark_modified()
+                        stats['added'] += 1
+
+                stats['notes'] += len(chunk)
+                if progress is not None:
+                    progress(len(chunk))
+    finally:
+        # Restore the default decks of the models
+        for mid, did in home_decks.items():
+            a.col.models.get(mid)['did'] = did
+
+    return stats
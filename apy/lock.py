@@ -0,0 +1,173 @@
+"""Coordinate access to an Anki collection between apy processes"""
+import os
+import time
+import fcntl
+import random
+import sqlite3
+from pathlib import Path
+
+
+class CollectionLock:
+    """Readers/writer lock for a collection based on a lock file
+
+    Waiting processes queue up in a directory next to the collection: each
+    waiter creates a ticket file and only tries to take the lock when no older
+    ticket is in the way. Readers (shared=True) may hold the lock together,
+    while writers hold it exclusively. Waiting is done with bounded exponential
+    backoff, and TimeoutError is raised if the lock is not acquired within
+    timeout seconds.
+    """
+
+    def __init__(self, path, shared=False, timeout=30):
+        path = Path(path)
+        self.lockfile = path.with_suffix('.apylock')
+        self.queuedir = path.with_suffix('.apyqueue')
+        self.shared = shared
+        self.timeout = timeout
+        self._fd = None
+        self._ticket = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.release()
+
+    def acquire(self):
+        """Wait in the queue and acquire the lock"""
+        self._fd = os.open(self.lockfile, os.O_RDWR | os.O_CREAT, 0o644)
+        operation = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+
+        try:
+            self._enqueue()
+            for _ in backoff(self.timeout):
+                if not self._is_my_turn():
+                    continue
+
+                try:
+                    fcntl.flock(self._fd, operation | fcntl.LOCK_NB)
+                    return
+                except BlockingIOError:
+                    continue
+
+            raise TimeoutError(f'Could not lock {self.lockfile} '
+                               f'within {self.timeout} seconds')
+        except BaseException:
+            os.close(self._fd)
+            self._fd = None
+            raise
+        finally:
+            self._dequeue()
+
+    def release(self):
+        """Release the lock"""
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def _enqueue(self):
+        """Create a ticket in the queue"""
+        kind = 'r' if self.shared else 'w'
+        self.queuedir.mkdir(exist_ok=True)
+        self._ticket = self.queuedir / f'{time.time_ns():020d}-{os.getpid()}-{kind}'
+        self._ticket.touch()
+
+    def _dequeue(self):
+        """Remove our ticket from the queue"""
+        if self._ticket is not None:
+            try:
+                self._ticket.unlink()
+            except FileNotFoundError:
+                pass
+            self._ticket = None
+
+    def _is_my_turn(self):
+        """Check that no older ticket should be served before ours
+
+        Tickets of dead processes are removed. Writers must be first in the
+        queue, readers may only be preceded by other readers.
+        """
+        for ticket in sorted(os.listdir(self.queuedir)):
+            if ticket == self._ticket.name:
+                return True
+
+            try:
+                _, pid, kind = ticket.split('-')
+                pid = int(pid)
+            except ValueError:
+                continue
+
+            if not _is_alive(pid):
+                try:
+                    (self.queuedir / ticket).unlink()
+                except FileNotFoundError:
+                    pass
+                continue
+
+            if not self.shared or kind == 'w':
+                return False
+
+        return True
+
+
+def copy_snapshot(path, directory, timeout=30):
+    """Copy the last committed state of a collection into directory
+
+    The collection is read through a read-only SQLite connection with the
+    backup API, so the copy is consistent and does not wait for writers
+    (except while they commit, if the collection is not in WAL mode). The
+    media folder of the copy links to the media folder of the collection.
+    Returns the path of the copy. TimeoutError is raised if the collection
+    stays locked for timeout seconds.
+    """
+    path = Path(path).resolve()
+    target = Path(directory) / 'collection.anki2'
+    for _ in backoff(timeout):
+        try:
+            src = sqlite3.connect(f'{path.as_uri()}?mode=ro', uri=True)
+            dst = sqlite3.connect(target)
+            try:
+                src.backup(dst)
+                break
+            finally:
+                dst.close()
+                src.close()
+        except sqlite3.OperationalError:
+            continue
+    else:
+        raise TimeoutError(f'Could not read {path} within {timeout} seconds')
+
+    media = path.with_suffix('.media')
+    if media.is_dir():
+        target.with_suffix('.media').symlink_to(media)
+
+    return str(target)
+
+
+def backoff(timeout, initial=0.05, maximum=2.0):
+    """Yield until timeout with bounded exponential backoff between yields"""
+    deadline = time.monotonic() + timeout
+    delay = initial
+    while True:
+        yield
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+
+        time.sleep(min(delay*random.uniform(0.5, 1), remaining))
+        delay = min(2*delay, maximum)
+
+
+def _is_alive(pid):
+    """Check if process with given pid exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
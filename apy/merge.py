@@ -0,0 +1,293 @@
+"""Merge of another collection into the current collection
+
+The other collection file is opened read-only with sqlite3 and its notes are
+streamed in chunks. Each chunk is written with bulk inserts, together with
+the cards and the review log of the new notes, and the media files that the
+notes refer to are copied. Notes are matched by guid with an index of the
+notes in the current collection that is built once before the merge.
+
+Models are matched by name and field names, or else by id if the local
+model with the same id has the same fields and templates (a model that was
+imported by an earlier merge and then renamed); models without a match are
+imported. Decks are matched by name and
+created as needed. Scheduling is kept: due dates of review cards are shifted
+to the creation day of the current collection, and new cards are placed
+after the existing new cards.
+"""
+import json
+import re
+import shutil
+from pathlib import Path
+
+import click
+from anki.utils import ids2str, splitFields, stripHTMLMedia
+
+from apy import trace
+from apy.diff import connect_read_only
+
+NOTE_COLUMNS = 'id, guid, mid, mod, usn, tags, flds, sfld, csum, flags, data'
+CARD_COLUMNS = ('id, nid, did, ord, mod, usn, type, queue, due, ivl, factor, '
+                'reps, lapses, left, odue, odid, flags, data')
+REVLOG_COLUMNS = 'id, cid, usn, ease, ivl, lastIvl, factor, time, type'
+
+
+def count_notes(path):
+    """Get number of notes in collection file"""
+    db = connect_read_only(path)
+    try:
+        return db.execute('select count() from notes').fetchone()[0]
+    finally:
+        db.close()
+
+def load_col_json(db, column):
+    """Load JSON column (e.g. models or decks) of the col table"""
+    data = db.execute(f'select {column} from col').fetchone()[0]
+    if not data:
+        click.echo('The collection schema is not supported (no '
+                   f'{column} in the col table)!')
+        raise click.Abort()
+
+    return json.loads(data)
+
+def resolve_models(a, models):
+    """Map ids of models from another collection to local models
+
+    Models are matched by name and field names, or else by id if the local
+    model has the same type, field names and templates (so models that were
+    imported by an earlier merge and then renamed are matched again). Models
+    without a match are imported. Returns the map, the names of the imported
+    models, and the pairs of names of the models that were matched by id.
+    """
+    def key(model):
+        return model['name'], tuple(f['name'] for f in model['flds'])
+
+    def structure(model):
+        return (model['type'], tuple(f['name'] for f in model['flds']),
+                tuple((t['name'], t['qfmt'], t['afmt'])
+                      for t in model['tmpls']))
+
+    by_key = {key(m): m for m in a.col.models.all()}
+
+    mapping = {}
+    imported = []
+    renamed = []
+    for mid, model in models.items():
+        match = by_key.get(key(model))
+        if match is None:
+            match = a.col.models.get(int(mid))
+            if match is not None and structure(match) == structure(model):
+                renamed.append((model['name'], match['name']))
+            else:
+                match = a.import_model(model)
+                imported.append(match['name'])
+                by_key[key(match)] = match
+        mapping[int(mid)] = match
+
+    return mapping, imported, renamed
+
+def merge_collection(a, path, update=False, media=True, progress=None,
+                     chunk_size=1000):
+    """Merge notes, cards and review log of another collection file
+
+    Notes whose guid exists in the current collection are skipped, or with
+    update=True, updated if they were modified later in the other collection
+    (and have the same model). If given, progress is called with the number
+    of notes after each chunk.
+
+    Returns a dict with the number of notes, added, updated and skipped
+    notes, cards, reviews and copied media files, the names of the imported
+    models, and the pairs of names of renamed models (see resolve_models).
+    """
+    stats = {'notes': 0, 'added': 0, 'updated': 0, 'skipped': 0, 'cards': 0,
+             'reviews': 0, 'media': 0, 'models': [], 'renamed': []}
+
+    other = connect_read_only(path)
+    try:
+        with trace.span('merge.prepare'):
+            merge = _Merge(a, other, path, update, media)
+            stats['models'] = merge.imported
+            stats['renamed'] = merge.renamed
+
+        cursor = other.execute('select id, guid, mid, mod, tags, flds, csum, '
+                               'flags, data from notes order by id')
+        with a.batch():
+            for rows in iter(lambda: cursor.fetchmany(chunk_size), []):
+                with trace.span('merge.chunk'):
+                    merge.chunk(rows, stats)
+                stats['notes'] += len(rows)
+                if progress is not None:
+                    progress(len(rows))
+
+            a.col.conf['nextPos'] = merge.next_pos
+            a.col.setMod()
+    finally:
+        other.close()
+
+    return stats
+
+
+class _Merge:
+    """State of a merge (see merge_collection)"""
+
+    def __init__(self, a, other, path, update, media):
+        self.a = a
+        self.other = other
+        self.update = update
+        self.usn = a.col.usn()
+
+        self.models, self.imported, self.renamed = resolve_models(
+            a, load_col_json(other, 'models'))
+        self.sort_index = {mid: a.col.models.sortIdx(m)
+                           for mid, m in self.models.items()}
+        self.deck_names = {int(did): d['name'] for did, d
+                           in load_col_json(other, 'decks').items()}
+        self.decks = {}
+
+        # The guid index of local notes
+        self.guids = {guid: (nid, mid, mod) for guid, nid, mid, mod
+                      in a.col.db.all('select guid, id, mid, mod from notes')}
+
+        # New ids for notes and cards whose id is taken
+        other_max = other.execute(
+            'select (select coalesce(max(id), 0) from notes), '
+            '(select coalesce(max(id), 0) from cards)').fetchone()
+        self.next_nid = max(other_max[0], a.col.db.scalar(
+            'select coalesce(max(id), 0) from notes')) + 1
+        self.next_cid = max(other_max[1], a.col.db.scalar(
+            'select coalesce(max(id), 0) from cards')) + 1
+
+        # Review due dates are days since the creation of the collection
+        other_crt = other.execute('select crt from col').fetchone()[0]
+        self.day_offset = (other_crt - a.col.crt)//86400
+        self.next_pos = a.col.conf.get('nextPos', 1)
+        self.first_pos = self.next_pos
+
+        self.media_src = Path(re.sub(r'(?i)\.anki2$', '.media', str(path)))
+        self.media_dst = Path(a.col.media.dir()) if media else None
+
+    def chunk(self, rows, stats):
+        """Merge chunk of note rows and their cards, reviews and media"""
+        db = self.a.col.db
+        taken = set(db.list('select id from notes where id in '
+                            f'{ids2str(r[0] for r in rows)}'))
+
+        notes = []
+        updates = []
+        nids = {}
+        tags = set()
+        files = set()
+        for old_id, guid, mid, mod, note_tags, flds, csum, flags, data in rows:
+            model = self.models[mid]
+            local_mid = int(model['id'])
+            sfld = stripHTMLMedia(splitFields(flds)[self.sort_index[mid]])
+            existing = self.guids.get(guid)
+            if existing is None:
+                nid = old_id
+                if nid in taken:
+                    nid, self.next_nid = self.next_nid, self.next_nid + 1
+                nids[old_id] = nid, model
+                self.guids[guid] = nid, local_mid, mod
+                notes.append((nid, guid, local_mid, mod, self.usn,
+                              note_tags, flds, sfld, csum, flags, data))
+            elif self.update and mod > existing[2] \
+                    and existing[1] == local_mid:
+                self.guids[guid] = existing[0], existing[1], mod
+                updates.append((flds, sfld, csum, note_tags, mod, self.usn,
+                                existing[0]))
+            else:
+                stats['skipped'] += 1
+                continue
+
+            tags.update(note_tags.split())
+            if self.media_dst is not None:
+                files.update(self.a.col.media.filesInStr(local_mid, flds))
+
+        if notes:
+            db.executemany(f'insert into notes ({NOTE_COLUMNS}) '
+                           'values (?,?,?,?,?,?,?,?,?,?,?)', notes)
+            self._merge_cards(nids, stats)
+        if updates:
+            db.executemany('update notes set flds = ?, sfld = ?, csum = ?, '
+                           'tags = ?, mod = ?, usn = ? where id = ?', updates)
+        if tags:
+            self.a.col.tags.register(list(tags))
+        self.a.mark_modified(len(notes) + len(updates))
+
+        stats['added'] += len(notes)
+        stats['updated'] += len(updates)
+        stats['media'] += self._copy_media(files)
+
+    def _merge_cards(self, nids, stats):
+        """Insert cards and review log of new notes
+
+        The argument maps note ids in the other collection to the new note
+        ids and the local models.
+        """
+        db = self.a.col.db
+        rows = self.other.execute(f'select {CARD_COLUMNS} from cards '
+                                  f'where nid in {ids2str(nids)}').fetchall()
+        taken = set(db.list('select id from cards where id in '
+                            f'{ids2str(r[0] for r in rows)}'))
+
+        cards = []
+        cids = {}
+        for row in rows:
+            (old_id, nid, did, ordinal, mod, _, ctype, queue, due, ivl,
+             factor, reps, lapses, left, odue, odid, flags, data) = row
+            nid, model = nids[nid]
+            if model['type'] == 0 and ordinal >= len(model['tmpls']):
+                continue
+
+            # Cards in filtered decks are returned to their home deck
+            if odid:
+                did, due, odue, odid = odid, odue, 0, 0
+
+            if queue in (2, 3) or (queue < 0 and ctype == 2):
+                due += self.day_offset
+            elif ctype == 0:
+                due += self.first_pos
+                self.next_pos = max(self.next_pos, due + 1)
+
+            cid = old_id
+            if cid in taken:
+                cid, self.next_cid = self.next_cid, self.next_cid + 1
+            cids[old_id] = cid
+            cards.append((cid, nid, self._deck(did), ordinal, mod, self.usn,
+                          ctype, queue, due, ivl, factor, reps, lapses, left,
+                          odue, odid, flags, data))
+
+        if cards:
+            db.executemany(f'insert into cards ({CARD_COLUMNS}) '
+                           f"values ({','.join('?'*18)})", cards)
+            stats['cards'] += len(cards)
+
+            reviews = [(rid, cids[cid], self.usn, *rest) for rid, cid, _, *rest
+                       in self.other.execute(f'select {REVLOG_COLUMNS} '
+                                             'from revlog where cid in '
+                                             f'{ids2str(cids)}')]
+            db.executemany(f'insert or ignore into revlog ({REVLOG_COLUMNS}) '
+                           'values (?,?,?,?,?,?,?,?,?)', reviews)
+            stats['reviews'] += len(reviews)
+
+    def _deck(self, did):
+        """Get local deck id for deck id of the other collection"""
+        if did not in self.decks:
+            self.decks[did] = self.a.ensure_deck(
+                self.deck_names.get(did, 'Default'))
+        return self.decks[did]
+
+    def _copy_media(self, files):
+        """Copy media files that do not exist in the local media folder"""
+        n_copied = 0
+        for name in files:
+            # Only plain file names (no paths) are valid media references
+            if Path(name).name != name:
+                continue
+
+            src = self.media_src / name
+            dst = self.media_dst / name
+            if src.is_file() and not dst.exists():
+                shutil.copy2(src, dst)
+                n_copied += 1
+
+        return n_copied
@@ -9,6 +9,8 @@ import click
 import readchar
 from anki import latex
 
+from apy import trace
+from apy.config import cfg
 from apy.convert import html_to_markdown
 from apy.convert import html_to_screen
 from apy.convert import is_generated_html
@@ -27,6 +29,9 @@ class Note:
         self.model_name = note.model()['name']
         self.fields = [x for x, y in self.n.items()]
         self.suspended = any([c.queue == -1 for c in self.n.cards()])
+        self._changed_fields = set()
+        self._changed_tags = False
+        trace.count('notes.hydrated')
 
 
     def __repr__(self):
@@ -109,7 +114,8 @@ class Note:
         latex_imgs = []
         for key, html in self.n.items():
             # Render LaTeX if necessary
-            latex.render_latex(html, self.n.model(), self.a.col)
+            with trace.span('latex.render'):
+                latex.render_latex(html, self.n.model(), self.a.col)
             latex_imgs += self.get_lateximg_from_field(html)
 
             lines.append(click.style('## ' + key, fg='blue'))
@@ -143,8 +149,48 @@ class Note:
                                      stderr=subprocess.DEVNULL)
 
 
+    def set_field(self, index, html):
+        """Set field value and mark it as changed (unless it is unchanged)"""
+        if self.n.fields[index] != html:
+            self.n.fields[index] = html
+            self._changed_fields.add(index)
+
+    def set_tags(self, tags):
+        """Set tags and mark them as changed (unless they are unchanged)"""
+        if tags != self.n.tags:
+            self.n.tags = tags
+            self._changed_tags = True
+
+    def flush(self):
+        """Write pending changes to the collection
+
+        The note is only written if a field or the tags were actually changed.
+        Returns a dict with the number of changed fields and tags.
+        """
+        changes = {'fields': len(self._changed_fields),
+                   'tags': int(self._changed_tags)}
+
+        if self._changed_fields or self._changed_tags:
+            self.n.flush()
+            self.a.mark_modified()
+
+        if self._changed_fields and cfg['highlight_classes']:
+            self.a.ensure_highlight_css(self.n.model())
+
+        self._changed_fields = set()
+        self._changed_tags = False
+
+        return changes
+
+
     def edit(self):
-        """Edit tags and fields of current note"""
+        """Edit tags and fields of current note
+
+        Only fields that were changed in the editor are converted and written.
+        Returns the change statistics from flush().
+        """
+        was_markdown = any(is_generated_html(x) for x in self.n.values())
+
         with tempfile.NamedTemporaryFile(mode='w+',
                                          dir=os.getcwd(),
                                          prefix='edit_note_',
@@ -155,13 +201,13 @@ class Note:
             retcode = editor(tf.name)
             if retcode != 0:
                 click.echo(f'Editor return with exit code {retcode}!')
-                return
+                return self.flush()
 
             notes = markdown_file_to_notes(tf.name)
 
         if not notes:
             click.echo('Something went wrong when editing note!')
-            return
+            return self.flush()
 
         if len(notes) > 1:
             self.a.add_notes_from_list(notes[1:])
@@ -171,22 +217,27 @@ class Note:
 
         note = notes[0]
 
-        new_tags = note['tags'].split()
-        if new_tags != self.n.tags:
-            self.n.tags = new_tags
+        self.set_tags(note['tags'].split())
 
         for i, value in enumerate(note['fields'].values()):
+            # Skip fields whose source text and markdown flag are unchanged
+            if (note['markdown'] == was_markdown
+                    and value == html_to_screen(self.n.fields[i],
+                                                parseable=True)):
+                continue
+
             if note['markdown']:
-                self.n.fields[i] = markdown_to_html(value)
+                self.set_field(i, markdown_to_html(value))
             else:
-                self.n.fields[i] = plain_to_html(value)
+                self.set_field(i, plain_to_html(value))
 
-        self.n.flush()
-        self.a.modified = True
-        if self.n.dupeOrEmpty():
+        changes = self.flush()
+        if changes['fields'] > 0 and self.n.dupeOrEmpty():
             click.confirm('The updated note is now a dupe!',
                           prompt_suffix='', show_default=False)
 
+        return changes
+
     def delete(self):
         """Delete the note"""
         self.a.delete_notes(self.n.id)
@@ -195,15 +246,15 @@ class Note:
     def toggle_marked(self):
         """Toggle marked tag for note"""
         if 'marked' in self.n.tags:
-            self.n.delTag('marked')
+            self.set_tags([t for t in self.n.tags if t != 'marked'])
         else:
-            self.n.addTag('marked')
-        self.n.flush()
-        self.a.modified = True
+            self.set_tags(self.n.tags + ['marked'])
+        self.flush()
 
     def toggle_suspend(self):
         """Toggle suspend for note"""
-        cids = [c.id for c in self.n.cards()]
+        cids = self.a.col.db.list('select id from cards where nid = ?',
+                                  self.n.id)
 
         if self.suspended:
             self.a.col.sched.unsuspendCards(cids)
@@ -211,7 +262,7 @@ class Note:
             self.a.col.sched.suspendCards(cids)
 
         self.suspended = not self.suspended
-        self.a.modified = True
+        self.a.mark_modified(len(cids))
 
     def toggle_markdown(self, index=None):
         """Toggle markdown on a field"""
@@ -223,20 +274,19 @@ class Note:
         field_value = self.n.fields[index]
 
         if is_generated_html(field_value):
-            self.n.fields[index] = html_to_markdown(field_value)
+            self.set_field(index, html_to_markdown(field_value))
         else:
-            self.n.fields[index] = markdown_to_html(field_value)
+            self.set_field(index, markdown_to_html(field_value))
 
-        self.n.flush()
-        self.a.modified = True
+        self.flush()
 
     def clear_flags(self):
         """Clear flags for note"""
-        for c in self.n.cards():
-            if c.flags > 0:
-                c.flags = 0
-                c.flush()
-                self.a.modified = True
+        cids = self.a.col.db.list(
+            'select id from cards where nid = ? and flags & 7 != 0', self.n.id)
+        if cids:
+            self.a.col.setUserFlag(0, cids)
+            self.a.mark_modified(len(cids))
 
 
     def show_cards(self):
@@ -418,3 +468,31 @@ class Note:
                         continue
                     self.a.modified = False
                 raise click.Abort()
+
+
+class NoteView:
+    """Compact read-only view of a note for listing
+
+    A view only holds the note id, model id, deck id (of the first card),
+    tags, flags (the largest card flag), queue (-1 if any card is suspended,
+    otherwise the lowest card queue) and the first field. Views are created
+    in bulk with Anki.iter_note_views().
+    """
+    __slots__ = ('id', 'mid', 'did', 'tags', 'flags', 'queue', 'first_field')
+
+    def __init__(self, nid, mid, did, tags, flags, queue, first_field):
+        self.id = nid
+        self.mid = mid
+        self.did = did
+        self.tags = tags
+        self.flags = flags
+        self.queue = queue
+        self.first_field = first_field
+
+    def __repr__(self):
+        return f'NoteView({self.id})'
+
+    @property
+    def suspended(self):
+        """Check if any card of the note is suspended"""
+        return self.queue == -1
@@ -0,0 +1,182 @@
+"""Export of notes to Anki packages (.apkg)
+
+A package is a zip file with a collection file (collection.anki2), the media
+files (named 0, 1, ...) and a JSON map from these names to the media file
+names. The collection file is created from the schema of the current
+collection, and the rows of the selected notes, their cards and their review
+log are copied in chunks with bulk inserts. Only the models, decks and media
+files that the notes use are included. The media files are written to the
+zip file one at a time as they are found, so the memory usage does not
+depend on the size of the media.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import zipfile
+from pathlib import Path
+
+from anki.utils import ids2str
+
+from apy import trace
+from apy.merge import NOTE_COLUMNS, CARD_COLUMNS, REVLOG_COLUMNS
+from apy.utilities import chunked
+
+COL_COLUMNS = ('id, crt, mod, scm, ver, dty, usn, ls, conf, models, decks, '
+               'dconf, tags')
+
+
+def export_package(a, query, path, scheduling=True, media=True,
+                   progress=None, chunk_size=1000):
+    """Export notes that match query to package file
+
+    With scheduling=False, the cards are exported as new cards and the
+    review log is left out. If given, progress is called with the number of
+    notes after each chunk. The package is written to a temporary file that
+    replaces path when it is complete.
+
+    Returns a dict with the number of exported notes, cards, reviews and
+    media files.
+    """
+    stats = {'notes': 0, 'cards': 0, 'reviews': 0, 'media': 0}
+    tmp_path = f'{path}.tmp'
+    try:
+        with tempfile.TemporaryDirectory() as tmp, \
+                zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            col_path = Path(tmp) / 'collection.anki2'
+            export = _Export(a, sqlite3.connect(col_path), zf, scheduling,
+                             media)
+            try:
+                for chunk in chunked(sorted(set(a.find_note_ids(query))),
+                                     chunk_size):
+                    with trace.span('export.chunk'):
+                        export.chunk(chunk, stats)
+                    stats['notes'] += len(chunk)
+                    if progress is not None:
+                        progress(len(chunk))
+
+                export.finish()
+            finally:
+                export.dst.close()
+
+            zf.write(col_path, 'collection.anki2')
+            zf.writestr('media', json.dumps(export.media_map))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    os.replace(tmp_path, path)
+    stats['media'] = len(export.media_map)
+    return stats
+
+def _unicase(x, y):
+    """Compare strings case insensitively (like Anki's unicase collation)"""
+    x, y = x.casefold(), y.casefold()
+    return (x > y) - (x < y)
+
+
+class _Export:
+    """State of an export (see export_package)"""
+
+    def __init__(self, a, dst, zf, scheduling, media):
+        self.a = a
+        self.dst = dst
+        self.zf = zf
+        self.scheduling = scheduling
+        self.media_dir = Path(a.col.media.dir()) if media else None
+
+        self.models = set()
+        self.decks = {1}
+        self.tags = set()
+        self.files = set()
+        self.media_map = {}
+        self.position = 0
+
+        # Tables of newer schema versions use Anki's unicase collation
+        dst.create_collation('unicase', _unicase)
+        for (sql,) in a.col.db.all(
+                'select sql from sqlite_master where sql is not null '
+                "and name not like 'sqlite_%' order by type = 'index'"):
+            dst.execute(sql)
+
+    def chunk(self, nids, stats):
+        """Copy chunk of notes with their cards, reviews and media"""
+        db = self.a.col.db
+        notes = db.all(f'select {NOTE_COLUMNS} from notes '
+                       f'where id in {ids2str(nids)} order by id')
+        self.dst.executemany(f'insert into notes ({NOTE_COLUMNS}) '
+                             'values (?,?,?,?,?,?,?,?,?,?,?)', notes)
+
+        files = set()
+        positions = {}
+        for nid, _, mid, _, _, tags, flds, *_ in notes:
+            self.models.add(mid)
+            self.tags.update(tags.split())
+            self.position += 1
+            positions[nid] = self.position
+            if self.media_dir is not None:
+                files.update(self.a.col.media.filesInStr(mid, flds))
+
+        cards = []
+        for row in db.all(f'select {CARD_COLUMNS} from cards '
+                          f'where nid in {ids2str(nids)}'):
+            row = list(row)
+            # Cards in filtered decks are returned to their home deck
+            if row[15]:
+                row[2], row[8], row[14], row[15] = row[15], row[14], 0, 0
+
+            # Reset type, queue, due, ivl, factor, reps, lapses and left
+            if not self.scheduling:
+                row[6:14] = [0, 0, positions[row[1]], 0, 0, 0, 0, 0]
+
+            self.decks.add(row[2])
+            cards.append(row)
+
+        self.dst.executemany(f'insert into cards ({CARD_COLUMNS}) '
+                             f"values ({','.join('?'*18)})", cards)
+        stats['cards'] += len(cards)
+
+        if self.scheduling and cards:
+            reviews = db.all(f'select {REVLOG_COLUMNS} from revlog where cid '
+                             f'in {ids2str(row[0] for row in cards)}')
+            self.dst.executemany(f'insert into revlog ({REVLOG_COLUMNS}) '
+                                 'values (?,?,?,?,?,?,?,?,?)', reviews)
+            stats['reviews'] += len(reviews)
+
+        self.dst.commit()
+        self._write_media(files - self.files)
+
+    def _write_media(self, files):
+        """Write media files to the package (as they are)"""
+        for name in sorted(files):
+            self.files.add(name)
+
+            # Only plain file names (no paths) are valid media references
+            src = self.media_dir / name
+            if Path(name).name != name or not src.is_file():
+                continue
+
+            key = str(len(self.media_map))
+            self.zf.write(src, key, compress_type=zipfile.ZIP_STORED)
+            self.media_map[key] = name
+
+    def finish(self):
+        """Write the col row with the used models, decks and tags"""
+        col = dict(zip(COL_COLUMNS.split(', '),
+                       self.a.col.db.all(f'select {COL_COLUMNS} from col')[0]))
+
+        decks = {}
+        for did in self.decks:
+            for deck in self.a.col.decks.parents(did) \
+                    + [self.a.col.decks.get(did)]:
+                decks[str(deck['id'])] = deck
+
+        col['models'] = json.dumps({str(mid): self.a.col.models.get(mid)
+                                    for mid in self.models})
+        col['decks'] = json.dumps(decks)
+        col['tags'] = json.dumps({tag: 0 for tag in sorted(self.tags)})
+
+        self.dst.execute(f'insert into col ({COL_COLUMNS}) values '
+                         f"({','.join('?'*len(col))})", list(col.values()))
+        self.dst.commit()
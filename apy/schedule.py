@@ -0,0 +1,252 @@
+"""Review workload forecasting and balancing with vectorized NumPy operations"""
+import time
+
+import click
+from anki.utils import intTime
+
+from apy import trace
+from apy.stats import require_numpy, load_columns, iter_revlog, np
+
+# Maximum number of simulated card states to keep in memory at a time
+MAX_STATES = 2_000_000
+
+# Cost per day of moving a card (prefers the original date among equal loads)
+MOVE_PENALTY = 1e-3
+
+
+def load_review_cards(a, query=None, chunk_size=100000):
+    """Load arrays (id, due, ivl, factor) for review and learning cards
+
+    The due dates are given as days from today (negative for overdue cards).
+    Learning cards are counted as due today with an interval of one day.
+    Cards in filtered decks are counted at their original due date.
+    """
+    today = a.col.sched.today
+    cards = load_columns(
+        a.col.db, 'select id, case when odid then odue else due end, ivl, '
+        'factor, queue from cards where queue in (1, 2, 3) and id > ? '
+        'order by id limit ?', 5, chunk_size)
+    if query:
+        selected = np.array(a.find_cards(query), dtype='int64')
+        cards = cards[np.isin(cards[:, 0], selected)]
+
+    cid, due, ivl, factor, queue = cards.T
+    learning = queue != 2
+    due = np.where(learning, 0, due - today)
+    ivl = np.where(learning, 1, np.maximum(ivl, 1))
+    factor = np.where(factor > 0, factor, 2500)
+
+    return cid, due, ivl, factor
+
+def estimate_retention(a, days=90, chunk_size=100000, default=0.9):
+    """Estimate retention from reviews in the review log of the last days"""
+    since = int((time.time() - days*86400)*1000)
+    reviews = 0
+    passed = 0
+    for chunk in iter_revlog(a.col.db, chunk_size, since):
+        is_review = chunk[:, 4] == 1
+        reviews += is_review.sum()
+        passed += (is_review & (chunk[:, 2] > 1)).sum()
+
+    return float(passed/reviews) if reviews else default
+
+def simulate_load(due, ivl, factor, days, retention, n_new=0, sims=100,
+                  seed=None):
+    """Monte-Carlo simulation of the daily number of reviews
+
+    Each simulated review is passed with probability retention. A passed
+    review multiplies the interval by the ease factor, a failed review resets
+    the interval to one day and lowers the ease factor by 20 percentage points
+    (similar to the default Anki settings). Optionally, n_new new cards are
+    introduced each day. Returns an array of shape (sims, days).
+
+    The simulations are run in batches to bound the memory usage, and all
+    cards of a batch are advanced together review by review.
+    """
+    require_numpy()
+    rng = np.random.default_rng(seed)
+
+    # Add hypothetical new cards (first review the day they are introduced)
+    if n_new > 0:
+        due = np.concatenate([due, np.repeat(np.arange(days), n_new)])
+        ivl = np.concatenate([ivl, np.zeros(n_new*days, dtype=ivl.dtype)])
+        factor = np.concatenate([factor,
+                                 np.full(n_new*days, 2500, dtype=factor.dtype)])
+
+    n_cards = len(due)
+    load = np.zeros(sims*days, dtype='int64')
+    batch = max(1, MAX_STATES // max(n_cards, 1))
+    for first in range(0, sims, batch):
+        n_sims = min(batch, sims - first)
+        with trace.span('forecast.simulate'):
+            _simulate_batch(load[first*days:(first + n_sims)*days], rng,
+                            np.tile(np.maximum(due, 0), n_sims),
+                            np.tile(ivl, n_sims).astype(float),
+                            np.tile(factor, n_sims).astype(float),
+                            np.repeat(np.arange(n_sims), n_cards),
+                            days, retention)
+
+    return load.reshape(sims, days)
+
+def _simulate_batch(load, rng, due, ivl, factor, sim, days, retention):
+    """Simulate a batch of simulations (see simulate_load)"""
+    active = np.nonzero(due < days)[0]
+    while len(active) > 0:
+        load += np.bincount(sim[active]*days + due[active],
+                            minlength=len(load))
+
+        passed = rng.random(len(active)) < retention
+        old = ivl[active]
+        new = np.where(passed,
+                       np.maximum(old + 1, np.round(old*factor[active]/1000)),
+                       1)
+        # False positives: pylint infers the tuple of one-argument np.where
+        # pylint: disable=unsupported-assignment-operation,no-member
+        new[old < 1] = 1
+        ivl[active] = new
+        factor[active] = np.where(passed, factor[active],
+                                  np.maximum(factor[active] - 200, 1300))
+        due[active] += new.astype(due.dtype)
+
+        active = active[due[active] < days]
+
+def forecast(a, query=None, days=30, n_new=0, sims=100, retention=None,
+             seed=None, bucket=1):
+    """Forecast review load
+
+    Returns a dict with the mean, 10th and 90th percentile of the number of
+    reviews per bucket of days (e.g. bucket=7 for weekly numbers), and the
+    parameters of the simulation.
+    """
+    require_numpy()
+    with trace.span('forecast.load'):
+        _, due, ivl, factor = load_review_cards(a, query)
+        if retention is None:
+            retention = estimate_retention(a)
+
+    load = simulate_load(due, ivl, factor, days, retention, n_new, sims, seed)
+
+    n = -(-days // bucket)
+    load = np.pad(load, ((0, 0), (0, n*bucket - days)))
+    # False positive: pylint does not infer the NumPy array type of load
+    # pylint: disable-next=too-many-function-args
+    load = load.reshape(sims, n, bucket).sum(axis=2)
+
+    return {
+        'cards': len(due),
+        'new_per_day': n_new,
+        'retention': retention,
+        'simulations': sims,
+        'bucket': bucket,
+        'mean': load.mean(axis=0).tolist(),
+        'p10': np.percentile(load, 10, axis=0).tolist(),
+        'p90': np.percentile(load, 90, axis=0).tolist(),
+    }
+
+def print_forecast(result, width=40):
+    """Print forecast as a histogram"""
+    click.echo(f"Cards: {result['cards']}  "
+               f"New per day: {result['new_per_day']}  "
+               f"Retention: {100*result['retention']:.1f}%  "
+               f"Simulations: {result['simulations']}")
+
+    unit = {1: 'Day', 7: 'Week'}.get(result['bucket'],
+                                     f"{result['bucket']} days")
+    click.echo(f"\n{unit:>7s} {'mean':>8s} {'p10-p90':>13s}")
+    click.echo('-'*(width + 30))
+    n_max = max(result['p90'] + [1])
+    for i, (m, low, high) in enumerate(zip(result['mean'], result['p10'],
+                                           result['p90'])):
+        hashes = '#'*int(round(width*m/n_max))
+        click.echo(f'{i:7d} {m:8.1f} {low:6.0f}-{high:<6.0f} {hashes}')
+
+
+def plan_reschedule(a, query, spread, tolerance=0.1, chunk_size=100000):
+    """Compute new due dates that flatten the review load
+
+    Review cards that match query and are due within the next spread days
+    (overdue cards count as due today) are moved within the window, but at
+    most tolerance times their interval days from their actual due date.
+    Cards in filtered decks are left alone.
+    The cards are assigned greedily, the most constrained cards first, each
+    to the day with the lowest load (including the other review cards) in
+    its allowed range.
+
+    Returns the card ids, the old and new due dates (in days from today) and
+    the daily load before and after. Overdue cards have old due date 0.
+    """
+    require_numpy()
+    with trace.span('reschedule.load'):
+        cards = load_columns(
+            a.col.db, 'select id, due, ivl from cards '
+            'where queue = 2 and odid = 0 and id > ? order by id limit ?', 3,
+            chunk_size)
+        cards[:, 1] -= a.col.sched.today
+        cards = cards[cards[:, 1] < spread]
+        matched = np.isin(cards[:, 0],
+                          np.array(a.find_cards(query), dtype='int64'))
+
+    cid, due, ivl = cards[matched].T
+    old = np.maximum(due, 0)
+    background = np.bincount(np.maximum(cards[~matched, 1], 0),
+                             minlength=spread)
+    before = background + np.bincount(old, minlength=spread)
+
+    with trace.span('reschedule.balance'):
+        new = balance_load(due, ivl, background, tolerance)
+    after = background + np.bincount(new, minlength=spread)
+
+    return cid, old, new, before, after
+
+def balance_load(due, ivl, background, tolerance):
+    """Greedy assignment of due days (see plan_reschedule)
+
+    The due days may be negative for overdue cards, which start on day 0.
+    """
+    n_days = len(background)
+    slack = np.floor(tolerance*ivl).astype('int64')
+    low = np.clip(due - slack, 0, n_days - 1)
+    high = np.clip(due + slack, 0, n_days - 1)
+    due = np.clip(due, 0, n_days - 1)
+
+    load = background.astype(float)
+    new = due.copy()
+
+    # Cards that can not be moved are placed first, in one go
+    fixed = low == high
+    load += np.bincount(due[fixed], minlength=n_days)
+
+    days = np.arange(n_days)
+    movable = np.nonzero(~fixed)[0]
+    for i in movable[np.lexsort((due[movable], high[movable] - low[movable]))]:
+        window = slice(low[i], high[i] + 1)
+        cost = load[window] + MOVE_PENALTY*np.abs(days[window] - due[i])
+        new[i] = low[i] + np.argmin(cost)
+        load[new[i]] += 1
+
+    return new
+
+def apply_reschedule(a, cid, due):
+    """Set due dates (in days from today) of cards in one transaction"""
+    today = a.col.sched.today
+    mod = intTime()
+    usn = a.col.usn()
+    with a.batch(0):
+        a.col.db.executemany(
+            'update cards set due = ?, mod = ?, usn = ? where id = ?',
+            [(int(d) + today, mod, usn, int(c)) for c, d in zip(cid, due)])
+        a.mark_modified(len(cid))
+
+def print_load(before, after, width=40):
+    """Print daily review load before and after rescheduling"""
+    click.echo(f"{'Day':>7s} {'before':>8s} {'after':>8s}")
+    click.echo('-'*(width + 25))
+    n_max = max(before.max(initial=0), after.max(initial=0), 1)
+    for day, (n_before, n_after) in enumerate(zip(before, after)):
+        hashes = '#'*int(round(width*n_after/n_max))
+        click.echo(f'{day:7d} {n_before:8d} {n_after:8d} {hashes}')
+
+    click.echo('-'*(width + 25))
+    click.echo(f"{'max':>7s} {before.max(initial=0):8d} "
+               f"{after.max(initial=0):8d}")
+    click.echo(f"{'std':>7s} {before.std():8.1f} {after.std():8.1f}")
@@ -0,0 +1,112 @@
+"""Full-text search index over the decoded note source
+
+Fields generated by apy store the original Markdown base64 encoded, so
+Anki's own search does not see what was actually written. This index stores
+the decoded Markdown (and plain text of other fields) in an SQLite FTS5
+table in the sidecar database, and is updated incrementally based on the
+note modification times.
+"""
+import sqlite3
+
+import click
+from anki.utils import ids2str
+
+from apy import sidecar
+from apy import trace
+from apy.convert import html_to_text
+from apy.utilities import chunked
+
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+
+class SearchIndex:
+    """Full-text search index for a collection"""
+
+    def __init__(self, anki):
+        self.a = anki
+        self.db = sidecar.connect(self.a.path)
+        self.db.executescript('''
+            create table if not exists fts_state (
+                nid integer primary key,
+                mod integer not null
+            );
+            create virtual table if not exists fts_notes using fts5(
+                tags, content, tokenize = 'unicode61 remove_diacritics 2'
+            );
+        ''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the index database"""
+        sidecar.close(self.db)
+
+    def update(self, chunk_size=1000):
+        """Update index with notes that were added/modified/deleted
+
+        Returns the number of notes that were (re)indexed and removed.
+        """
+        with trace.span('search.index.update'):
+            indexed = dict(self.db.execute('select nid, mod from fts_state'))
+            current = self.a.col.db.all('select id, mod from notes')
+
+            changed = [nid for nid, mod in current if indexed.get(nid) != mod]
+            deleted = indexed.keys() - {nid for nid, _ in current}
+
+            with self.db:
+                for chunk in chunked(list(deleted), chunk_size):
+                    self.db.execute(
+                        f'delete from fts_notes where rowid in {ids2str(chunk)}')
+                    self.db.execute(
+                        f'delete from fts_state where nid in {ids2str(chunk)}')
+
+            for chunk in chunked(changed, chunk_size):
+                rows = self.a.col.db.all(
+                    'select id, mod, tags, flds from notes '
+                    f'where id in {ids2str(chunk)}')
+                with self.db:
+                    self.db.execute(
+                        f'delete from fts_notes where rowid in {ids2str(chunk)}')
+                    self.db.executemany(
+                        'insert into fts_notes (rowid, tags, content) '
+                        'values (?, ?, ?)',
+                        [(nid, tags.strip(), '\n'.join(
+                            [html_to_text(x) for x in flds.split('\x1f')]))
+                         for nid, _, tags, flds in rows])
+                    self.db.executemany(
+                        'insert or replace into fts_state (nid, mod) '
+                        'values (?, ?)',
+                        [(nid, mod) for nid, mod, _, _ in rows])
+
+            trace.count('search.index.updated', len(changed))
+
+        return len(changed), len(deleted)
+
+    def search(self, text, limit=None):
+        """Search index with an FTS5 query
+
+        Returns list of (note id, rank, snippet) tuples, best match first.
+        In the snippets, the matches are enclosed by SNIPPET_START and
+        SNIPPET_END.
+        """
+        sql = ('select rowid, bm25(fts_notes), '
+               f"snippet(fts_notes, 1, '{SNIPPET_START}', '{SNIPPET_END}', "
+               "'...', 12) "
+               'from fts_notes where fts_notes match ? order by rank')
+        args = [text]
+        if limit is not None:
+            sql += ' limit ?'
+            args.append(limit)
+
+        try:
+            with trace.span('search.index.query'):
+                return self.db.execute(sql, args).fetchall()
+        except sqlite3.OperationalError as e:
+            click.echo(f'Invalid search: {text}')
+            click.echo(e)
+            raise click.Abort()
@@ -0,0 +1,37 @@
+"""Sidecar database with apy specific data for a collection
+
+The sidecar is a separate SQLite database next to the collection file (e.g.
+collection.apy.db next to collection.anki2). It only holds data that can be
+rebuilt from the collection, so it is safe to delete.
+"""
+import sqlite3
+from pathlib import Path
+
+
+def sidecar_path(collection_path):
+    """Get path to sidecar database for collection"""
+    return Path(collection_path).with_suffix('.apy.db')
+
+def connect(collection_path):
+    """Open (and create if necessary) the sidecar database for collection"""
+    db = sqlite3.connect(sidecar_path(collection_path), timeout=30)
+    db.execute('pragma journal_mode = wal')
+    return db
+
+def close(db):
+    """Checkpoint the write-ahead log and close the sidecar database
+
+    SQLite removes the -wal and -shm files when the last connection closes.
+    """
+    try:
+        db.execute('pragma wal_checkpoint(truncate)')
+    finally:
+        db.close()
+
+def remove(collection_path):
+    """Remove sidecar database (with its -wal and -shm files)"""
+    path = sidecar_path(collection_path)
+    for filename in (path, path.with_name(f'{path.name}-wal'),
+                     path.with_name(f'{path.name}-shm')):
+        if filename.exists():
+            filename.unlink()
@@ -0,0 +1,309 @@
+"""Review statistics computed with vectorized NumPy operations
+
+The cards table is loaded into columnar arrays, while the review log is
+streamed in chunks and reduced to per card totals and a histogram of review
+times. Thus the memory usage is bounded by the number of cards, not by the
+number of reviews.
+"""
+import click
+from anki.utils import ids2str
+
+from apy import trace
+from apy.utilities import chunked
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Upper bounds for the interval distribution (in days)
+IVL_BINS = [1, 2, 3, 7, 14, 30, 90, 180, 365, 730]
+
+# Percentiles of the time spent per review
+TIME_PERCENTILES = [50, 75, 90, 95, 99]
+
+
+def require_numpy():
+    """Abort if NumPy is not available"""
+    if np is None:
+        click.echo('This command requires NumPy (pip install numpy)!')
+        raise click.Abort()
+
+def load_columns(db, sql, ncols, chunk_size, dtype='int64'):
+    """Load result of query as 2D array in chunks
+
+    The query must select an integer id as the first column and contain a
+    placeholder for the lower id bound and the chunk size, e.g.:
+
+        select id, ... from table where id > ? order by id limit ?
+    """
+    chunks = []
+    last = -2**63
+    while True:
+        rows = db.all(sql, last, chunk_size)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=dtype).reshape(-1, ncols))
+        last = rows[-1][0]
+
+    if not chunks:
+        return np.empty((0, ncols), dtype=dtype)
+
+    return np.concatenate(chunks)
+
+def iter_revlog(db, chunk_size, since=None):
+    """Yield review log as arrays (id, cid, ease, time, type) in chunks
+
+    If since is given, only reviews after this time (epoch in ms) are read.
+    """
+    last = -2**63 if since is None else since
+    while True:
+        rows = db.all('select id, cid, ease, time, type from revlog '
+                      'where id > ? order by id limit ?', last, chunk_size)
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield np.array(rows, dtype='int64').reshape(-1, 5)
+
+def lookup(sorted_ids, ids):
+    """Find indices of ids in sorted array (and a mask of the found ids)"""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype='int64'), np.zeros(len(ids), bool)
+
+    index = np.searchsorted(sorted_ids, ids)
+    index[index == len(sorted_ids)] = 0
+    return index, sorted_ids[index] == ids
+
+def group_totals(index, weights, n):
+    """Sum weights by group index"""
+    return np.bincount(index, weights=weights, minlength=n)
+
+
+def compute_stats(a, query=None, chunk_size=100000, top=10):
+    """Compute review statistics for cards that match query (or all cards)
+
+    Returns a dict with retention by deck, model and tag, ease and interval
+    distributions, lapse hot spots and time per review percentiles.
+    """
+    require_numpy()
+    db = a.col.db
+
+    # Cards (sorted by id) and their notes
+    with trace.span('stats.load.cards'):
+        cards = load_columns(
+            db, 'select c.id, c.nid, c.did, n.mid, c.factor, c.ivl, '
+            'c.lapses, c.type from cards c join notes n on n.id = c.nid '
+            'where c.id > ? order by c.id limit ?', 8, chunk_size)
+        if query:
+            selected = np.sort(np.array(a.find_cards(query), dtype='int64'))
+            cards = cards[np.isin(cards[:, 0], selected)]
+
+    cid, nid, did, mid, factor, ivl, lapses, ctype = cards.T
+    n_cards = len(cid)
+
+    # Per card review totals and review time histogram from the revlog
+    reviews = np.zeros(n_cards)
+    passed = np.zeros(n_cards)
+    times = np.zeros(60001, dtype='int64')
+    n_revlog = 0
+    with trace.span('stats.load.revlog'):
+        for chunk in iter_revlog(db, chunk_size):
+            n_revlog += len(chunk)
+            index, known = lookup(cid, chunk[:, 1])
+            chunk, index = chunk[known], index[known]
+
+            times += np.bincount(np.clip(chunk[:, 3], 0, 60000),
+                                 minlength=60001)
+
+            is_review = chunk[:, 4] == 1
+            reviews += group_totals(index[is_review], None, n_cards)
+            passed += group_totals(index[is_review & (chunk[:, 2] > 1)],
+                                   None, n_cards)
+
+    with trace.span('stats.compute'):
+        stats = {
+            'cards': n_cards,
+            'revlog': n_revlog,
+            'reviews': int(reviews.sum()),
+            'retention': {
+                'deck': _retention_by(did, reviews, passed, a.col.decks.name),
+                'model': _retention_by(mid, reviews, passed,
+                                       lambda x: a.col.models.get(x)['name']),
+                'tag': _retention_by_tag(a, nid, reviews, passed, chunk_size),
+            },
+            'ease': _ease_distribution(factor[ctype == 2]),
+            'interval': _interval_distribution(ivl[ctype == 2]),
+            'lapses': _lapse_hot_spots(a, cid, nid, did, lapses, top),
+            'time': _time_percentiles(times),
+        }
+
+    return stats
+
+def _retention_by(keys, reviews, passed, name):
+    """Retention grouped by keys (e.g. deck ids)"""
+    unique, index = np.unique(keys, return_inverse=True)
+    n_reviews = group_totals(index, reviews, len(unique))
+    n_passed = group_totals(index, passed, len(unique))
+
+    return _retention_table([name(int(x)) for x in unique],
+                            n_reviews, n_passed)
+
+def _retention_by_tag(a, nid, reviews, passed, chunk_size):
+    """Retention grouped by tags
+
+    The tags are read only for the selected notes, in chunks, and the totals
+    are accumulated per chunk.
+    """
+    notes, note_index = np.unique(nid, return_inverse=True)
+    note_reviews = group_totals(note_index, reviews, len(notes))
+    note_passed = group_totals(note_index, passed, len(notes))
+
+    tags = {}
+    n_reviews = np.zeros(0)
+    n_passed = np.zeros(0)
+    for chunk in chunked(notes.tolist(), chunk_size):
+        index, tag_index = _tag_pairs(a, notes, chunk, tags)
+        n_reviews = np.pad(n_reviews, (0, len(tags) - len(n_reviews))) \
+            + group_totals(tag_index, note_reviews[index], len(tags))
+        n_passed = np.pad(n_passed, (0, len(tags) - len(n_passed))) \
+            + group_totals(tag_index, note_passed[index], len(tags))
+
+    return _retention_table(list(tags), n_reviews, n_passed)
+
+def _tag_pairs(a, notes, note_ids, tags):
+    """Arrays of note indices (in notes) and tag indices for tags of notes
+
+    New tags are added to tags, a dict from tag names to indices.
+    """
+    pairs = ([], [])
+    for note_id, tag_string in a.col.db.all(
+            f'select id, tags from notes where id in {ids2str(note_ids)}'):
+        for tag in tag_string.split():
+            pairs[0].append(note_id)
+            pairs[1].append(tags.setdefault(tag, len(tags)))
+
+    return (np.searchsorted(notes, np.array(pairs[0], dtype='int64')),
+            np.array(pairs[1], dtype='int64'))
+
+def _retention_table(names, n_reviews, n_passed):
+    """List of rows (name, reviews, retention) sorted by name"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        retention = np.where(n_reviews > 0, n_passed/n_reviews, np.nan)
+
+    return sorted([
+        {'name': name, 'reviews': int(n), 'retention': None if np.isnan(r)
+         else float(r)}
+        for name, n, r in zip(names, n_reviews, retention)
+    ], key=lambda x: x['name'])
+
+def _ease_distribution(factor):
+    """Ease distribution (in percent) for review cards"""
+    ease = factor/10
+    bins = np.arange(130, 360, 20)
+    counts = np.bincount(np.searchsorted(bins, ease, side='right'),
+                         minlength=len(bins) + 1)
+    labels = [f'<{bins[0]}'] + [f'{x}-{x + 19}' for x in bins[:-1]] \
+        + [f'>={bins[-1]}']
+
+    return {
+        'mean': float(ease.mean()) if len(ease) else None,
+        'histogram': dict(zip(labels, counts.tolist())),
+    }
+
+def _interval_distribution(ivl):
+    """Interval distribution (in days) for review cards"""
+    bins = np.array(IVL_BINS)
+    counts = np.bincount(np.searchsorted(bins, ivl, side='right'),
+                         minlength=len(bins) + 1)
+    labels = [f'<{bins[0]}'] + [f'{x}-{y - 1}' for x, y in
+                                zip(bins[:-1], bins[1:])] + [f'>={bins[-1]}']
+
+    return {
+        'mean': float(ivl.mean()) if len(ivl) else None,
+        'median': float(np.median(ivl)) if len(ivl) else None,
+        'histogram': dict(zip(labels, counts.tolist())),
+    }
+
+def _lapse_hot_spots(a, cid, nid, did, lapses, top):
+    """Cards with the most lapses and decks with the highest lapse rate"""
+    order = np.argsort(-lapses, kind='stable')[:top]
+    cards = [{
+        'cid': int(cid[i]),
+        'nid': int(nid[i]),
+        'deck': a.col.decks.name(int(did[i])),
+        'lapses': int(lapses[i]),
+    } for i in order if lapses[i] > 0]
+
+    unique, index = np.unique(did, return_inverse=True)
+    total = group_totals(index, lapses, len(unique))
+    count = np.bincount(index, minlength=len(unique))
+    rate = np.divide(total, count, out=np.zeros(len(unique)),
+                     where=count > 0)
+    order = np.argsort(-rate, kind='stable')[:top]
+    decks = [{
+        'deck': a.col.decks.name(int(unique[i])),
+        'cards': int(count[i]),
+        'lapses': int(total[i]),
+        'lapses_per_card': float(rate[i]),
+    } for i in order if total[i] > 0]
+
+    return {'cards': cards, 'decks': decks}
+
+def _time_percentiles(histogram):
+    """Percentiles of time per review (in seconds) from histogram of ms"""
+    total = histogram.sum()
+    if total == 0:
+        return {}
+
+    cumulative = np.cumsum(histogram)
+    index = np.searchsorted(cumulative, np.array(TIME_PERCENTILES)/100*total)
+    return {f'p{p}': float(i)/1000 for p, i in zip(TIME_PERCENTILES, index)}
+
+
+def print_stats(stats):
+    """Print statistics as tables"""
+    width = 40
+    click.echo(f"Cards: {stats['cards']}  "
+               f"Reviews: {stats['reviews']}  "
+               f"Review log entries: {stats['revlog']}")
+
+    for group in ['deck', 'model', 'tag']:
+        rows = stats['retention'][group]
+        if not rows:
+            continue
+
+        click.echo(f"\n{'Retention by ' + group:{width}s} "
+                   f"{'reviews':>8s} {'retention':>10s}")
+        click.echo('-'*(width + 20))
+        for row in rows:
+            retention = '-' if row['retention'] is None \
+                else f"{100*row['retention']:.1f}%"
+            click.echo(f"{row['name'][:width]:{width}s} {row['reviews']:8d} "
+                       f"{retention:>10s}")
+
+    for key, title in [('ease', 'Ease (%)'), ('interval', 'Interval (days)')]:
+        histogram = stats[key]['histogram']
+        n_max = max(histogram.values())
+        click.echo(f'\n{title:12s} {"cards":>8s}')
+        click.echo('-'*(width + 20))
+        for label, count in histogram.items():
+            hashes = '#'*int(round(38*count/n_max)) if n_max else ''
+            click.echo(f'{label:12s} {count:8d} {hashes}')
+
+    if stats['lapses']['cards']:
+        click.echo(f"\n{'Most lapses: card id':{width}s} {'lapses':>8s}")
+        click.echo('-'*(width + 20))
+        for row in stats['lapses']['cards']:
+            click.echo(f"{row['cid']:<20d}{row['deck'][:width - 20]:20s} "
+                       f"{row['lapses']:8d}")
+
+        click.echo(f"\n{'Most lapses per card: deck':{width}s} "
+                   f"{'cards':>8s} {'lapses':>10s}")
+        click.echo('-'*(width + 20))
+        for row in stats['lapses']['decks']:
+            click.echo(f"{row['deck'][:width]:{width}s} {row['cards']:8d} "
+                       f"{row['lapses_per_card']:10.2f}")
+
+    if stats['time']:
+        click.echo('\nTime per review (s): ' + '  '.join(
+            f'{key}: {value:.1f}' for key, value in stats['time'].items()))
@@ -0,0 +1,156 @@
+"""Timing and tracing instrumentation
+
+Tracing is disabled by default. When disabled, span() returns a shared no-op
+context manager and count() returns immediately, so the instrumentation has
+close to zero overhead. Enable it with enable() (see the --trace option) and
+write the results with report().
+"""
+import os
+import json
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+import click
+
+_tracer = None
+_null_span = nullcontext()
+
+
+class Tracer:
+    """Record nested timing spans and counters"""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self.stack = []
+
+    def summary(self):
+        """Aggregate spans by their nesting path"""
+        rows = {}
+        for path, _, duration in self.spans:
+            calls, total, longest = rows.get(path, (0, 0.0, 0.0))
+            rows[path] = (calls + 1, total + duration, max(longest, duration))
+
+        return sorted(rows.items())
+
+    def chrome_events(self):
+        """Convert spans and counters to Chrome trace events"""
+        pid = os.getpid()
+        events = [{
+            'name': path[-1],
+            'cat': 'apy',
+            'ph': 'X',
+            'ts': start*1e6,
+            'dur': duration*1e6,
+            'pid': pid,
+            'tid': 0,
+        } for path, start, duration in self.spans]
+
+        end = time.perf_counter() - self.t0
+        events += [{
+            'name': name,
+            'ph': 'C',
+            'ts': end*1e6,
+            'pid': pid,
+            'args': {'value': value},
+        } for name, value in self.counters.items()]
+
+        return events
+
+
+class Span:
+    """Context manager that records a timing span"""
+    __slots__ = ('tracer', 'name', 'start')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.tracer.stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        end = time.perf_counter()
+        path = tuple(self.tracer.stack)
+        self.tracer.stack.pop()
+        self.tracer.spans.append(
+            (path, self.start - self.tracer.t0, end - self.start))
+
+
+def enable():
+    """Enable tracing"""
+    # The tracer is a module level singleton, so that tracing costs nothing
+    # when it is disabled
+    global _tracer  # pylint: disable=global-statement
+    _tracer = Tracer()
+
+def enabled():
+    """Check if tracing is enabled"""
+    return _tracer is not None
+
+def span(name):
+    """Return a context manager that records a span with the given name"""
+    if _tracer is None:
+        return _null_span
+
+    return Span(_tracer, name)
+
+def count(name, n=1):
+    """Increment counter"""
+    if _tracer is not None:
+        _tracer.counters[name] = _tracer.counters.get(name, 0) + n
+
+def traced(name):
+    """Decorator that records a span for each call of the function"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+
+            with Span(_tracer, name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def report(target='-'):
+    """Write trace results
+
+    If target is '-', then a summary table is printed to stderr. Otherwise
+    the spans and counters are written as Chrome trace events (JSON) to the
+    file target, which may be loaded in chrome://tracing or Perfetto.
+    """
+    if _tracer is None:
+        return
+
+    if target != '-':
+        with open(target, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': _tracer.chrome_events()}, f)
+        click.echo(f'Trace written to {target}', err=True)
+        return
+
+    elapsed = time.perf_counter() - _tracer.t0
+    click.echo(f"\n{'Span':40s} {'calls':>8s} {'total ms':>10s} "
+               f"{'mean ms':>10s} {'max ms':>10s}", err=True)
+    click.echo('-'*82, err=True)
+    for path, (calls, total, longest) in _tracer.summary():
+        name = '  '*(len(path) - 1) + path[-1]
+        click.echo(f'{name:40s} {calls:8d} {1e3*total:10.2f} '
+                   f'{1e3*total/calls:10.3f} {1e3*longest:10.2f}', err=True)
+    click.echo('-'*82, err=True)
+    click.echo(f"{'Total (wall time)':40s} {'':8s} {1e3*elapsed:10.2f}",
+               err=True)
+
+    if _tracer.counters:
+        click.echo(f"\n{'Counter':40s} {'value':>8s}", err=True)
+        click.echo('-'*49, err=True)
+        for name, value in sorted(_tracer.counters.items()):
+            click.echo(f'{name:40s} {value:8d}', err=True)
@@ -1,6 +1,9 @@
 """Simple utility functions."""
 
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from subprocess import call
 import tempfile
 import readchar
@@ -43,6 +46,55 @@ def edit_text(input_text, prefix=None):
 
     return edited_message
 
+def chunked(items, size):
+    """Split a list into chunks of given size (a single chunk if size is 0)"""
+    if not size:
+        if items:
+            yield items
+        return
+
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def chunked_iter(items, size):
+    """Split an iterable into lists of given size (read lazily)"""
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+def parallel_map(func, items, jobs=None):
+    """Map func over items in a process pool and yield the results in order
+
+    At most two items per process are in flight at a time, so the items are
+    read lazily and the memory usage is bounded. The default number of
+    processes is the number of CPUs.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2*jobs:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+def echo_lines(lines, pager=False):
+    """Print lines from an iterable (possibly in a pager)
+
+    The pager reads the lines lazily, so a generator is only advanced as far
+    as the output is shown.
+    """
+    if pager:
+        click.echo_via_pager(f'{line}\n' for line in lines)
+    else:
+        for line in lines:
+            click.echo(line)
+
 def choose(items, text="Choose from list:"):
     """Choose from list of items"""
     click.echo(text)
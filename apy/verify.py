@@ -0,0 +1,163 @@
+"""Round-trip verification of generated notes
+
+Fields generated by apy store their original Markdown. The verification
+decodes the Markdown, converts it again, and compares the result with the
+stored HTML. Differences show fields that were edited outside of apy (e.g.
+in the Anki GUI), or that are rendered differently by the current Markdown
+extensions.
+
+The conversion runs in a pool of processes on chunks of fields, and the
+results are reported in order as the chunks complete. After each chunk, the
+last verified note id is written to a checkpoint file, so that an interrupted
+run can be resumed.
+"""
+import os
+import re
+import json
+import zlib
+
+from anki.utils import ids2str, splitFields
+
+from apy.convert import is_generated_html, html_to_markdown, rerender_markdown
+from apy.convert import parse_html, serialize_html
+from apy.utilities import chunked, parallel_map
+
+# Number of characters of context to show around the first difference
+CONTEXT = 40
+
+
+def normalize_html(html):
+    """Normalize HTML for comparison
+
+    The original Markdown attribute is removed (it may be encoded in
+    different ways), and whitespace is folded.
+    """
+    tree = parse_html(html)
+    for tag in tree.find_all(attrs={'data-original-markdown': True}):
+        del tag['data-original-markdown']
+
+    html = re.sub(r'\s+', ' ', serialize_html(tree))
+    return re.sub(r'>\s+<', '><', html).strip()
+
+def verify_field(html):
+    """Compare generated field with a new conversion of its Markdown
+
+    Returns None if the field matches, otherwise a dict that describes the
+    difference.
+    """
+    try:
+        html_to_markdown(html)
+    except (ValueError, zlib.error) as e:
+        return {'error': f'Could not decode Markdown: {e}'}
+
+    # Use the highlight mode of the stored field
+    classes = 'codehilite' in html and 'codehilite" style="' not in html
+
+    stored = normalize_html(html)
+    expected = normalize_html(rerender_markdown(html, classes))
+    if stored == expected:
+        return None
+
+    first = next((i for i, (x, y) in enumerate(zip(stored, expected))
+                  if x != y), min(len(stored), len(expected)))
+    start = max(first - CONTEXT, 0)
+    return {
+        'offset': first,
+        'stored': stored[start:first + CONTEXT],
+        'expected': expected[start:first + CONTEXT],
+    }
+
+def verify_chunk(chunk):
+    """Verify chunk of fields (run in worker processes)
+
+    The chunk is a tuple (last note id, number of notes, list of fields),
+    where each field is a tuple (note id, field name, html). Returns the
+    chunk info with the number of fields and the list of differences.
+    """
+    last, n_notes, fields = chunk
+    results = []
+    for nid, name, html in fields:
+        result = verify_field(html)
+        if result is not None:
+            results.append({'nid': nid, 'field': name, **result})
+
+    return last, n_notes, len(fields), results
+
+
+class Checkpoint:
+    """Progress of a verification run, stored as JSON in a file"""
+
+    def __init__(self, path, query):
+        self.path = path
+        self.query = query
+        self.last = None
+        self.counts = {'notes': 0, 'fields': 0, 'drifting': 0}
+
+        if path is not None and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('query') == query:
+                self.last = data['last']
+                self.counts = data['counts']
+
+    def save(self, last):
+        """Save progress (atomically)"""
+        self.last = last
+        if self.path is None:
+            return
+
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'query': self.query, 'last': last,
+                       'counts': self.counts}, f)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        """Remove checkpoint file after a completed run"""
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def verify(a, query, emit, checkpoint=None, jobs=None, chunk_size=200):
+    """Verify generated fields of notes that match query
+
+    Drifting fields are passed to emit() as dicts, in note id order, while
+    the verification runs. Notes up to the last note in the checkpoint are
+    skipped. Returns a dict with the number of verified notes and fields and
+    the number of drifting fields (including those of earlier runs).
+    """
+    checkpoint = checkpoint or Checkpoint(None, query)
+    nids = sorted(a.find_note_ids(query))
+    if checkpoint.last is not None:
+        nids = [x for x in nids if x > checkpoint.last]
+
+    counts = checkpoint.counts
+    chunks = _iter_field_chunks(a, nids, chunk_size)
+    for last, n_notes, n_fields, results in parallel_map(verify_chunk, chunks,
+                                                         jobs):
+        for result in results:
+            emit(result)
+
+        counts['notes'] += n_notes
+        counts['fields'] += n_fields
+        counts['drifting'] += len(results)
+        checkpoint.save(last)
+
+    checkpoint.remove()
+    return counts
+
+def _iter_field_chunks(a, nids, chunk_size):
+    """Yield chunks of generated fields for verify_chunk"""
+    field_names = {int(m['id']): [x['name'] for x in m['flds']]
+                   for m in a.col.models.all()}
+
+    for chunk in chunked(nids, chunk_size):
+        fields = []
+        for nid, mid, flds in a.col.db.all(
+                'select id, mid, flds from notes '
+                f'where id in {ids2str(chunk)} order by id'):
+            for name, html in zip(field_names[mid], splitFields(flds)):
+                if is_generated_html(html):
+                    fields.append((nid, name, html))
+
+        yield chunk[-1], len(chunk), fields
@@ -0,0 +1,147 @@
+"""Deterministic generator of synthetic notes, Markdown decks and collections
+
+The generated notes mix plain text, Markdown with code blocks and math, and
+clozes, and are spread over several models, decks and tags. The same size
+and seed always give the same notes.
+"""
+import os
+import random
+import shutil
+from pathlib import Path
+
+from apy.anki import Anki
+
+MODELS = ['Basic', 'Basic (and reversed card)', 'Cloze']
+DECKS = ['Default', 'Bench', 'Bench::Math', 'Bench::Code', 'Bench::Words']
+TAGS = ['marked', 'math', 'code', 'words', 'hard', 'easy', 'todo',
+        'chapter1', 'chapter2', 'chapter3']
+
+WORDS = '''
+    lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod
+    tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam
+    quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo
+    consequat duis aute irure in reprehenderit voluptate velit esse cillum
+    fugiat nulla pariatur excepteur sint occaecat cupidatat non proident sunt
+    culpa qui officia deserunt mollit anim id est laborum
+'''.split()
+
+CODE = [
+    '```python\ndef f(x):\n    return {a}*x + {b}\n```',
+    '```c\nint f(int x) {{\n    return {a}*x + {b};\n}}\n```',
+    '```bash\nfor i in $(seq {a} {b}); do\n    echo "$i"\ndone\n```',
+]
+
+MATH = [
+    r'\(x^{a} + {b}\)',
+    r'\[\int_0^{a} x^{b}\,dx\]',
+    r'\(\frac{{{a}}}{{{b}}}\)',
+]
+
+
+def sentence(rng, n_min=3, n_max=12):
+    """Random sentence"""
+    return ' '.join(rng.choice(WORDS)
+                    for _ in range(rng.randint(n_min, n_max)))
+
+def field_text(rng, kind):
+    """Random field text of given kind (plain, markdown, code or math)"""
+    a, b = rng.randint(1, 99), rng.randint(1, 99)
+    if kind == 'plain':
+        return sentence(rng)
+    if kind == 'code':
+        return sentence(rng) + '\n\n' + rng.choice(CODE).format(a=a, b=b)
+    if kind == 'math':
+        return sentence(rng) + ' ' + rng.choice(MATH).format(a=a, b=b)
+
+    return (f'**{sentence(rng, 1, 3)}** {sentence(rng)}\n\n'
+            f'* {sentence(rng)}\n* _{sentence(rng)}_')
+
+def generate_notes(n, seed=0, field_names=None):
+    """Generate n notes as parsed notes (see markdown_file_to_notes)
+
+    The field_names argument maps model names to lists of field names. The
+    defaults correspond to the standard Anki models.
+    """
+    if field_names is None:
+        field_names = {
+            'Basic': ['Front', 'Back'],
+            'Basic (and reversed card)': ['Front', 'Back'],
+            'Cloze': ['Text', 'Extra'],
+        }
+
+    rng = random.Random(seed)
+    for i in range(n):
+        model = MODELS[i % len(MODELS)]
+        kind = rng.choice(['plain', 'plain', 'markdown', 'code', 'math'])
+        names = field_names[model]
+
+        first = f'{i}: {field_text(rng, kind)}'
+        if model == 'Cloze':
+            words = first.split(' ')
+            j = rng.randrange(1, len(words))
+            words[j] = f'{{{{c1::{words[j]}}}}}'
+            first = ' '.join(words)
+
+        values = [first] + [field_text(rng, 'plain') for _ in names[1:]]
+
+        yield {
+            'model': model,
+            'deck': DECKS[i % len(DECKS)],
+            'tags': ' '.join(rng.sample(TAGS, rng.randint(0, 3))),
+            'markdown': kind != 'plain',
+            'fields': dict(zip(names, values)),
+        }
+
+def write_markdown_deck(path, notes):
+    """Write notes to Markdown file (see markdown_file_to_notes)"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, note in enumerate(notes):
+            f.write(f'# Note {i}\n')
+            f.write(f"model: {note['model']}\n")
+            f.write(f"deck: {note['deck']}\n")
+            f.write(f"tags: {note['tags']}\n")
+            f.write(f"markdown: {str(note['markdown']).lower()}\n\n")
+            for name, value in note['fields'].items():
+                f.write(f'## {name}\n{value}\n\n')
+
+def model_field_names(a):
+    """Get field names of the generated models from collection"""
+    return {name: [f['name'] for f in a.get_model(name)['flds']]
+            for name in MODELS}
+
+def create_collection(path, n, seed=0):
+    """Create collection with n generated notes at path"""
+    path = Path(path)
+    if path.exists():
+        os.remove(path)
+
+    # Create decks first (the deck list is loaded when Anki is initialized)
+    with Anki(path=str(path)) as a:
+        for deck in DECKS:
+            a.col.decks.id(deck)
+        a.modified = True
+
+    with Anki(path=str(path)) as a:
+        notes = generate_notes(n, seed, model_field_names(a))
+        with a.batch(chunk_size=10000):
+            a.add_notes_from_list(notes)
+
+    return path
+
+def cached_collection(cache_dir, n, seed=0):
+    """Return path to a fresh copy of a generated collection
+
+    Generated collections are kept in cache_dir, since generating the larger
+    ones takes a long time.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    original = cache_dir / f'bench_{n}_{seed}.anki2'
+    if not original.exists():
+        create_collection(cache_dir / 'tmp.anki2', n, seed)
+        shutil.move(cache_dir / 'tmp.anki2', original)
+
+    copy = cache_dir / 'work.anki2'
+    shutil.copy2(original, copy)
+    return copy
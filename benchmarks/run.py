@@ -0,0 +1,222 @@
+"""Run benchmarks against generated collections
+
+Examples:
+
+    # Run the default sizes and store the results
+    python benchmarks/run.py -o results.json
+
+    # Run larger sizes and compare with an earlier run
+    python benchmarks/run.py -s 10000 -s 100000 -c results.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from contextlib import redirect_stdout
+
+import click
+from click.testing import CliRunner
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# pylint: disable=wrong-import-position,wrong-import-order
+from apy import __version__
+from apy.anki import Anki
+from apy.cli import main
+from apy.config import cfg
+from apy.convert import markdown_to_html, html_to_markdown
+from apy.convert import html_to_screen, is_generated_html
+from generate import cached_collection, generate_notes, model_field_names
+from generate import write_markdown_deck
+
+
+def timed(func, repeat):
+    """Time func (with stdout suppressed) and return list of timings"""
+    timings = []
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, \
+            redirect_stdout(devnull):
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - t0)
+
+    return timings
+
+def bench_collection(path, n_add, repeat):
+    """Benchmark collection operations on collection at path
+
+    The query cache is disabled, so that repeated searches are not served
+    from the cache.
+    """
+    results = {}
+    cache_size = cfg['query_cache_size']
+    cfg['query_cache_size'] = 0
+    try:
+        results.update(_bench_session(path, n_add, repeat))
+        results['info'] = timed(lambda: _invoke(['info'], path), repeat)
+    finally:
+        cfg['query_cache_size'] = cache_size
+
+    return results
+
+def _bench_session(path, n_add, repeat):
+    """Benchmark operations within one session of collection at path"""
+    results = {}
+    with Anki(path=str(path)) as a:
+        results['find_notes'] = timed(
+            lambda: list(a.find_notes('tag:marked')), repeat)
+        results['find_cards'] = timed(
+            lambda: a.find_cards('deck:Bench::Math'), repeat)
+        results['list_cards'] = timed(
+            lambda: a.list_cards('tag:todo', verbose=True), repeat)
+        results['list_tags'] = timed(a.list_tags, repeat)
+        results['change_tags'] = timed(
+            lambda: a.change_tags('tag:hard', 'bench-tag'), repeat)
+
+        # Use a new deck for each repetition to avoid dupes
+        with tempfile.TemporaryDirectory() as tmpdir:
+            decks = []
+            for seed in range(1, repeat + 1):
+                deck = Path(tmpdir) / f'deck{seed}.md'
+                write_markdown_deck(deck, generate_notes(
+                    n_add, seed, model_field_names(a)))
+                decks.append(str(deck))
+
+            results['add_notes_from_file'] = timed(
+                lambda: a.add_notes_from_file(decks.pop()), repeat)
+
+    return results
+
+def _invoke(args, path):
+    """Invoke apy command on collection at path (raise if it fails)"""
+    cfg['path'] = str(path)
+    result = CliRunner().invoke(main, args)
+    if result.exit_code != 0:
+        raise RuntimeError(f"apy {' '.join(args)} failed: {result.output}") \
+            from result.exception
+
+def bench_convert(n, repeat):
+    """Benchmark the convert functions on n generated fields"""
+    fields = [v for note in generate_notes(n)
+              for v in note['fields'].values()]
+    html = [markdown_to_html(x) for x in fields]
+    generated = [x for x in html if is_generated_html(x)]
+
+    return {
+        'markdown_to_html': timed(
+            lambda: [markdown_to_html(x) for x in fields], repeat),
+        'html_to_markdown': timed(
+            lambda: [html_to_markdown(x) for x in generated], repeat),
+        'html_to_screen': timed(
+            lambda: [html_to_screen(x) for x in html], repeat),
+        'html_to_screen_raw': timed(
+            lambda: [html_to_screen(x, pprint=False) for x in html], repeat),
+        'is_generated_html': timed(
+            lambda: [is_generated_html(x) for x in html], repeat),
+    }
+
+def report_timings(timings, size):
+    """Print and summarize timings from a benchmark"""
+    results = []
+    for name, values in timings.items():
+        result = {
+            'name': name,
+            'size': size,
+            'min': min(values),
+            'median': statistics.median(values),
+            'times': values,
+        }
+        results.append(result)
+        click.echo(f"{name:28s} {size:8d} {1e3*result['median']:10.2f} ms")
+
+    return results
+
+def git_revision():
+    """Get current git revision (if available)"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """Print comparison of median timings against baseline results"""
+    old = {(r['name'], r['size']): r['median'] for r in baseline['results']}
+
+    click.echo(f"\n{'Benchmark':28s} {'size':>8s} {'old ms':>10s} "
+               f"{'new ms':>10s} {'ratio':>7s}")
+    click.echo('-'*67)
+    for r in results:
+        key = (r['name'], r['size'])
+        if key not in old:
+            continue
+        ratio = r['median']/old[key]
+        color = 'red' if ratio > 1.1 else 'green' if ratio < 0.9 else None
+        click.echo(f"{r['name']:28s} {r['size']:8d} {1e3*old[key]:10.2f} "
+                   f"{1e3*r['median']:10.2f} "
+                   + click.style(f'{ratio:7.2f}', fg=color))
+
+
+@click.command()
+@click.option('-s', '--size', 'sizes', type=int, multiple=True,
+              default=[1000, 10000], show_default=True,
+              help='Number of notes in generated collection.')
+@click.option('-a', '--add', 'n_add', type=int, default=100,
+              show_default=True,
+              help='Number of notes to add with add_notes_from_file.')
+@click.option('-n', '--convert-notes', 'n_convert', type=int, default=1000,
+              show_default=True,
+              help='Number of notes to use for the convert benchmarks.')
+@click.option('-r', '--repeat', type=int, default=3, show_default=True,
+              help='Number of repetitions of each benchmark.')
+@click.option('--cache-dir', default='.bench_cache', show_default=True,
+              help='Where to store generated collections.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False),
+              help='Write results as JSON to file.')
+@click.option('-c', '--compare', 'baseline', type=click.File(),
+              help='Compare with results from earlier run (JSON file).')
+def run(sizes, n_add, n_convert, repeat, cache_dir, output, baseline):
+    """Benchmark apy against generated collections."""
+    results = []
+    for size in sizes:
+        click.echo(f'Preparing collection with {size} notes ... ', nl=False)
+        path = cached_collection(cache_dir, size)
+        click.echo('done!')
+
+        timings = bench_collection(path, n_add, repeat)
+        os.remove(path)
+        results += report_timings(timings, size)
+
+    results += report_timings(bench_convert(n_convert, repeat), n_convert)
+
+    report = {
+        'meta': {
+            'apy': __version__,
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        click.echo(f'Results written to {output}')
+
+    if baseline:
+        compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    # pylint: disable=no-value-for-parameter
+    run()
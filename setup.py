@@ -27,6 +27,10 @@ setup(
         'Markdown',
         'readchar',
     ],
+    extras_require={
+        'stats': ['numpy'],
+        'fast': ['lxml'],
+    },
     entry_points='''
         [console_scripts]
         apy=apy.cli:main
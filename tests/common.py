@@ -5,10 +5,21 @@ import tempfile
 import shutil
 
 from apy.anki import Anki
+from apy.lock import CollectionLock
+from apy import sidecar
 
 testDir = os.path.dirname(__file__)
 
 
+def remove_collection(path):
+    """Remove collection file and the lock files of apy processes"""
+    lock = CollectionLock(path)
+    for filename in (path, lock.lockfile):
+        if os.path.exists(filename):
+            os.remove(filename)
+    shutil.rmtree(lock.queuedir, ignore_errors=True)
+
+
 class AnkiTest:
     """Create Anki collection wrapper"""
     def __init__(self, anki):
@@ -29,6 +40,12 @@ class AnkiEmpty(AnkiTest):
         os.unlink(self.name)
         super(AnkiEmpty, self).__init__(Anki(path=self.name))
 
+    def __exit__(self, exception_type, exception_value, traceback):
+        super(AnkiEmpty, self).__exit__(
+            exception_type, exception_value, traceback)
+        remove_collection(self.name)
+        sidecar.remove(self.name)
+
 
 class AnkiSimple(AnkiTest):
     """Create Anki collection wrapper"""
@@ -41,4 +58,5 @@ class AnkiSimple(AnkiTest):
     def __exit__(self, exception_type, exception_value, traceback):
         super(AnkiSimple, self).__exit__(
             exception_type, exception_value, traceback)
-        os.remove(self.tmppath)
+        remove_collection(self.tmppath)
+        sidecar.remove(self.tmppath)
@@ -28,3 +28,80 @@ def test_add_different_models():
         n_cards = a.col.cardCount()
         a.add_notes_from_file(testDir + '/data/models.md')
         assert a.col.cardCount() == n_cards + 6
+
+def test_edit_without_changes(monkeypatch):
+    """Test that saving an unchanged note does not modify the collection"""
+    monkeypatch.setenv('EDITOR', 'true')
+
+    with AnkiSimple() as a:
+        note = next(a.find_notes('deck:*'))
+        fields = list(note.n.fields)
+
+        changes = note.edit()
+
+        assert changes == {'fields': 0, 'tags': 0}
+        assert note.n.fields == fields
+        assert not a.modified
+
+def test_toggle_marked():
+    """Test that toggling the marked tag flushes the note"""
+    with AnkiSimple() as a:
+        note = next(a.find_notes('deck:*'))
+        marked = 'marked' in note.n.tags
+
+        note.toggle_marked()
+
+        assert ('marked' in note.n.tags) != marked
+        assert a.modified
+
+def test_note_views():
+    """Test that note views agree with the full Note objects"""
+    with AnkiSimple() as a:
+        a.add_notes_from_file(testDir + '/data/deck.md')
+
+        notes = list(a.find_notes('deck:*'))
+        views = list(a.iter_note_views('deck:*', chunk_size=2))
+
+        assert [v.id for v in views] == [n.n.id for n in notes]
+        for view, note in zip(views, notes):
+            assert view.mid == note.n.mid
+            assert view.tags == note.n.tags
+            assert view.first_field == note.n.fields[0]
+            assert view.suspended == note.suspended
+            assert a.col.decks.name(view.did) == note.get_deck()
+
+def test_sort_ids():
+    """Test sorting and limiting of ids in the database"""
+    with AnkiSimple() as a:
+        cids = a.find_cards('deck:*')
+        a.col.db.execute('update cards set ivl = id % 7')
+
+        # Ties are sorted by id in ascending order
+        ivl = {cid: a.col.getCard(cid).ivl for cid in cids}
+        ordered = sorted(cids, key=lambda x: (-ivl[x], x))
+
+        assert a.sort_ids('cards', cids, 'ivl', reverse=True,
+                          limit=2, offset=1) == ordered[1:3]
+        assert list(a.sort_ids('cards', cids, limit=2)) == list(cids[:2])
+
+def test_bulk_card_changes():
+    """Test set-based suspend, flag and move of matched cards"""
+    with AnkiSimple() as a:
+        n_cards = a.col.cardCount()
+        n_matched, cids = a.select_cards('deck:*', 'queue != -1')
+        assert n_matched == n_cards
+
+        a.suspend_cards(cids)
+        assert len(a.find_cards('is:suspended')) == len(cids)
+        assert a.select_cards('deck:*', 'queue != -1')[1] == []
+
+        a.suspend_cards(cids, False)
+        assert not a.find_cards('is:suspended')
+
+        a.flag_cards(cids[:2], 1)
+        assert sorted(a.find_cards('flag:1')) == sorted(cids[:2])
+        a.flag_cards(cids[:2], 0)
+        assert not a.find_cards('-flag:0')
+
+        a.move_cards(cids[:1], 'Default')
+        assert cids[0] in a.find_cards('deck:Default')
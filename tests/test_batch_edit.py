@@ -19,3 +19,17 @@ def test_change_tags():
 
         a.change_tags(query, 'test', add=False)
         assert len(list(a.find_notes(query))) == 0
+
+def test_batch_rollback():
+    """Test that a failed chunk is rolled back"""
+    with AnkiSimple() as a:
+        n_notes = a.col.noteCount()
+
+        with pytest.raises(RuntimeError):
+            with a.batch(chunk_size=2):
+                a.add_notes_from_file(testDir + '/' + 'data/deck.md')
+                a.add_notes_single(['Front', 'Back'])
+                raise RuntimeError
+
+        assert a.col.noteCount() == n_notes + 2
+        assert a.modified
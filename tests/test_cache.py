@@ -0,0 +1,33 @@
+"""Test the query result cache"""
+from apy.cache import QueryCache, is_time_dependent
+
+
+def test_query_cache(tmp_path):
+    """Test lookup, invalidation and eviction"""
+    cache = QueryCache(tmp_path / 'collection.anki2', max_size=8*150)
+
+    assert cache.get('notes', 'tag:a', 'stamp1') is None
+    cache.put('notes', 'tag:a', 'stamp1', range(100))
+    assert list(cache.get('notes', 'tag:a', 'stamp1')) == list(range(100))
+    assert cache.get('notes', 'tag:a', 'stamp2') is None
+    assert cache.get('cards', 'tag:a', 'stamp1') is None
+
+    # Adding 50 ids fits, but 40 more evicts the least recently used result
+    cache.put('notes', 'tag:b', 'stamp1', range(50))
+    cache.get('notes', 'tag:a', 'stamp1')
+    cache.put('notes', 'tag:c', 'stamp1', range(40))
+    assert cache.get('notes', 'tag:b', 'stamp1') is None
+    assert cache.get('notes', 'tag:a', 'stamp1') is not None
+    assert cache.get('notes', 'tag:c', 'stamp1') is not None
+
+    cache.close()
+    assert sorted(x.name for x in tmp_path.iterdir()) == ['collection.apy.db']
+
+
+def test_time_dependent_queries():
+    """Test detection of queries that must not be cached"""
+    assert is_time_dependent('deck:Default is:due')
+    assert is_time_dependent('-is:learn')
+    assert is_time_dependent('prop:due<=1 OR rated:1')
+    assert not is_time_dependent('deck:Default tag:is:due-later')
+    assert not is_time_dependent('is:new added:1')
@@ -0,0 +1,43 @@
+"""Test changefeed"""
+import time
+
+import click
+import pytest
+
+from common import AnkiSimple
+from apy.changes import iter_changes
+
+pytestmark = pytest.mark.filterwarnings("ignore")
+
+
+def test_changes():
+    """Test that only changes since the cursor are reported"""
+    with AnkiSimple() as a:
+        records = list(iter_changes(a))
+        cursor = records[-1]['cursor']
+        assert len(records) == a.col.noteCount() + a.col.cardCount() + 1
+        assert {x['op'] for x in records[:-1]} == {'add'}
+
+        nids = sorted(a.find_note_ids('deck:*'))
+        a.col.tags.bulkAdd(nids[:1], 'changed')
+        a.delete_notes(nids[1])
+
+        # Changes are reported once their second has passed
+        time.sleep(1.1)
+
+        records = list(iter_changes(a, cursor))
+        assert records[-1]['cursor'] != cursor
+        assert {(x['op'], x['type'], x['id']) for x in records[:-1]
+                if x['type'] == 'note'} == {('modify', 'note', nids[0]),
+                                             ('delete', 'note', nids[1])}
+
+def test_changes_graves():
+    """Test that a full feed has no deletions and renumbered graves abort"""
+    with AnkiSimple() as a:
+        a.delete_notes(sorted(a.find_note_ids('deck:*'))[0])
+        records = list(iter_changes(a))
+        assert 'delete' not in {x.get('op') for x in records}
+
+        a.col.db.execute('delete from graves')
+        with pytest.raises(click.Abort):
+            list(iter_changes(a, records[-1]['cursor']))
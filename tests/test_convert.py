@@ -0,0 +1,104 @@
+"""Test conversion between Markdown and HTML"""
+import pytest
+
+from apy import convert
+from apy.convert import markdown_to_html, html_to_screen
+from apy.convert import rerender_highlight, rerender_markdown
+from apy.convert import with_highlight_css
+from apy.convert import HIGHLIGHT_CSS_START, HIGHLIGHT_CSS_END
+from apy.convert import encode_markdown, reencode_markdown, html_to_markdown
+from apy.convert import COMPACT_PREFIX
+
+MARKDOWN = [
+    'Some *text* with `code`\n\n- a\n- b <br> c',
+    '| a | b |\n|---|---|\n| 1 | 2 |\n\nTerm\n:   Definition',
+    'Footnote[^1]\n\n[^1]: Note',
+    'a & b < c',
+    '<div>Raw *HTML*</div>',
+    r'Math \(x\) and $$\frac{a}{b}$$',
+    '',
+]
+
+HTML = [
+    'Plain text',
+    '<b>Bold</b> text &amp; more<br>Next line',
+    '<div>a</div><div>b &lt; c</div>',
+    '</p>Stray end tags</span> and <p>unclosed',
+    'Text <!-- comment --> <i data-original-markdown="eA==">x</i>',
+]
+
+CODE = 'Example:\n\n```python\ndef f(x):\n    return 2*x\n```'
+
+
+def test_highlight_classes():
+    """Test class-based highlighting keeps the source and saves space"""
+    inline = markdown_to_html(CODE, highlight_classes=False)
+    classes = markdown_to_html(CODE, highlight_classes=True)
+
+    assert 'style=' in inline
+    assert 'style=' not in classes
+    assert len(classes) < len(inline)
+    assert html_to_screen(classes, parseable=True) \
+        == html_to_screen(inline, parseable=True)
+    assert rerender_highlight(inline) == classes
+    assert rerender_highlight('<p>No code</p>') == '<p>No code</p>'
+
+def test_highlight_css():
+    """Test that the highlight stylesheet is added once"""
+    css = with_highlight_css('.card { color: black; }\n')
+    assert css.startswith('.card')
+    assert css.count(HIGHLIGHT_CSS_START) == 1
+    assert css.count(HIGHLIGHT_CSS_END) == 1
+    assert with_highlight_css(css) == css
+
+def test_compact_encoding():
+    """Test that both encodings of the original Markdown are decoded"""
+    plain = 'Some *text* with\nnewlines\n\n' + 'repeated '*20
+    legacy = markdown_to_html(plain)
+    compact = reencode_markdown(legacy, 'compact')
+
+    assert COMPACT_PREFIX in compact
+    assert len(compact) < len(legacy)
+    assert html_to_markdown(compact) == plain
+    assert html_to_markdown(legacy) == plain
+    assert reencode_markdown(compact, 'base64') == legacy
+    assert encode_markdown('x', 'compact') == encode_markdown('x', 'base64')
+
+def test_rerender_markdown():
+    """Test that re-rendering uses the stored Markdown as is"""
+    # The legacy encoding does not keep literal <br> tags (MARKDOWN[0])
+    for plain in MARKDOWN[1:] + [CODE, r'Escaped \\ and \{braces\} *}']:
+        html = markdown_to_html(plain)
+        assert rerender_markdown(html) == html
+
+def _parse_all():
+    """Results of all parser dependent conversions of the test inputs"""
+    generated = [markdown_to_html(x) for x in MARKDOWN + [CODE]]
+    return (generated,
+            [convert.html_to_text(x) for x in generated + HTML],
+            [convert.is_generated_html(x) for x in generated + HTML])
+
+@pytest.mark.parametrize('parser', ['html.parser', 'lxml'])
+def test_parser_backends(monkeypatch, parser):
+    """Test that the parser backends give the same results as html.parser"""
+    if parser != 'html.parser':
+        pytest.importorskip(parser)
+
+    monkeypatch.setattr(convert, 'HTML_PARSER', 'html.parser')
+    expected = _parse_all()
+
+    monkeypatch.setattr(convert, 'HTML_PARSER', parser)
+    assert _parse_all() == expected
+
+def test_pretty_printer():
+    """Test that the fast pretty printer matches html5lib and prettify"""
+    bs4 = pytest.importorskip('bs4')
+    pytest.importorskip('html5lib')
+
+    # Comments are skipped (the old output showed them as bare text)
+    for html in [markdown_to_html(x) for x in MARKDOWN + [CODE]] + HTML[:-1]:
+        soup = bs4.BeautifulSoup(html.replace('\n', ''),
+                                 features='html5lib').body
+        expected = ''.join(x.prettify() if isinstance(x, bs4.Tag) else x
+                           for x in soup.contents)
+        assert html_to_screen(html, pprint=False) == expected
@@ -0,0 +1,57 @@
+"""Test differences between collection files"""
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from apy.diff import iter_diff, summarize
+
+pytestmark = pytest.mark.filterwarnings("ignore")
+
+testDir = os.path.dirname(__file__)
+
+
+def test_diff(tmp_path):
+    """Test that added, deleted and modified notes and cards are found"""
+    old = tmp_path / 'old.anki2'
+    new = tmp_path / 'new.anki2'
+    shutil.copy2(testDir + '/data/test_base/Test/collection.anki2', old)
+    shutil.copy2(old, new)
+
+    assert not list(iter_diff(old, new))
+
+    db = sqlite3.connect(new)
+    (nid0, guid0, flds0), (nid1, guid1, _) = db.execute(
+        'select id, guid, flds from notes order by id limit 2').fetchall()
+    cid = db.execute('select id from cards where nid != ? and nid != ? '
+                     'order by id limit 1', (nid0, nid1)).fetchone()[0]
+
+    fields = flds0.split('\x1f')
+    fields[0] = 'changed'
+    db.execute("update notes set flds = ?, tags = ' new ', mod = mod + 1 "
+               "where id = ?", ('\x1f'.join(fields), nid0))
+    db.execute('delete from notes where id = ?', (nid1,))
+    db.execute('delete from cards where nid = ?', (nid1,))
+    db.execute('update cards set ivl = ivl + 3, mod = mod + 1 where id = ?',
+               (cid,))
+    db.commit()
+    db.close()
+
+    records = list(iter_diff(old, new))
+    notes = [x for x in records if x['type'] == 'note']
+    assert {(x['op'], x['guid']) for x in notes} == {('modify', guid0),
+                                                      ('delete', guid1)}
+
+    modified = next(x for x in notes if x['op'] == 'modify')
+    assert [x['new'] for x in modified['fields'].values()] == ['changed']
+    assert 'new' in modified['tags']['added']
+
+    cards = [x for x in records if x['type'] == 'card']
+    assert {x['op'] for x in cards if x['nid'] == nid1} == {'delete'}
+    assert [(x['id'], list(x['changes'])) for x in cards
+            if x['op'] == 'modify'] == [(cid, ['ivl'])]
+
+    reverse = summarize(iter_diff(new, old))
+    assert reverse[('note', 'add')] == 1
+    assert reverse[('card', 'ivl')] == 1
@@ -0,0 +1,55 @@
+"""Test duplicate detection"""
+import pytest
+
+from common import AnkiEmpty
+from apy.dupes import MinHasher, UnionFind, find_duplicates, _union_similar
+
+pytestmark = pytest.mark.filterwarnings("ignore")
+
+SENTENCE = ('The mitochondrion is the powerhouse of the cell and produces '
+            'most of its ATP by oxidative phosphorylation')
+
+
+def test_dupes():
+    """Test that exact and near-duplicates are clustered"""
+    with AnkiEmpty() as a:
+        a.add_notes_single(['What is the capital of France?', 'Paris'])
+        a.add_notes_single(['what is the  CAPITAL of france?', 'paris'])
+        a.add_notes_single([SENTENCE, 'Biology'])
+        a.add_notes_single([SENTENCE.replace('most', 'much'), 'Biology'])
+        a.add_notes_single(['Something else entirely', 'Unrelated'])
+
+        clusters = find_duplicates(a, near=False)
+        assert len(clusters) == 1
+        assert clusters[0]['exact']
+        assert clusters[0]['text'] == 'what is the capital of france? paris'
+
+        pytest.importorskip('numpy')
+        clusters = sorted(find_duplicates(a), key=lambda x: x['exact'])
+        assert [len(x['nids']) for x in clusters] == [2, 2]
+        assert [x['exact'] for x in clusters] == [False, True]
+
+
+def test_minhash_blocks():
+    """Test that signatures of long texts are hashed in blocks"""
+    np = pytest.importorskip('numpy')
+    hasher = MinHasher()
+    text = SENTENCE*200
+    shingles = hasher.shingles(text)
+    hashes = hasher.a[:, None]*shingles[None, :] + hasher.b[:, None]
+    expected = (hashes.min(axis=1) >> np.uint64(32)).astype('uint32')
+
+    signatures = hasher.signatures([text, 'short'])
+    assert signatures.shape == (2, len(hasher.a))
+    assert (signatures[0] == expected).all()
+
+
+def test_union_similar_buckets():
+    """Test that large buckets of similar notes are merged into one set"""
+    np = pytest.importorskip('numpy')
+    matrix = np.zeros((501, 64), dtype='uint32')
+    matrix[500, 4:] = 1
+
+    sets = UnionFind(502)
+    _union_similar(sets, list(range(1, 502)), matrix, 0.8)
+    assert sets.groups() == [list(range(1, 501))]
@@ -0,0 +1,48 @@
+"""Test import of notes from CSV, TSV and JSONL files"""
+import io
+
+import pytest
+
+from common import AnkiEmpty
+from apy.importer import iter_records, parse_mapping
+from apy.importer import prepare_notes, import_notes
+
+pytestmark = pytest.mark.filterwarnings("ignore")
+
+
+CSV = '''question,Back,tags,deck
+What is 1+1?,2,math,Imported
+"Multi
+line",yes,,
+What is 1+1?,duplicate,,
+'''
+
+JSONL = '''{"Front": "**bold**", "Back": "x", "markdown": true, "tags": ["a", "b"]}
+
+{"Front": "plain", "Back": "y"}
+'''
+
+
+def test_import_csv():
+    """Test import with mapping, per-row tags and deck, and duplicates"""
+    with AnkiEmpty() as a:
+        records = iter_records(io.StringIO(CSV), 'csv')
+        notes = prepare_notes(a, records, 'Basic', tags='imported',
+                              mapping=parse_mapping(['Front=question']))
+        stats = import_notes(a, notes, chunk_size=2)
+        assert stats == {'notes': 3, 'added': 2, 'skipped': 1}
+
+        assert len(a.find_note_ids('tag:math tag:imported')) == 1
+        assert len(a.find_note_ids('deck:Imported')) == 1
+        assert len(a.find_note_ids('Front:Multi*')) == 1
+
+
+def test_import_jsonl():
+    """Test import of JSON lines with Markdown flag"""
+    with AnkiEmpty() as a:
+        records = iter_records(io.StringIO(JSONL), 'jsonl')
+        stats = import_notes(a, prepare_notes(a, records, 'Basic'))
+        assert stats['added'] == 2
+
+        note = a.col.getNote(a.find_note_ids('tag:a tag:b')[0])
+        assert '<strong>bold</strong>' in note['Front']
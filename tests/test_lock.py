@@ -0,0 +1,85 @@
+"""Test locking between processes"""
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import subprocess
+
+import click
+import pytest
+
+from common import AnkiSimple
+from apy.anki import Anki
+from apy.lock import CollectionLock
+
+test_collection_dir = "tests/data/test_base/"
+
+
+def test_lock_exclusive():
+    """Test that writers exclude each other and readers share the lock"""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = os.path.join(tmpdirname, 'collection.anki2')
+
+        with CollectionLock(path):
+            with pytest.raises(TimeoutError):
+                CollectionLock(path, timeout=0.2).acquire()
+            with pytest.raises(TimeoutError):
+                CollectionLock(path, shared=True, timeout=0.2).acquire()
+
+        with CollectionLock(path, shared=True):
+            with CollectionLock(path, shared=True, timeout=0.2):
+                pass
+
+            with pytest.raises(TimeoutError):
+                CollectionLock(path, timeout=0.2).acquire()
+
+        assert not os.listdir(os.path.join(tmpdirname, 'collection.apyqueue'))
+
+def test_read_alongside_writer():
+    """Test that readers open a snapshot while a writer has the collection"""
+    with AnkiSimple() as a:
+        n_notes = a.col.noteCount()
+        a.add_notes_single(['Front', 'Back'], model='Basic')
+        a.col.save()
+        a.add_notes_single(['Uncommitted', 'Back'], model='Basic')
+
+        with Anki(path=a.path, read_only=True) as reader:
+            assert reader.path == a.path
+            assert reader.col.path != a.col.path
+            assert reader.col.noteCount() == n_notes + 1
+
+    with pytest.raises(click.Abort):
+        Anki(path=os.path.join(tempfile.gettempdir(), 'missing', 'c.anki2'))
+
+def test_concurrent_processes():
+    """Stress test with many apy processes against one collection"""
+    n_writers = 8
+    n_readers = 8
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        shutil.copytree(test_collection_dir, tmpdirname, dirs_exist_ok=True)
+        path = os.path.join(tmpdirname, 'Test', 'collection.anki2')
+
+        with sqlite3.connect(path) as db:
+            n_notes = db.execute('select count() from notes').fetchone()[0]
+
+        command = [sys.executable, '-m', 'apy.cli', '-b', tmpdirname]
+        processes = []
+        for i in range(n_writers + n_readers):
+            if i % 2 == 0:
+                args = ['add-single', f'Stress test {i}', 'Answer']
+            else:
+                args = ['list', 'deck:*']
+
+            processes.append(subprocess.Popen(command + args,
+                                              stdout=subprocess.DEVNULL,
+                                              stderr=subprocess.PIPE))
+
+        for process in processes:
+            _, stderr = process.communicate(timeout=300)
+            assert process.returncode == 0, stderr.decode()
+
+        with sqlite3.connect(path) as db:
+            assert db.execute('select count() from notes').fetchone()[0] \
+                == n_notes + n_writers
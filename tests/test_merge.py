@@ -0,0 +1,122 @@
+"""Test merging of collections"""
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from common import AnkiEmpty, testDir
+from apy.merge import merge_collection
+
+pytestmark = pytest.mark.filterwarnings("ignore")
+
+OTHER = os.path.join(testDir, 'data/test_base/Test/collection.anki2')
+
+
+def test_merge():
+    """Test that notes are added once, with their models and cards"""
+    with AnkiEmpty() as a:
+        stats = merge_collection(a, OTHER, media=False)
+        assert stats['added'] == stats['notes'] > 0
+        assert stats['cards'] == a.col.cardCount()
+        assert a.col.noteCount() == stats['notes']
+
+        # Models imported under a new name (e.g. Cloze-2a756) are matched by id
+        suffixed = [x for x in stats['models'] if x.startswith('Cloze-')]
+
+        # Merging again skips the existing notes
+        stats = merge_collection(a, OTHER, media=False)
+        assert stats['added'] == 0
+        assert stats['skipped'] == stats['notes']
+        assert stats['models'] == []
+        assert stats['renamed'] == [('Cloze', x) for x in suffixed]
+
+def _copy_other(tmp_path, *statements):
+    """Copy the other collection and run SQL statements on the copy"""
+    path = tmp_path / 'collection.anki2'
+    shutil.copy2(OTHER, path)
+    db = sqlite3.connect(path)
+    for statement in statements:
+        db.execute(*statement)
+    db.commit()
+    db.close()
+    return str(path)
+
+def test_merge_update(tmp_path):
+    """Test that notes modified later are updated with update=True"""
+    with AnkiEmpty() as a:
+        merge_collection(a, OTHER, media=False)
+        nid = a.col.db.scalar('select min(id) from notes')
+        other = _copy_other(tmp_path, (
+            "update notes set flds = 'New\x1fFields', mod = mod + 100 "
+            'where id = ?', (nid,)))
+
+        stats = merge_collection(a, other, media=False)
+        assert stats['updated'] == 0
+        assert a.col.getNote(nid).fields != ['New', 'Fields']
+
+        stats = merge_collection(a, other, update=True, media=False)
+        assert stats['updated'] == 1
+        assert stats['skipped'] == stats['notes'] - 1
+        assert a.col.getNote(nid).fields == ['New', 'Fields']
+
+def test_merge_id_collisions(tmp_path):
+    """Test that notes and cards with taken ids get new ids"""
+    with AnkiEmpty() as a:
+        merge_collection(a, OTHER, media=False)
+        n_notes, n_cards = a.col.noteCount(), a.col.cardCount()
+        other = _copy_other(tmp_path, ("update notes set guid = guid || 'x'",))
+
+        stats = merge_collection(a, other, media=False)
+        assert stats['added'] == n_notes
+        assert a.col.noteCount() == 2*n_notes
+        assert a.col.cardCount() == 2*n_cards
+        assert a.col.db.scalar('select count() from cards where nid not in '
+                               '(select id from notes)') == 0
+
+def test_merge_schedule(tmp_path):
+    """Test that review due dates are shifted to the local creation day"""
+    with AnkiEmpty() as a:
+        other = _copy_other(tmp_path, (
+            'update cards set type = 2, queue = 2, ivl = 10, due = 100 '
+            'where id = (select min(id) from cards)',))
+        db = sqlite3.connect(other)
+        cid, crt = db.execute('select (select min(id) from cards), crt '
+                              'from col').fetchone()
+        db.close()
+
+        merge_collection(a, other, media=False)
+        assert a.col.getCard(cid).due == 100 + (crt - a.col.crt)//86400
+
+def test_merge_media(tmp_path):
+    """Test that media files that the notes refer to are copied"""
+    (tmp_path / 'collection.media').mkdir()
+    (tmp_path / 'collection.media' / 'merged.png').write_bytes(b'png')
+    (tmp_path / 'outside.png').write_bytes(b'png')
+    other = _copy_other(tmp_path, (
+        'update notes set flds = flds || ? where id = (select min(id) '
+        'from notes)', ('<img src="merged.png"><img src="../outside.png">',)))
+
+    with AnkiEmpty() as a:
+        stats = merge_collection(a, other)
+        assert stats['media'] == 1
+        media_dir = Path(a.col.media.dir())
+        assert (media_dir / 'merged.png').read_bytes() == b'png'
+        assert not (media_dir.parent / 'outside.png').exists()
+
+        stats = merge_collection(a, other, media=False)
+        assert stats['media'] == 0
+
+def test_merge_renamed_model():
+    """Test that imported models that were renamed are matched by id"""
+    with AnkiEmpty() as a:
+        stats = merge_collection(a, OTHER, media=False)
+        assert 'MyTest' in stats['models']
+        model = a.col.models.byName('MyTest')
+        model['name'] = 'Renamed'
+        a.col.models.save(model)
+
+        stats = merge_collection(a, OTHER, media=False)
+        assert stats['models'] == []
+        assert ('MyTest', 'Renamed') in stats['renamed']
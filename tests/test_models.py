@@ -1,5 +1,10 @@
 """Test model features"""
-from common import AnkiSimple
+import shutil
+
+from common import testDir, AnkiEmpty, AnkiSimple
+from apy.anki import Anki
+from apy.cache import load_snapshot
+from apy.convert import HIGHLIGHT_CSS_START, rerender_highlight
 
 
 def test_rename_model():
@@ -11,3 +16,37 @@ def test_rename_model():
 
         assert 'NewModelName' in a.model_names
         assert 'MyTest' not in a.model_names
+
+def test_metadata_snapshot(tmp_path):
+    """Test that the metadata snapshot is updated after renaming a model"""
+    path = str(tmp_path / 'collection.anki2')
+    shutil.copy2(testDir + '/data/test_base/Test/collection.anki2', path)
+
+    with Anki(path=path) as a:
+        a.rename_model('MyTest', 'NewModelName')
+
+    with Anki(path=path) as a:
+        assert load_snapshot(path, a._metadata_stamp()) is not None
+        assert 'NewModelName' in a.model_names
+        assert a.model_field_names('NewModelName') == [
+            'FieldOne', 'FieldTwo', 'FieldThree']
+
+def test_migrate_highlight(tmp_path):
+    """Test that code blocks are re-rendered with classes and CSS is added"""
+    input_file = tmp_path / 'code.md'
+    input_file.write_text('model: Basic\n\n# Note\n## Front\nCode?\n\n'
+                          '## Back\n```python\nprint("hello")\n```\n')
+
+    with AnkiEmpty() as a:
+        a.add_notes_from_file(str(input_file))
+        stats = a.transform_fields('deck:*', rerender_highlight)
+        assert stats['changed'] == 1
+        assert stats['after'] < stats['before']
+
+        model = a.get_model('Basic')
+        a.ensure_highlight_css(model)
+        assert HIGHLIGHT_CSS_START in a.get_model('Basic')['css']
+
+        back = a.col.getNote(a.find_note_ids('deck:*')[0]).fields[1]
+        assert 'style=' not in back
+        assert a.transform_fields('deck:*', rerender_highlight)['changed'] == 0
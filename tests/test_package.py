@@ -0,0 +1,35 @@
+"""Test export of packages"""
+import json
+import sqlite3
+import zipfile
+
+import pytest
+
+from common import AnkiEmpty, AnkiSimple
+from apy.merge import merge_collection
+from apy.package import export_package
+
+pytestmark = pytest.mark.filterwarnings("ignore")
+
+
+def test_export_package(tmp_path):
+    """Test that exported packages contain the notes and can be merged"""
+    path = tmp_path / 'test.apkg'
+    with AnkiSimple() as a:
+        nids = set(a.find_note_ids('deck:*'))
+        stats = export_package(a, 'deck:*', path, scheduling=False)
+        assert stats['notes'] == len(nids)
+
+    with zipfile.ZipFile(path) as zf:
+        assert json.loads(zf.read('media')) == {}
+        zf.extract('collection.anki2', tmp_path)
+
+    db = sqlite3.connect(tmp_path / 'collection.anki2')
+    assert db.execute('select count() from notes').fetchone()[0] == len(nids)
+    assert db.execute('select count() from cards where queue != 0 '
+                      'or ivl != 0').fetchone()[0] == 0
+    db.close()
+
+    with AnkiEmpty() as a:
+        stats = merge_collection(a, tmp_path / 'collection.anki2')
+        assert stats['added'] == len(nids)
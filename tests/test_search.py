@@ -0,0 +1,21 @@
+"""Test the full-text search index"""
+import pytest
+
+from common import testDir, AnkiSimple
+
+pytestmark = pytest.mark.filterwarnings("ignore")
+
+
+def test_search():
+    """Test full-text search in decoded Markdown"""
+    with AnkiSimple() as a:
+        a.add_notes_from_file(testDir + '/data/deck.md')
+
+        results = a.search_notes('"deck.md"')
+        assert len(results) == 2
+
+        query = a.restrict_query('deck:NewDeck', '"deck.md"')
+        assert len(list(a.find_notes(query))) == 1
+
+        a.delete_notes([nid for nid, _, _ in results])
+        assert not a.search_notes('"deck.md"')
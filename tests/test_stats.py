@@ -0,0 +1,87 @@
+"""Test review statistics"""
+import pytest
+
+from common import AnkiSimple
+from apy.schedule import forecast, balance_load, load_review_cards
+from apy.schedule import plan_reschedule
+from apy.stats import compute_stats
+
+pytest.importorskip('numpy')
+pytestmark = pytest.mark.filterwarnings("ignore")
+
+
+def test_stats():
+    """Test that statistics cover all (or the matching) cards"""
+    with AnkiSimple() as a:
+        stats = compute_stats(a, chunk_size=2)
+        assert stats['cards'] == a.col.cardCount()
+        assert {r['name'] for r in stats['retention']['deck']} \
+            <= set(a.deck_names)
+
+        stats = compute_stats(a, 'deck:Default')
+        assert stats['cards'] == len(a.find_cards('deck:Default'))
+        assert {r['name'] for r in stats['retention']['tag']} \
+            <= {t for nid in a.find_note_ids('deck:Default')
+                for t in a.col.getNote(nid).tags}
+
+def test_forecast():
+    """Test that forecast is reproducible and counts new cards"""
+    with AnkiSimple() as a:
+        result = forecast(a, days=10, sims=5, seed=1)
+        assert len(result['mean']) == 10
+        assert result == forecast(a, days=10, sims=5, seed=1)
+
+        result = forecast(a, days=10, n_new=3, sims=5, seed=1, bucket=7)
+        assert len(result['mean']) == 2
+        assert sum(result['mean']) >= 30
+
+def test_filtered_deck_due():
+    """Test that review cards in filtered decks count at their original due"""
+    with AnkiSimple() as a:
+        cid = sorted(a.find_cards('deck:*'))[0]
+        a.col.db.execute('update cards set type = 2, queue = 2, ivl = 10, '
+                         'due = -100000, odue = ?, odid = 1 where id = ?',
+                         a.col.sched.today + 3, cid)
+
+        cids, due, _, _ = load_review_cards(a)
+        assert due[cids == cid].tolist() == [3]
+
+def test_balance_load():
+    """Test that balanced due dates flatten the load within the tolerance"""
+    np = pytest.importorskip('numpy')
+    due = np.array([0]*20 + [5]*5)
+    ivl = np.array([10]*10 + [1]*10 + [30]*5)
+    background = np.zeros(10, dtype='int64')
+
+    new = balance_load(due, ivl, background, 0.1)
+    assert (np.abs(new - due) <= np.floor(0.1*ivl)).all()
+    assert (new[10:20] == 0).all()
+    assert np.bincount(new).max() == 10
+
+def test_balance_load_overdue():
+    """Test that overdue cards move at most the tolerance from their due"""
+    np = pytest.importorskip('numpy')
+    due = np.array([-10, -3])
+    ivl = np.array([50, 50])
+    background = np.array([10] + [0]*9)
+
+    new = balance_load(due, ivl, background, 0.1)
+    assert new[0] == 0
+    assert 0 < new[1] <= 2
+
+def test_reschedule_filtered_deck():
+    """Test that cards in filtered decks are not rescheduled"""
+    with AnkiSimple() as a:
+        today = a.col.sched.today
+        cids = sorted(a.find_cards('deck:*'))
+        for cid in cids:
+            a.col.db.execute('update cards set type = 2, queue = 2, '
+                             'ivl = 100, due = ? where id = ?', today, cid)
+        a.col.db.execute('update cards set due = -100000, odue = ?, odid = 1 '
+                         'where id = ?', today, cids[0])
+
+        cid, old, _, before, after = plan_reschedule(a, 'deck:*', 10)
+        assert cids[0] not in cid
+        assert len(cid) == len(cids) - 1
+        assert (old == 0).all()
+        assert sum(before) == sum(after) == len(cids) - 1
@@ -0,0 +1,25 @@
+"""Test the tracing instrumentation"""
+import json
+
+from apy import trace
+
+
+def test_trace(tmp_path, monkeypatch):
+    """Test that nested spans and counters are recorded"""
+    monkeypatch.setattr(trace, '_tracer', None)
+    assert trace.span('disabled') is trace.span('other')
+
+    trace.enable()
+    with trace.span('outer'):
+        with trace.span('inner'):
+            trace.count('things', 2)
+
+    rows = dict(trace._tracer.summary())
+    assert rows[('outer',)][0] == 1
+    assert rows[('outer', 'inner')][0] == 1
+    assert trace._tracer.counters == {'things': 2}
+
+    target = tmp_path / 'trace.json'
+    trace.report(str(target))
+    events = json.loads(target.read_text())['traceEvents']
+    assert {e['name'] for e in events} == {'outer', 'inner', 'things'}
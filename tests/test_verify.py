@@ -0,0 +1,54 @@
+"""Test round-trip verification of generated notes"""
+import pytest
+
+from common import AnkiEmpty
+from apy.convert import rerender_markdown
+from apy.verify import verify, verify_field, Checkpoint
+
+pytestmark = pytest.mark.filterwarnings("ignore")
+
+
+def write_notes(tmp_path, n_notes=5):
+    """Write Markdown file with simple notes and return its path"""
+    input_file = tmp_path / 'notes.md'
+    input_file.write_text(''.join(
+        f'# Note\nmodel: Basic\n\n## Front\nWhat is *{i}*?\n\n'
+        f'## Back\n**{i}**, of course\n\n' for i in range(n_notes)))
+    return str(input_file)
+
+def test_verify(tmp_path):
+    """Test that fields edited outside of apy are reported"""
+    with AnkiEmpty() as a:
+        a.add_notes_from_file(write_notes(tmp_path))
+        nid = sorted(a.find_note_ids('deck:*'))[2]
+        note = a.col.getNote(nid)
+        assert verify_field(note.fields[1]) is None
+
+        note.fields[1] = note.fields[1].replace('of course', 'obviously')
+        note.flush()
+
+        results = []
+        checkpoint = tmp_path / 'checkpoint.json'
+        counts = verify(a, 'deck:*', results.append,
+                        Checkpoint(str(checkpoint), 'deck:*'), jobs=2,
+                        chunk_size=2)
+        assert counts == {'notes': 5, 'fields': 10, 'drifting': 1}
+        assert [(x['nid'], x['field']) for x in results] == [(nid, 'Back')]
+        assert not checkpoint.exists()
+
+def test_rerender(tmp_path):
+    """Test that re-rendering only writes fields whose HTML changed"""
+    with AnkiEmpty() as a:
+        a.add_notes_from_file(write_notes(tmp_path))
+        nid = sorted(a.find_note_ids('deck:*'))[3]
+        note = a.col.getNote(nid)
+        note.fields[0] = note.fields[0].replace('<em>', '<i>')
+        note.flush()
+
+        progress = []
+        stats = a.transform_fields('deck:*', rerender_markdown, jobs=2,
+                                   progress=progress.append, chunk_size=2)
+        assert sum(progress) == stats['notes'] == 5
+        assert stats['changed'] == stats['fields'] == 1
+        assert '<em>' in a.col.getNote(nid).fields[0]
+        assert verify(a, 'deck:*', print)['drifting'] == 0